@@ -1,82 +1,300 @@
-from flask import Flask, request, jsonify, send_from_directory
-from PIL import Image
-import io
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+import hmac
+import json
 import sys
 import os
+import time
+from functools import wraps
 
-# Ensure the app can find modules in the current and subdirectories
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'first_aid_ai'))
+# The service modules live in first_aid_ai/ and import each other by top-level name
+MODULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'first_aid_ai')
+if MODULES_DIR not in sys.path:
+    sys.path.append(MODULES_DIR)
 
 import core
+import imaging
+import metrics
+import sessions
+from inventory_store import VersionConflict
 
 app = Flask(__name__, static_folder='first_aid_ai/static', static_url_path='')
+# Reject oversized uploads before they are read (leave headroom for the form fields)
+app.config['MAX_CONTENT_LENGTH'] = imaging.MAX_UPLOAD_BYTES + 1024 * 1024
+
+# Build indexes and import the SDK ahead of traffic (see core.WARM_UP)
+core.start_warm_up()
+
+# Operator endpoints (/metrics, key health) want "Authorization: Bearer <ADMIN_TOKEN>";
+# without a token configured they only answer requests from this machine.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+def admin_only(view):
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if ADMIN_TOKEN:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            allowed = hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+        else:
+            allowed = request.remote_addr in LOCAL_ADDRESSES
+        if not allowed:
+            return jsonify({"error": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return guarded
 
 @app.route('/')
 def index():
     return send_from_directory(app.static_folder, 'index.html')
 
+def load_image(image_data, filename):
+    """
+    Downscales and re-encodes an upload once (see imaging.preprocess), returning
+    None if it is missing or invalid. Oversized uploads raise ImageTooLarge.
+    """
+    if not image_data:
+        return None
+    try:
+        with metrics.span("image_decode"):
+            image = imaging.preprocess(image_data)
+        metrics.annotate(image=repr(image))
+        return image
+    except imaging.ImageTooLarge:
+        raise
+    except Exception as img_err:
+        print(f"Warning: Could not process image {filename}: {img_err}")
+        return None # Continue without image if it's invalid
+
+def parse_chat_request():
+    """Reads the /api/chat form fields shared by the blocking and streaming endpoints."""
+    user_message = request.form.get('message', '')
+    language = request.form.get('language', 'English')
+    manual_api_key = request.form.get('api_key', '')
+    history_str = request.form.get('history', '[]')
+    # School/organisation whose protocol set to search (see shards.py)
+    tenant = request.form.get('tenant') or request.headers.get('X-Tenant')
+    session_id = resolve_session_id(request.form.get('session_id'))
+
+    # Extract patient metadata
+    patient_metadata = {
+        "age": request.form.get('age', 'N/A'),
+        "gender": request.form.get('gender', 'N/A'),
+        "location": request.form.get('location', 'N/A'),
+        "duration": request.form.get('duration', 'N/A')
+    }
+
+    image_file = request.files.get('image')
+    image = None
+    if image_file and image_file.filename != '':
+        image = load_image(image_file.read(), image_file.filename)
+
+    return user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id
+
+def resolve_session_id(value):
+    """
+    Clients that send session_id get server-side history (see sessions.py); an
+    empty or unknown-format id starts a new session. No field = legacy `history`.
+    """
+    if value is None:
+        return None
+    return value if sessions.valid_session_id(value) else sessions.new_session_id()
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    with metrics.request_trace("chat"):
+        response, status = _chat()
+        metrics.annotate(status=status)
+        return response, status
+
+def _chat():
     try:
-        user_message = request.form.get('message', '')
-        language = request.form.get('language', 'English')
-        manual_api_key = request.form.get('api_key', '')
-        
-        # Extract patient metadata
-        patient_metadata = {
-            "age": request.form.get('age', 'N/A'),
-            "gender": request.form.get('gender', 'N/A'),
-            "location": request.form.get('location', 'N/A'),
-            "duration": request.form.get('duration', 'N/A')
-        }
-
-        image_file = request.files.get('image')
-        image = None
-        if image_file and image_file.filename != '':
-            try:
-                image_data = image_file.read()
-                if image_data:
-                    image = Image.open(io.BytesIO(image_data))
-                    image.load() # Verify it's a real image
-                    print(f"Successfully loaded image: {image_file.filename}")
-            except Exception as img_err:
-                print(f"Warning: Could not process image {image_file.filename}: {img_err}")
-                image = None # Continue without image if it's invalid
+        user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id = parse_chat_request()
 
         if not user_message and not image:
             return jsonify({"error": "No message or image provided"}), 400
 
-        print(f"Generating response for: {user_message[:50]}...")
-        result = core.generate_response(user_message, image, language, patient_metadata, manual_api_key, history_str)
+        metrics.annotate(query_chars=len(user_message), language=language, tenant=tenant)
+        result = core.generate_response(user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id)
+        if session_id:
+            result = dict(result, session_id=session_id)
         
         if "error" in result:
+             metrics.annotate(error=result["error"])
+             if result.get("shed"):
+                 # Turned away under load (see scheduler.py); clients should back off and retry
+                 response = jsonify(result)
+                 response.headers["Retry-After"] = str(result["retry_after"])
+                 return response, 503
              return jsonify(result), 500
              
-        return jsonify(result)
+        return jsonify(result), 200
+
+    except (imaging.ImageTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        metrics.annotate(error=str(e))
+        return jsonify({"error": str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Server-Sent Events version of /api/chat (one `data:` JSON event per chunk)."""
+    request_started = time.perf_counter()
+    try:
+        user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id = parse_chat_request()
+    except (imaging.ImageTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    if not user_message and not image:
+        return jsonify({"error": "No message or image provided"}), 400
+
+    def events():
+        # The trace lives in the generator so it covers the whole stream
+        with metrics.request_trace("chat_stream") as trace:
+            trace.started = request_started
+            metrics.annotate(query_chars=len(user_message), language=language, tenant=tenant, status=200)
+            try:
+                for event in core.generate_response_stream(user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id):
+                    if session_id and event["type"] == "meta":
+                        event = dict(event, session_id=session_id)
+                    if event["type"] == "error":
+                        metrics.annotate(status=503 if event.get("shed") else 500, error=event["error"])
+                    yield f"data: {json.dumps(event)}\n\n"
+            except Exception as e:
+                metrics.annotate(status=500, error=str(e))
+                yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Load balancer readiness: 503 until this worker's indexes are warm
+    state = core.readiness()
+    return jsonify(state), 200 if state["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+@admin_only
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(dict(core.response_cache.stats(), singleflight=core.inflight.stats()))
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(core.request_scheduler.stats())
+
+@app.route('/api/sessions/stats', methods=['GET'])
+def session_stats():
+    return jsonify(core.session_store.stats())
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def end_session(session_id):
+    # "New case" in the UI: forget the conversation right away instead of waiting for the TTL
+    core.session_store.delete(session_id)
+    return jsonify({"deleted": session_id})
+
+@app.route('/api/keys/stats', methods=['GET'])
+@admin_only
+def key_stats():
+    return jsonify(core.key_manager.stats())
+
+@app.route('/api/offline/stats', methods=['GET'])
+def offline_stats():
+    # Share of answers served without Gemini (fast path + degraded fallback), per worker
+    return jsonify(core.offline_responder.stats())
+
+@app.route('/api/content', methods=['GET'])
+def content_status():
+    # Polls the files too, so this doubles as a "pick up my edit now" check
+    core.content.current()
+    return jsonify(dict(core.content.stats(), shards=core.shard_router.stats()))
+
+def _inventory_payload(snapshot):
+    return {
+        "medicines": snapshot.get("medicines", []),
+        "equipment": snapshot.get("equipment", []),
+        "items": snapshot.get("items", []),
+        "version": snapshot.get("version"),
+    }
+
+def _expected_version():
+    """Optional optimistic concurrency: If-Match: "inv-<version>". Any other tag can never match."""
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    for tag in if_match.as_set():
+        if tag.startswith('inv-') and tag[4:].isdigit():
+            return int(tag[4:])
+    raise VersionConflict(f'If-Match must be an inventory ETag such as "{core.inventory_store.etag()}"')
+
+def _versioned_response(payload, version, status=200):
+    response = jsonify(payload)
+    response.status_code = status
+    response.set_etag(core.inventory_store.etag(version))
+    return response
+
 @app.route('/api/inventory', methods=['GET', 'POST'])
 def inventory():
-    import json
-    path = 'first_aid_ai/inventory.json'
+    store = core.inventory_store
     if request.method == 'GET':
         try:
-            with open(path, 'r') as f:
-                return jsonify(json.load(f))
-        except:
+            snapshot = store.snapshot()
+            etag = store.etag(snapshot["version"])
+            if request.if_none_match.contains(etag):
+                return '', 304, {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+            response = _versioned_response(_inventory_payload(snapshot), snapshot["version"])
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        except Exception:
             return jsonify({"medicines": [], "equipment": []})
     else:
+        # Whole-inventory replace (kept for older clients); prefer the item endpoints
         try:
-            data = request.json
-            with open(path, 'w') as f:
-                json.dump(data, f, indent=4)
-            return jsonify({"status": "success"})
+            _, version = store.replace(request.json, expected_version=_expected_version())
+            return _versioned_response({"status": "success", "version": version}, version)
+        except VersionConflict as e:
+            return jsonify({"error": str(e)}), 412
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+@app.route('/api/inventory/items', methods=['POST'])
+def add_inventory_item():
+    data = request.get_json(silent=True) or {}
+    try:
+        item, version = core.inventory_store.add(
+            data.get('name', ''), data.get('kind', 'medicines'), expected_version=_expected_version())
+        return _versioned_response({"item": item, "version": version}, version, 201)
+    except VersionConflict as e:
+        return jsonify({"error": str(e)}), 412
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/inventory/items/<int:item_id>', methods=['PATCH', 'DELETE'])
+def inventory_item(item_id):
+    store = core.inventory_store
+    try:
+        if request.method == 'DELETE':
+            _, version = store.remove(item_id, expected_version=_expected_version())
+            return _versioned_response({"status": "deleted", "version": version}, version)
+        data = request.get_json(silent=True) or {}
+        item, version = store.patch(item_id, name=data.get('name'), kind=data.get('kind'),
+                                    expected_version=_expected_version())
+        return _versioned_response({"item": item, "version": version}, version)
+    except KeyError:
+        return jsonify({"error": f"Inventory item {item_id} not found"}), 404
+    except VersionConflict as e:
+        return jsonify({"error": str(e)}), 412
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     # Listen on all interfaces
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,142 @@
+# ASGI entry point for the async serving mode.
+# /api/chat and /api/chat/stream run natively async (non-blocking Gemini I/O,
+# optional hedged keys on /api/chat); every other route is served by the
+# regular Flask app.
+#
+# Run with: gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2
+import json
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, load_image, resolve_session_id
+import core
+import imaging
+import metrics
+
+# Same request ceiling as Flask's MAX_CONTENT_LENGTH: the image plus room for the form fields
+MAX_BODY_BYTES = imaging.MAX_UPLOAD_BYTES + 1024 * 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+
+async def chat(request):
+    with metrics.request_trace("chat_async"):
+        response = await _chat(request)
+        metrics.annotate(status=response.status_code)
+        return response
+
+
+async def read_upload(upload, max_bytes=None):
+    """Reads an uploaded file in chunks, raising ImageTooLarge as soon as it passes max_bytes."""
+    max_bytes = max_bytes or imaging.MAX_UPLOAD_BYTES
+    chunks, size = [], 0
+    while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+        size += len(chunk)
+        if size > max_bytes:
+            raise imaging.ImageTooLarge(f"Image is over the {max_bytes // 1024} KB limit")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def parse_chat_form(request):
+    """Reads the chat form fields shared by the blocking and streaming endpoints."""
+    length = request.headers.get('content-length', '')
+    if length.isdigit() and int(length) > MAX_BODY_BYTES:
+        # Refuse before Starlette spools the multipart body to disk
+        raise imaging.ImageTooLarge(f"Request is {int(length) // 1024} KB; the limit is {MAX_BODY_BYTES // 1024} KB")
+    form = await request.form()
+    user_message = form.get('message', '')
+    language = form.get('language', 'English')
+    manual_api_key = form.get('api_key', '')
+    history_str = form.get('history', '[]')
+    tenant = form.get('tenant') or request.headers.get('x-tenant')
+    session_id = resolve_session_id(form.get('session_id'))
+
+    patient_metadata = {
+        "age": form.get('age', 'N/A'),
+        "gender": form.get('gender', 'N/A'),
+        "location": form.get('location', 'N/A'),
+        "duration": form.get('duration', 'N/A')
+    }
+
+    image = None
+    image_file = form.get('image')
+    if image_file is not None and getattr(image_file, 'filename', ''):
+        image_data = await read_upload(image_file)
+        # Decoding is CPU-bound, keep it off the event loop
+        image = await run_in_threadpool(load_image, image_data, image_file.filename)
+
+    return user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id
+
+
+async def _chat(request):
+    try:
+        user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id = await parse_chat_form(request)
+
+        if not user_message and not image:
+            return JSONResponse({"error": "No message or image provided"}, status_code=400)
+
+        metrics.annotate(query_chars=len(user_message), language=language, tenant=tenant)
+        result = await core.generate_response_async(user_message, image, language, patient_metadata, manual_api_key, history_str,
+                                                    tenant=tenant, session_id=session_id)
+        if session_id:
+            result = dict(result, session_id=session_id)
+
+        if "error" in result:
+            metrics.annotate(error=result["error"])
+            if result.get("shed"):
+                return JSONResponse(result, status_code=503, headers={"Retry-After": str(result["retry_after"])})
+            return JSONResponse(result, status_code=500)
+
+        return JSONResponse(result)
+
+    except imaging.ImageTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except Exception as e:
+        metrics.annotate(error=str(e))
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def chat_stream(request):
+    """Server-Sent Events version of /api/chat, streamed without holding a threadpool thread."""
+    request_started = time.perf_counter()
+    try:
+        user_message, image, language, patient_metadata, manual_api_key, history_str, tenant, session_id = await parse_chat_form(request)
+    except imaging.ImageTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    if not user_message and not image:
+        return JSONResponse({"error": "No message or image provided"}, status_code=400)
+
+    async def events():
+        # The trace lives in the generator so it covers the whole stream
+        with metrics.request_trace("chat_stream_async") as trace:
+            trace.started = request_started
+            metrics.annotate(query_chars=len(user_message), language=language, tenant=tenant, status=200)
+            try:
+                async for event in core.generate_response_stream_async(user_message, image, language, patient_metadata, manual_api_key,
+                                                                       history_str, tenant, session_id):
+                    if session_id and event["type"] == "meta":
+                        event = dict(event, session_id=session_id)
+                    if event["type"] == "error":
+                        metrics.annotate(status=503 if event.get("shed") else 500, error=event["error"])
+                    yield f"data: {json.dumps(event)}\n\n"
+            except Exception as e:
+                metrics.annotate(status=500, error=str(e))
+                yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type='text/event-stream', headers=headers)
+
+
+app = Starlette(routes=[
+    Route('/api/chat', chat, methods=['POST']),
+    Route('/api/chat/stream', chat_stream, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
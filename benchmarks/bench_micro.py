@@ -0,0 +1,179 @@
+"""
+Microbenchmarks for the local (non-model) hot path over synthetic knowledge
+bases: index build, get_relevant_context, prompt assembly (cold and warm
+PromptBuilder) and image preprocessing of a phone-sized photo.
+
+    python benchmarks/bench_micro.py --sizes 10,1000,100000 --queries 500
+    python benchmarks/bench_micro.py --json-out before.json   # keep a baseline
+    python benchmarks/bench_micro.py --compare before.json    # flag regressions
+
+No network and no API key are needed.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'first_aid_ai'))
+
+import core  # noqa: E402
+import imaging  # noqa: E402
+import prompts  # noqa: E402
+from benchstats import compare, percentile  # noqa: E402
+from content import ContentSnapshot  # noqa: E402
+
+INJURIES = ["burn", "cut", "scrape", "sprain", "fracture", "bruise", "sting", "bite", "bleed",
+            "rash", "blister", "splinter", "fever", "faint", "choke", "seizure", "nosebleed",
+            "allergy", "asthma", "concussion", "dislocation", "cramp", "sunburn", "frostbite"]
+PARTS = ["head", "face", "eye", "nose", "mouth", "neck", "shoulder", "chest", "stomach", "arm",
+         "elbow", "wrist", "hand", "finger", "hip", "thigh", "knee", "leg", "ankle", "foot"]
+CAUSES = ["playground", "football", "stairs", "kitchen", "science lab", "bee", "dog", "bicycle",
+          "swing", "gym", "art class", "garden", "bus", "classroom", "lunch", "field trip"]
+ACTIONS = ["Keep the student calm", "Wash hands and put on gloves", "Apply gentle pressure with gauze",
+           "Cool under running water for 10 minutes", "Cover with a sterile dressing",
+           "Apply a cold compress for 15 minutes", "Support the limb with a sling",
+           "Check breathing and response", "Call the school nurse", "Record the incident"]
+FLAGS = ["Not breathing", "Unconscious", "Bleeding does not stop after 10 minutes",
+         "Swelling of face or throat", "Severe pain", "Bone visible"]
+
+
+def synthetic_kb(size, rng):
+    protocols = []
+    for i in range(size):
+        injury, part, cause = rng.choice(INJURIES), rng.choice(PARTS), rng.choice(CAUSES)
+        protocols.append({
+            "id": f"p{i}",
+            "title": f"{injury.title()} on the {part} ({cause} #{i})",
+            "keywords": [injury, f"{injury} {part}", f"{part} {injury}", cause, f"case{i}"],
+            "steps": rng.sample(ACTIONS, 4),
+            "red_flags": rng.sample(FLAGS, 2),
+        })
+    return {"metadata": {"language": "English", "synthetic": True}, "protocols": protocols}
+
+
+def synthetic_queries(count, rng):
+    templates = ["my student has a {i} on the {p}", "{i} {p} after {c}", "what do I do for a {p} {i}",
+                 "kid hurt his {p} at the {c}, looks like a {i}", "{i}"]
+    return [rng.choice(templates).format(i=rng.choice(INJURIES), p=rng.choice(PARTS), c=rng.choice(CAUSES))
+            for _ in range(count)]
+
+
+def synthetic_photo(width, height, rng):
+    """Noisy 12 MP JPEG, so the encoder can't cheat on a flat colour."""
+    from PIL import Image
+    tile = Image.frombytes("RGB", (256, 256), bytes(rng.getrandbits(8) for _ in range(256 * 256 * 3)))
+    image = Image.new("RGB", (width, height))
+    for x in range(0, width, 256):
+        for y in range(0, height, 256):
+            image.paste(tile, (x, y))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=92)
+    return out.getvalue()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(name, size, samples):
+    return {
+        "bench": name,
+        "size": size,
+        "n": len(samples),
+        "p50_ms": round(percentile(samples, 50), 4),
+        "p95_ms": round(percentile(samples, 95), 4),
+        "max_ms": round(max(samples), 4),
+    }
+
+
+def bench_knowledge_base(size, args, rng):
+    kb = synthetic_kb(size, rng)
+    kb_text = json.dumps(kb)
+    queries = synthetic_queries(args.queries, rng)
+    rows = []
+
+    started = time.perf_counter()
+    snapshot = ContentSnapshot(kb_text, kb, "bench system prompt")
+    rows.append(summarize("index_build", size, [(time.perf_counter() - started) * 1000]))
+
+    it = iter(queries * 2)
+    rows.append(summarize("get_relevant_context", size,
+                          timed(lambda: core.get_relevant_context(next(it), snapshot=snapshot), len(queries))))
+
+    inventory = core.load_inventory()
+    matches = [core.get_relevant_context(q, snapshot=snapshot) for q in queries[:50]]
+    history = [{"role": "user" if i % 2 == 0 else "model", "text": f"turn {i} " + "x " * 40}
+               for i in range(12)]
+
+    def build(builder, i):
+        builder.build(queries[i % len(queries)], "English", {"age": "9"}, history, matches[i % len(matches)],
+                      inventory, core.inventory_version(), snapshot.version, False, snapshot.rendered)
+
+    counter = iter(range(10 ** 9))
+    rows.append(summarize("prompt_build_cold", size,
+                          timed(lambda: build(prompts.PromptBuilder(), next(counter)), args.prompt_repeat)))
+    warm = prompts.PromptBuilder()
+    build(warm, 0)
+    rows.append(summarize("prompt_build_warm", size,
+                          timed(lambda: build(warm, next(counter)), args.prompt_repeat)))
+    return rows
+
+
+def bench_image(args, rng):
+    width, height = (int(v) for v in args.photo.split("x"))
+    photo = synthetic_photo(width, height, rng)
+    samples = timed(lambda: imaging.preprocess(photo, max_bytes=len(photo) + 1), args.image_repeat)
+    row = summarize("image_preprocess", f"{width}x{height}", samples)
+    row["input_kb"] = len(photo) // 1024
+    return [row]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000", help="comma-separated protocol counts")
+    parser.add_argument("--queries", type=int, default=300, help="retrieval queries per knowledge base")
+    parser.add_argument("--prompt-repeat", type=int, default=300)
+    parser.add_argument("--image-repeat", type=int, default=10)
+    parser.add_argument("--photo", default="4000x3000", help="synthetic photo size (WIDTHxHEIGHT)")
+    parser.add_argument("--skip-image", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json-out", help="write results as JSON (a baseline for --compare)")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --json-out run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="p50 slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    core.metrics.LOG_FORMAT = "off"
+    rows = []
+    print(f"{'bench':<22} {'size':>10} {'n':>6} {'p50_ms':>10} {'p95_ms':>10} {'max_ms':>10}")
+    quiet = io.StringIO()  # index/cache chatter from core
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        with contextlib.redirect_stdout(quiet):
+            size_rows = bench_knowledge_base(size, args, rng)
+        for row in size_rows:
+            print(f"{row['bench']:<22} {row['size']:>10} {row['n']:>6} {row['p50_ms']:>10} {row['p95_ms']:>10} {row['max_ms']:>10}")
+        rows += size_rows
+    if not args.skip_image:
+        for row in bench_image(args, rng):
+            print(f"{row['bench']:<22} {row['size']:>10} {row['n']:>6} {row['p50_ms']:>10} {row['p95_ms']:>10} {row['max_ms']:>10}")
+            rows.append(row)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(rows, f, indent=2)
+    if args.compare and compare(rows, args.compare, args.tolerance, key_fields=("bench", "size")):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Cold-start benchmark for the Flask entry point.
+
+Each run imports `app` in a fresh interpreter under `python -X importtime`,
+so nothing is shared with earlier runs except the OS file cache. Reports the
+import wall time, the slowest top-level imports, and how long warm_up() (the
+work core.WARM_UP otherwise does in the background) takes on top of that.
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --json-out before.json   # keep a baseline
+    python benchmarks/bench_startup.py --compare before.json    # flag regressions
+
+No network and no API key are needed.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchstats import compare, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child: import the app without its own warm-up, then warm explicitly
+CHILD = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+import core
+state = core.warm_up()
+print("BENCH " + json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "warm_up_ms": (time.perf_counter() - imported) * 1000,
+    "steps_ms": state["steps_ms"],
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """{module: cumulative_us} for the modules imported directly by `import app`."""
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header row
+        # One space after the bar, then two more per nesting level. Children
+        # are printed before their parent, so collect level 1 until "app" closes them.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == "app":
+                return children
+            children = {}
+    return {}
+
+
+def run_once(env):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=120)
+    result = next((json.loads(line[6:]) for line in proc.stdout.splitlines() if line.startswith("BENCH ")), None)
+    if proc.returncode != 0 or result is None:
+        raise SystemExit(f"import failed (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+    result["modules"] = parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--json-out", help="write results as JSON (a baseline for --compare)")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --json-out run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="p50 slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    env = dict(os.environ, WARM_UP="off", LOG_FORMAT="off")
+    runs = [run_once(env) for _ in range(args.runs)]
+
+    rows = []
+    for bench in ("import_ms", "warm_up_ms"):
+        samples = [r[bench] for r in runs]
+        rows.append({"bench": bench[:-3], "n": len(samples), "p50_ms": round(percentile(samples, 50), 1),
+                     "max_ms": round(max(samples), 1)})
+    print(f"{'bench':<12} {'n':>4} {'p50_ms':>10} {'max_ms':>10}")
+    for row in rows:
+        print(f"{row['bench']:<12} {row['n']:>4} {row['p50_ms']:>10} {row['max_ms']:>10}")
+
+    last = runs[-1]
+    print("\nwarm_up steps (last run, ms): " + ", ".join(f"{k}={v}" for k, v in last["steps_ms"].items()))
+    print("\nslowest imports under `import app` (last run):")
+    for module, us in sorted(last["modules"].items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:>8.1f} ms  {module}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(rows, f, indent=2)
+    if args.compare and compare(rows, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
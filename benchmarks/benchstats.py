@@ -0,0 +1,38 @@
+"""
+Helpers shared by the benchmark scripts: nearest-rank percentiles and the
+p50-against-a-baseline regression check behind their --compare flag.
+"""
+import json
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def compare(rows, baseline_path, tolerance, key_fields=("bench",)):
+    """
+    Prints each row's p50 next to the baseline's (matched on key_fields) and
+    returns how many slowed down by more than tolerance.
+    """
+    def key(row):
+        return tuple(str(row[field]) for field in key_fields)
+
+    with open(baseline_path) as f:
+        baseline = {key(r): r for r in json.load(f)}
+    regressions = 0
+    header = f"{key_fields[0]:<22}" + "".join(f" {field:>10}" for field in key_fields[1:])
+    print(f"\n{header} {'base p50':>10} {'now p50':>10} {'change':>8}")
+    for row in rows:
+        base = baseline.get(key(row))
+        if not base or not base["p50_ms"]:
+            continue
+        change = row["p50_ms"] / base["p50_ms"] - 1
+        flag = "  REGRESSION" if change > tolerance else ""
+        regressions += bool(flag)
+        label = f"{row[key_fields[0]]:<22}" + "".join(f" {row[field]:>10}" for field in key_fields[1:])
+        print(f"{label} {base['p50_ms']:>10} {row['p50_ms']:>10} {change:>+8.0%}{flag}")
+    return regressions
@@ -0,0 +1,293 @@
+"""
+Open-loop load generator for /api/chat and /api/inventory.
+
+Requests are fired on a fixed schedule (--rps) whether or not earlier ones have
+finished, and latency is measured from the scheduled send time, so a stalled
+server shows up as queueing instead of being hidden by a slower client
+(coordinated omission). Reports p50/p95/p99, throughput and errors by status.
+With `--mix chat=0.9,critical=0.1` emergency questions are reported as their
+own row, showing whether the scheduler keeps them fast while routine chat
+is being shed.
+
+Against a running server:
+
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000 --rps 20 --duration 30
+
+Comparing worker configurations against the local mock Gemini (no quota used).
+Each --config starts its command with {port} filled in, waits until it
+answers, runs the load and stops it:
+
+    python benchmarks/loadgen.py --mock --mock-latency-ms 1200 --rps 30 --duration 20 \\
+        --config "sync-2x4=gunicorn app:app -b 127.0.0.1:{port} -w 2 --threads 4" \\
+        --config "sync-4x8=gunicorn app:app -b 127.0.0.1:{port} -w 4 --threads 8" \\
+        --config "asgi-2=uvicorn asgi:app --port {port} --workers 2"
+"""
+import argparse
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from benchstats import percentile  # noqa: E402
+
+# Mix of questions the offline path answers, ones that need the model, and follow-ups
+QUERIES = [
+    "nosebleed",
+    "bee sting on the arm",
+    "my student fell in the playground and hurt his knee, it is bleeding a little",
+    "a girl feels dizzy after running in the heat, what should I do",
+    "child burned her hand on a hot pan in the science lab",
+    "boy twisted his ankle playing football and can't walk",
+    "student has a rash and swollen lips after lunch",
+    "kid got hit on the head with a ball and has a headache",
+]
+
+# Emergencies the scheduler should put first (--mix chat=0.9,critical=0.1)
+CRITICAL_QUERIES = [
+    "a student collapsed in the gym and is not breathing",
+    "boy is choking on food in the canteen",
+    "girl is unconscious after falling from the climbing frame",
+    "student having a seizure in class, lips turning blue",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows = []  # (endpoint, status, latency_ms, finished_at)
+
+    def add(self, endpoint, status, latency_ms):
+        with self._lock:
+            self.rows.append((endpoint, status, latency_ms, time.perf_counter()))
+
+
+def chat_request(base_url, args, rng, queries=QUERIES):
+    query = rng.choice(queries)
+    if rng.random() < args.unique:
+        query += f" (case {rng.getrandbits(32):x})"  # defeats the response cache and coalescing
+    form = {
+        "message": query,
+        "language": "English",
+        "age": str(rng.randint(6, 17)),
+        "history": "[]",
+        "api_key": args.api_key,
+    }
+    if args.tenant:
+        form["tenant"] = args.tenant
+    data = urllib.parse.urlencode(form).encode()
+    return urllib.request.Request(f"{base_url}/api/chat", data=data, method="POST")
+
+
+def inventory_request(base_url, args, rng):
+    return urllib.request.Request(f"{base_url}/api/inventory", method="GET")
+
+
+def critical_request(base_url, args, rng):
+    return chat_request(base_url, args, rng, CRITICAL_QUERIES)
+
+
+BUILDERS = {"chat": chat_request, "critical": critical_request, "inventory": inventory_request}
+
+
+def send(endpoint, req, scheduled, timeout, recorder):
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except Exception as e:  # connection refused/reset, timeout
+        status = type(e).__name__
+    recorder.add(endpoint, status, (time.perf_counter() - scheduled) * 1000)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in BUILDERS:
+            raise SystemExit(f"unknown endpoint in --mix: {name!r} (expected {', '.join(BUILDERS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_load(base_url, args):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    recorder = Recorder()
+    total = int(args.rps * args.duration)
+    interval = 1.0 / args.rps
+
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as pool:
+        started = time.perf_counter()
+        for i in range(total):
+            scheduled = started + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = rng.choices(names, weights)[0]
+            req = BUILDERS[endpoint](base_url, args, rng)
+            pool.submit(send, endpoint, req, scheduled, args.timeout, recorder)
+    elapsed = time.perf_counter() - started
+    return summarize(recorder.rows, elapsed, args)
+
+
+def summarize(rows, elapsed, args):
+    report = {"offered_rps": args.rps, "elapsed_s": round(elapsed, 2), "endpoints": {}}
+    for endpoint in sorted({r[0] for r in rows}) + ["all"]:
+        subset = [r for r in rows if endpoint in ("all", r[0])]
+        ok = [r[2] for r in subset if r[1] == 200]
+        statuses = {}
+        for r in subset:
+            statuses[str(r[1])] = statuses.get(str(r[1]), 0) + 1
+        report["endpoints"][endpoint] = {
+            "requests": len(subset),
+            "ok": len(ok),
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(ok, 50), 1),
+            "p95_ms": round(percentile(ok, 95), 1),
+            "p99_ms": round(percentile(ok, 99), 1),
+            "statuses": statuses,
+        }
+    return report
+
+
+def wait_ready(base_url, proc, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/api/inventory", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except Exception:
+            time.sleep(0.25)
+    raise RuntimeError(f"server at {base_url} not ready after {timeout}s")
+
+
+def start_mock(args):
+    import mock_gemini
+    mock_args = argparse.Namespace(
+        host="127.0.0.1", port=args.mock_port or free_port(), latency_ms=args.mock_latency_ms,
+        ttft_ms=args.mock_latency_ms / 3, chunk_ms=60, chunks=8, error_ms=80, jitter=0.25,
+        p403=args.mock_p403, p429=args.mock_p429, p500=args.mock_p500, p_malformed=0.0, verbose=False,
+    )
+    server, stats = mock_gemini.serve(mock_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats, f"http://127.0.0.1:{mock_args.port}"
+
+
+def spawn(command, port, env, log):
+    argv = shlex.split(command.format(port=port))
+    return subprocess.Popen(argv, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+
+def print_report(name, report):
+    print(f"\n== {name}  (offered {report['offered_rps']} rps for {report['elapsed_s']} s)")
+    print(f"{'endpoint':<10} {'reqs':>6} {'ok':>6} {'rps':>7} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8}  statuses")
+    for endpoint, row in report["endpoints"].items():
+        print(f"{endpoint:<10} {row['requests']:>6} {row['ok']:>6} {row['throughput_rps']:>7} "
+              f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8}  {row['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of an already running server")
+    parser.add_argument("--config", action="append", default=[],
+                        help='NAME=COMMAND to start per run; {port} is replaced (repeatable)')
+    parser.add_argument("--rps", type=float, default=10.0, help="offered load (requests per second)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load per run")
+    parser.add_argument("--mix", default="chat=0.8,inventory=0.2", help="endpoint weights")
+    parser.add_argument("--unique", type=float, default=0.5,
+                        help="fraction of chat queries made unique (cache/coalescing misses)")
+    parser.add_argument("--tenant", default="")
+    parser.add_argument("--api-key", default="", help="sent as the api_key form field")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--max-in-flight", type=int, default=512, help="client-side concurrency cap")
+    parser.add_argument("--ready-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--mock", action="store_true", help="point spawned servers at an in-process mock Gemini")
+    parser.add_argument("--mock-port", type=int, default=0)
+    parser.add_argument("--mock-latency-ms", type=float, default=1200)
+    parser.add_argument("--mock-p403", type=float, default=0.0)
+    parser.add_argument("--mock-p429", type=float, default=0.0)
+    parser.add_argument("--mock-p500", type=float, default=0.0)
+    parser.add_argument("--json-out", help="write all reports as JSON")
+    args = parser.parse_args()
+    if not args.url and not args.config:
+        parser.error("give --url or at least one --config")
+
+    reports = {}
+    if args.url:
+        wait_ready(args.url.rstrip("/"), None, args.ready_timeout)
+        reports["url"] = run_load(args.url.rstrip("/"), args)
+        print_report(args.url, reports["url"])
+
+    env = dict(os.environ, LOG_FORMAT="off")
+    mock = None
+    if args.mock:
+        mock, mock_stats, endpoint = start_mock(args)
+        # Mock keys never reach Google; AIzaBAD* keys would be rejected by the mock
+        env.update(GEMINI_API_ENDPOINT=endpoint, GEMINI_API_KEY=env.get("GEMINI_API_KEY", "AIzaMockKey1"))
+        print(f"Mock Gemini on {endpoint} ({args.mock_latency_ms} ms)")
+
+    for spec in args.config:
+        name, _, command = spec.partition("=")
+        if not command:
+            parser.error(f"--config needs NAME=COMMAND, got {spec!r}")
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        log_path = os.path.join(ROOT, f".loadgen-{name}.log")
+        with open(log_path, "w") as log:
+            try:
+                proc = spawn(command, port, env, log)
+            except OSError as e:
+                print(f"\n== {name}: could not start server: {e}")
+                continue
+            try:
+                wait_ready(base_url, proc, args.ready_timeout)
+                if mock is not None:
+                    mock_stats.reset()
+                report = run_load(base_url, args)
+                if mock is not None:
+                    report["mock"] = mock_stats.snapshot()
+            except RuntimeError as e:
+                print(f"\n== {name}: {e} (see {log_path})")
+                continue
+            finally:
+                os.killpg(proc.pid, 15)
+                proc.wait(timeout=30)
+        reports[name] = report
+        print_report(name, report)
+        if "mock" in report:
+            print(f"   mock: {report['mock']}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
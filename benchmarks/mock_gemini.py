@@ -0,0 +1,259 @@
+"""
+Local stand-in for the Gemini REST API (generateContent / streamGenerateContent).
+
+Latency, jitter, error rates and streaming behaviour are configurable, so the
+app and the load generator can be exercised without network noise or quota:
+
+    python benchmarks/mock_gemini.py --port 8089 --latency-ms 1200 --p429 0.05
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8089 GEMINI_API_KEY=AIzaMock python app.py
+
+JSON-mode requests get a JSON answer (--p-malformed truncates some of them).
+Keys starting with AIzaBAD always get 403 (API_KEY_HTTP_REFERRER_BLOCKED).
+GET /__stats returns request counters; POST /__reset clears them.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROUTE_RE = re.compile(r"^/v1(?:beta)?/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)$")
+
+ANSWER = (
+    "1. Keep the student calm and seated.\n"
+    "2. Follow the protocol steps above.\n"
+    "⚠️ WARNING: Cold compress is missing from inventory. Use a clean cloth with cold water.\n"
+    "[SPOT_ID: 11]\n"
+    "[PROCEDURE: Keep calm, Sit down, Monitor]\n"
+    "[SEARCH: Cold compress]"
+)
+VISION_ANSWER = "cut, knee, bleeding, plaster"
+# Structured output (generationConfig.responseMimeType = application/json)
+JSON_ANSWER = {
+    "answer": "1. Keep the student calm and seated.\n2. Follow the protocol steps above.\n"
+              "⚠️ WARNING: Cold compress is missing from inventory. Use a clean cloth with cold water.",
+    "spot_id": 11,
+    "procedure": ["Keep calm", "Sit down", "Monitor"],
+    "search": ["Cold compress"],
+}
+
+ERRORS = {
+    403: ("PERMISSION_DENIED", "API_KEY_HTTP_REFERRER_BLOCKED: Requests from this referer are blocked."),
+    429: ("RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+    500: ("INTERNAL", "An internal error has occurred."),
+}
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {"requests": 0, "stream": 0, "ok": 0, "403": 0, "429": 0, "500": 0}
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+    def add(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts, in_flight=self.in_flight, max_in_flight=self.max_in_flight)
+
+
+def _prompt_text(body):
+    texts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+
+def _chunk(text, final, prompt_tokens, completion_tokens):
+    payload = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+    if final:
+        payload["candidates"][0]["finishReason"] = "STOP"
+        payload["usageMetadata"] = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": completion_tokens,
+            "totalTokenCount": prompt_tokens + completion_tokens,
+        }
+    return payload
+
+
+def make_handler(args, stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *a):
+            if args.verbose:
+                super().log_message(fmt, *a)
+
+        def _json(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _sleep(self, ms):
+            if ms > 0:
+                time.sleep(ms * random.lognormvariate(0, args.jitter) / 1000)
+
+        def _api_key(self, query):
+            return self.headers.get("x-goog-api-key") or (query.get("key") or [""])[0]
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/__stats":
+                return self._json(200, stats.snapshot())
+            if path.rstrip("/").endswith("/models"):
+                return self._json(200, {"models": [
+                    {"name": f"models/{m}", "supportedGenerationMethods": ["generateContent"]}
+                    for m in ("gemini-1.5-flash", "gemini-flash-latest")
+                ]})
+            self._json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path == "/__reset":
+                stats.reset()
+                return self._json(200, {"ok": True})
+            match = ROUTE_RE.match(url.path)
+            if not match:
+                return self._json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            query = parse_qs(url.query)
+            stream = match.group("method") == "streamGenerateContent"
+            stats.add("requests")
+            if stream:
+                stats.add("stream")
+            stats.enter()
+            try:
+                status = self._pick_error(self._api_key(query))
+                if status:
+                    self._sleep(args.error_ms)
+                    stats.add(str(status))
+                    reason, message = ERRORS[status]
+                    return self._json(status, {"error": {"code": status, "message": message, "status": reason}})
+
+                prompt = _prompt_text(body)
+                text = VISION_ANSWER if "keywords" in prompt.lower() and len(prompt) < 400 else ANSWER
+                config = body.get("generationConfig") or body.get("generation_config") or {}
+                if text == ANSWER and "json" in str(config.get("responseMimeType") or config.get("response_mime_type")):
+                    text = json.dumps(JSON_ANSWER, ensure_ascii=False)
+                    if random.random() < args.p_malformed:
+                        # Typical breakage: code fence plus an answer cut off mid-object
+                        text = "```json\n" + text[:int(len(text) * 0.8)]
+                prompt_tokens = max(1, len(prompt) // 4)
+                completion_tokens = max(1, len(text) // 4)
+                stats.add("ok")
+                if stream:
+                    return self._stream(text, query, prompt_tokens, completion_tokens)
+                self._sleep(args.latency_ms)
+                self._json(200, _chunk(text, True, prompt_tokens, completion_tokens))
+            finally:
+                stats.leave()
+
+        def _pick_error(self, api_key):
+            if api_key.startswith("AIzaBAD"):
+                return 403
+            roll = random.random()
+            for status, rate in ((403, args.p403), (429, args.p429), (500, args.p500)):
+                if roll < rate:
+                    return status
+                roll -= rate
+            return None
+
+        def _stream(self, text, query, prompt_tokens, completion_tokens):
+            sse = (query.get("alt") or [""])[0] == "sse"
+            pieces = _split(text, args.chunks)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write(data):
+                raw = data.encode()
+                self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+                self.wfile.flush()
+
+            self._sleep(args.ttft_ms)
+            if not sse:
+                write("[")
+            for i, piece in enumerate(pieces):
+                if i:
+                    self._sleep(args.chunk_ms)
+                payload = json.dumps(_chunk(piece, i == len(pieces) - 1, prompt_tokens, completion_tokens))
+                if sse:
+                    write(f"data: {payload}\r\n\r\n")
+                else:
+                    write(("," if i else "") + payload)
+            if not sse:
+                write("]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def _split(text, n):
+    n = max(1, n)
+    size = max(1, -(-len(text) // n))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def serve(args):
+    stats = Stats()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, stats))
+    server.daemon_threads = True
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=1200, help="generateContent latency")
+    parser.add_argument("--ttft-ms", type=float, default=400, help="time to first streamed chunk")
+    parser.add_argument("--chunk-ms", type=float, default=60, help="gap between streamed chunks")
+    parser.add_argument("--chunks", type=int, default=8, help="chunks per streamed answer")
+    parser.add_argument("--error-ms", type=float, default=80, help="latency of error responses")
+    parser.add_argument("--jitter", type=float, default=0.25, help="lognormal sigma applied to every delay")
+    parser.add_argument("--p403", type=float, default=0.0)
+    parser.add_argument("--p429", type=float, default=0.0)
+    parser.add_argument("--p500", type=float, default=0.0)
+    parser.add_argument("--p-malformed", type=float, default=0.0, help="share of JSON answers sent truncated")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server, _ = serve(args)
+    print(f"Mock Gemini listening on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms} ms, 403/429/500 = {args.p403}/{args.p429}/{args.p500})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import streamlit as st
 import json
-import google.generativeai as genai
 import os
 from PIL import Image
+import clients
+from inventory_store import InventoryStore
+from content import ContentManager
+from prompts import KEYWORDS_FORMAT, split_image_keywords
 
 # Theme Support (Dark/Light Mode)
 def setup_theme():
@@ -63,42 +66,54 @@ st.set_page_config(
 )
 
 # Constants
-KB_PATH = "knowledge_base.json"
-SYSTEM_PROMPT_PATH = "system_prompt.md"
-INVENTORY_PATH = "inventory.json"
+VISION_MODE = os.getenv("VISION_MODE", "two_pass").lower()
 
-# Load Helpers
-def load_json(path):
-    try:
-        with open(path, "r") as f:
-            return json.load(f)
-    except Exception:
-        return {"protocols": []}
+@st.cache_resource
+def get_inventory_store():
+    return InventoryStore()
 
-def load_text(path):
-    try:
-        with open(path, "r") as f:
-            return f.read()
-    except Exception:
-        return ""
+@st.cache_resource
+def get_content_manager():
+    """Knowledge base + system prompt, compiled once and hot-reloaded when the files change."""
+    return ContentManager()
 
-def get_retrieved_context(query, kb_data):
-    """Simple Keyword RAG"""
-    query = query.lower()
-    matches = []
-    for p in kb_data.get("protocols", []):
-        score = 0
-        if p["title"].lower() in query:
-            score += 5
-        for kw in p["keywords"]:
-            if kw in query:
-                score += 1
+def get_retrieved_context(query, snapshot):
+    """Ranked keyword RAG (same engine as core.get_relevant_context)"""
+    return [p for _, p in snapshot.protocol_index.search(query, top_k=3)]
+
+def format_context(context_items, rendered):
+    if not context_items:
+        return "No specific protocol matched in Knowledge Base. Use general medical safety knowledge based on the image."
+    context_str = "\n### IDENTIFIED PROTOCOLS (Based on Image/Text):\n"
+    for p in context_items:
+        context_str += rendered[p['id']] + "\n"
+    return context_str
+
+def build_final_prompt(inventory_data, context_items, user_msg_content, img_data, rendered, ask_keywords=False):
+    final_prompt = [
+        f"""
+        AVAILABLE INVENTORY (Medicines & Equipment):
+        {json.dumps(inventory_data.get('medicines', []), indent=2)}
+        
+        CONTEXT DATA (Retrieved First Aid Protocols):
+        {format_context(context_items, rendered)}
         
-        if score > 0:
-            matches.append((score, p))
-            
-    matches.sort(key=lambda x: x[0], reverse=True)
-    return [m[1] for m in matches[:3]] # Return top 3
+        USER QUERY: {user_msg_content}
+        
+        TASK:
+        1. Analyze image (if any) and query.
+        2. Use CONTEXT DATA protocols for steps.
+        3. CROSS-REFERENCE with AVAILABLE INVENTORY. 
+        4. Tell the user what to use from inventory.
+        5. If a critical item is missing but needed, WARN specifically.
+        6. Be extremely concise. Action starts now.
+        """,
+    ]
+    if ask_keywords:
+        final_prompt.append(f"LAST LINE: {KEYWORDS_FORMAT}")
+    if img_data:
+        final_prompt.append(img_data)
+    return final_prompt
 
 # UI Layout
 st.title("🚑 First Aid Guardian (School Edition)")
@@ -114,45 +129,39 @@ with st.sidebar:
     
     st.divider()
     st.subheader("📚 Knowledge Base")
-    try:
-        with open(KB_PATH, "r") as f:
-            kb_content = f.read()
-            
-        st.download_button(
-            label="Download Knowledge Base (JSON)",
-            data=kb_content,
-            file_name="knowledge_base.json",
-            mime="application/json"
-        )
-        
-        st.info("To add data: Edit knowledge_base.json and restart app.")
-        
-        if st.checkbox("Show Raw Data"):
-            st.json(load_json(KB_PATH))
-    except FileNotFoundError:
-        st.error(f"Knowledge Base file not found at {KB_PATH}")
+    content = get_content_manager()
+    snapshot = content.current()
+    st.download_button(
+        label="Download Knowledge Base (JSON)",
+        data=snapshot.kb_text,
+        file_name="knowledge_base.json",
+        mime="application/json"
+    )
+
+    st.info(f"Loaded {len(snapshot.protocols)} protocols (version {snapshot.version}). Edits to knowledge_base.json are picked up automatically.")
+    if content.last_error:
+        st.warning(f"Last edit was rejected: {content.last_error}")
+
+    if st.checkbox("Show Raw Data"):
+        st.json(snapshot.knowledge_base)
 
     st.divider()
     st.subheader("🩺 Doctor's Inventory")
     
-    # Medicine/Equipment Management
-    inventory = load_json(INVENTORY_PATH)
-    if not isinstance(inventory, dict): inventory = {"medicines": [], "equipment": []}
+    # Medicine/Equipment Management (shared, versioned store - same data as the web app)
+    store = get_inventory_store()
+    inventory = store.snapshot()
     
     new_med = st.text_input("Add Medicine/Equipment")
     if st.button("Add to Inventory") and new_med:
-        if "medicines" not in inventory: inventory["medicines"] = []
-        inventory["medicines"].append(new_med)
-        with open(INVENTORY_PATH, "w") as f:
-            json.dump(inventory, f, indent=4)
+        store.add(new_med, "medicines")
         st.success(f"Added: {new_med}")
         st.rerun()
 
     if st.checkbox("Show Inventory"):
         st.write(inventory.get("medicines", []))
         if st.button("Clear Inventory"):
-            with open(INVENTORY_PATH, "w") as f:
-                json.dump({"medicines": [], "equipment": []}, f)
+            store.clear()
             st.rerun()
 
     setup_theme()
@@ -211,19 +220,21 @@ if prompt or img_data:
             message_placeholder.error("⚠️ Please enter your Gemini API Key in the sidebar.")
         else:
             try:
-                genai.configure(api_key=api_key_input)
-                model = genai.GenerativeModel('gemini-flash-latest')
-                
                 # Load Resources
-                kb_data = load_json(KB_PATH)
-                system_instruction = load_text(SYSTEM_PROMPT_PATH)
-                inventory_data = load_json(INVENTORY_PATH)
+                snapshot = get_content_manager().current()
+                system_instruction = snapshot.system_prompt
+                inventory_data = get_inventory_store().snapshot()
+
+                # Pooled per-key model; the system prompt is registered once as its system instruction
+                model = clients.model_pool.get(api_key_input, 'gemini-flash-latest', system_instruction=system_instruction)
 
                 # --- Dynamic Context Retrieval ---
                 search_query = user_msg_content
+                # Single-call mode: skip the separate vision request, the answer call reports keywords too
+                single_call = img_data is not None and VISION_MODE == "single"
                 
                 # If image exists, ask Gemini to describe it first to get better keywords for search
-                if img_data:
+                if img_data and not single_call:
                     with st.spinner("Analyzing image patterns..."):
                         vision_prompt = """
                         Identify the medical situation, injury, or any items visible in this image. 
@@ -231,53 +242,31 @@ if prompt or img_data:
                         If there are objects, list them (e.g., 'medicine bottle', 'bandage').
                         Return only 3-5 descriptive keywords.
                         """
-                        vision_response = model.generate_content([vision_prompt, img_data])
+                        vision_model = clients.model_pool.get(api_key_input, 'gemini-flash-latest')
+                        vision_response = vision_model.generate_content([vision_prompt, img_data])
                         image_keywords = vision_response.text
                         search_query = f"{user_msg_content} {image_keywords}"
                         # st.caption(f"Detected: {image_keywords}") # Optional Debug
 
                 # Retrieve Context based on Text + Image Keywords
-                context_items = get_retrieved_context(search_query, kb_data)
-                
-                context_str = ""
-                if context_items:
-                    context_str = "\n### IDENTIFIED PROTOCOLS (Based on Image/Text):\n"
-                    for p in context_items:
-                        context_str += f"- PROTOCOL: {p['title']} ({p['grade_level']})\n"
-                        context_str += f"  STEPS: {'; '.join(p['steps'])}\n"
-                        context_str += f"  RED FLAGS: {', '.join(p['red_flags'])}\n"
-                else:
-                    context_str = "No specific protocol matched in Knowledge Base. Use general medical safety knowledge based on the image."
+                context_items = get_retrieved_context(search_query, snapshot)
 
                 # --- Final Generation ---
-                final_prompt = [
-                    f"""
-                    system_instruction: {system_instruction}
-                    
-                    AVAILABLE INVENTORY (Medicines & Equipment):
-                    {json.dumps(inventory_data.get('medicines', []), indent=2)}
-                    
-                    CONTEXT DATA (Retrieved First Aid Protocols):
-                    {context_str}
-                    
-                    USER QUERY: {user_msg_content}
-                    
-                    TASK:
-                    1. Analyze image (if any) and query.
-                    2. Use CONTEXT DATA protocols for steps.
-                    3. CROSS-REFERENCE with AVAILABLE INVENTORY. 
-                    4. Tell the user what to use from inventory.
-                    5. If a critical item is missing but needed, WARN specifically.
-                    6. Be extremely concise. Action starts now.
-                    """,
-                ]
-                
-                if img_data:
-                    final_prompt.append(img_data)
+                final_prompt = build_final_prompt(inventory_data, context_items, user_msg_content, img_data, snapshot.rendered, ask_keywords=single_call)
                 
                 with st.spinner("Generating First Aid advice..."):
                     response = model.generate_content(final_prompt)
                     full_response = response.text
+
+                if single_call:
+                    full_response, image_keywords = split_image_keywords(full_response)
+                    if image_keywords:
+                        detected = get_retrieved_context(f"{user_msg_content} {image_keywords}", snapshot)
+                        # Second pass only when the image points at a protocol we didn't use
+                        if detected and detected[0]["id"] not in {p["id"] for p in context_items}:
+                            with st.spinner("Refining advice for what the image shows..."):
+                                final_prompt = build_final_prompt(inventory_data, detected, user_msg_content, img_data, snapshot.rendered)
+                                full_response = model.generate_content(final_prompt).text
                     
                 message_placeholder.markdown(full_response)
                 st.session_state.messages.append({"role": "assistant", "content": full_response})
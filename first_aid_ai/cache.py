@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from retrieval import MARKS
+
+# Response Cache
+# In-process LRU + TTL tier with a memory cap, plus an optional SQLite tier
+# (RESPONSE_CACHE_DB) that all gunicorn workers on the machine share.
+
+DEFAULT_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+DEFAULT_MAX_BYTES = int(float(os.getenv("RESPONSE_CACHE_MAX_MB", "32")) * 1024 * 1024)
+
+_PUNCT_RE = re.compile(rf"[^\w\s{MARKS}]")  # keeps vowel signs, so Hindi questions don't collapse together
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    text = _PUNCT_RE.sub(" ", (text or "").lower())
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def bucket_age(age):
+    """Collapse exact ages into the bands that change first aid advice."""
+    try:
+        age = int(float(str(age).strip()))
+    except (TypeError, ValueError):
+        return "N/A"
+    if age <= 5:
+        return "0-5"
+    if age <= 10:
+        return "6-10"
+    if age <= 14:
+        return "11-14"
+    if age <= 18:
+        return "15-18"
+    return "adult"
+
+
+def bucket_metadata(patient_metadata):
+    meta = patient_metadata or {}
+    return {
+        "age": bucket_age(meta.get("age")),
+        "gender": normalize_query(str(meta.get("gender", "N/A"))) or "n a",
+        "location": normalize_query(str(meta.get("location", "N/A"))) or "n a",
+        "duration": normalize_query(str(meta.get("duration", "N/A"))) or "n a",
+    }
+
+
+def make_key(query, language, patient_metadata, protocol_ids, inventory_version, extra=None):
+    payload = {
+        "q": normalize_query(query),
+        "lang": (language or "English").lower(),
+        "meta": bucket_metadata(patient_metadata),
+        "protocols": list(protocol_ids),
+        "inv": inventory_version,
+        "extra": extra,
+    }
+    raw = json.dumps(payload, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, db_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if db_path:
+            self._init_db()
+
+    # --- SQLite tier ---
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """Forked worker: open its own SQLite connections instead of reusing the parent's."""
+        self._local = threading.local()
+
+    def _init_db(self):
+        try:
+            db_dir = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(db_dir, exist_ok=True)
+            conn = self._db()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.commit()
+        except Exception as e:
+            print(f"Response cache: SQLite tier disabled ({e})")
+            self.db_path = None
+
+    def _db_get(self, key, now):
+        try:
+            row = self._db().execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        except Exception:
+            return None
+        if not row or row[1] < now:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _db_set(self, key, raw, expires_at):
+        try:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, raw, expires_at),
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+        except Exception as e:
+            print(f"Response cache: SQLite write failed ({e})")
+
+    # --- Memory tier ---
+    def _store(self, key, value, size, expires_at):
+        old = self._entries.pop(key, None)
+        if old:
+            self._bytes -= old[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, old_size, _) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+            self.evictions += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[0] >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._entries.pop(key)
+                self._bytes -= entry[1]
+
+        if self.db_path:
+            found = self._db_get(key, now)
+            if found:
+                value, expires_at = found
+                with self._lock:
+                    self._store(key, value, len(json.dumps(value)), expires_at)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        raw = json.dumps(value)
+        with self._lock:
+            self._store(key, value, len(raw), expires_at)
+        if self.db_path:
+            self._db_set(key, raw, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.db_path:
+            try:
+                conn = self._db()
+                conn.execute("DELETE FROM responses")
+                conn.commit()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "disk_tier": bool(self.db_path),
+            }
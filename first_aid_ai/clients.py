@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Gemini Client Pool
+# One pre-configured client per API key (its gRPC channel stays open and is
+# reused across requests) and one GenerativeModel per (key, model, system
+# instruction). Nothing here touches the global genai.configure() state, so
+# threaded workers can use different keys at the same time.
+# The SDK itself takes ~0.6 s to import (it pulls in IPython and every API
+# surface), so it is loaded on first use (or by core.warm_up) rather than at
+# import time.
+
+DEFAULT_MODEL = 'gemini-1.5-flash'
+MAX_POOLED_KEYS = 32  # manual keys typed into the UI are pooled too, so bound it
+
+# Point the SDK somewhere else, e.g. the local mock in benchmarks/mock_gemini.py:
+# GEMINI_API_ENDPOINT=http://127.0.0.1:8089 (uses the REST transport unless GEMINI_TRANSPORT says otherwise)
+API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+TRANSPORT = os.getenv("GEMINI_TRANSPORT") or ("rest" if API_ENDPOINT else None)
+
+
+def _client_kwargs():
+    kwargs = {}
+    if TRANSPORT:
+        kwargs["transport"] = TRANSPORT
+    if API_ENDPOINT:
+        kwargs["client_options"] = {"api_endpoint": API_ENDPOINT}
+    return kwargs
+
+
+def load_sdk():
+    """(genai, genai.client), imported on first call; later calls hit sys.modules."""
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+    return genai, genai_client
+
+
+def _digest(text):
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:12]
+
+
+_END = object()
+
+
+class _ThreadedStream:
+    """Async iteration over a blocking streamed response, fetching each chunk in a worker thread."""
+
+    def __init__(self, response):
+        self.response = response
+        self._chunks = iter(response)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await asyncio.to_thread(next, self._chunks, _END)
+        if chunk is _END:
+            raise StopAsyncIteration
+        return chunk
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class _ThreadedAsyncModel:
+    """The SDK has no async REST client; run the blocking call off the event loop instead."""
+
+    def __init__(self, model):
+        self.model = model
+
+    async def generate_content_async(self, *args, **kwargs):
+        response = await asyncio.to_thread(self.model.generate_content, *args, **kwargs)
+        return _ThreadedStream(response) if kwargs.get("stream") else response
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+class ModelPool:
+    def __init__(self, max_keys=MAX_POOLED_KEYS):
+        self.max_keys = max_keys
+        self._managers = OrderedDict()  # api_key -> _ClientManager
+        self._models = {}               # (api_key, model, sys_digest, loop_id) -> GenerativeModel
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _manager(self, api_key):
+        manager = self._managers.get(api_key)
+        if manager is None:
+            manager = load_sdk()[1]._ClientManager()
+            manager.configure(api_key=api_key, **_client_kwargs())
+            self._managers[api_key] = manager
+            if len(self._managers) > self.max_keys:
+                evicted, _ = self._managers.popitem(last=False)
+                self._models = {k: v for k, v in self._models.items() if k[0] != evicted}
+        else:
+            self._managers.move_to_end(api_key)
+        return manager
+
+    def get(self, api_key, model_name=DEFAULT_MODEL, system_instruction=None, use_async=False):
+        """
+        Returns a model bound to api_key. Async models are additionally keyed by
+        the running event loop, since async gRPC channels belong to one loop.
+        """
+        loop_id = id(asyncio.get_running_loop()) if use_async else None
+        pool_key = (api_key, model_name, _digest(system_instruction), loop_id)
+
+        with self._lock:
+            model = self._models.get(pool_key)
+            if model is not None:
+                self._managers.move_to_end(api_key)
+                self.reused += 1
+                return model
+
+            manager = self._manager(api_key)
+            model = load_sdk()[0].GenerativeModel(model_name, system_instruction=system_instruction or None)
+            if use_async and TRANSPORT == "rest":
+                model._client = manager.get_default_client("generative")
+                model = _ThreadedAsyncModel(model)
+            elif use_async:
+                model._async_client = manager.make_client("generative_async")
+            else:
+                model._client = manager.get_default_client("generative")
+            self._models[pool_key] = model
+            self.created += 1
+            return model
+
+    def retain(self, system_instructions):
+        """Drops models built for any other system instruction (vision models have none). Returns how many."""
+        live = {_digest(text) for text in system_instructions} | {_digest(None)}
+        with self._lock:
+            before = len(self._models)
+            self._models = {k: v for k, v in self._models.items() if k[2] in live}
+            return before - len(self._models)
+
+    def after_fork(self):
+        """Drops clients inherited from a preloading parent; gRPC channels must not cross fork()."""
+        with self._lock:
+            self._managers.clear()
+            self._models.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._managers), "models": len(self._models),
+                    "created": self.created, "reused": self.reused}
+
+
+model_pool = ModelPool()
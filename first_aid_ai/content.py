@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import retrieval
+import embeddings
+from prompts import render_protocol
+
+# Content Manager
+# knowledge_base.json and system_prompt.md are watched by mtime polling (no
+# background thread, so it survives gunicorn's fork). A changed file is parsed
+# and validated once, compiled into an immutable snapshot (protocol index,
+# rendered protocol fragments, system prompt) and swapped in with a single
+# reference assignment. Requests in flight keep the snapshot they started
+# with; a broken edit is rejected and the previous snapshot stays live.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KB_PATH = os.path.join(BASE_DIR, 'knowledge_base.json')
+SYSTEM_PROMPT_PATH = os.path.join(BASE_DIR, 'system_prompt.md')
+
+POLL_SECONDS = float(os.getenv("CONTENT_POLL_SECONDS", "2"))
+DEFAULT_SYSTEM_PROMPT = "You are First Aid Guardian, a professional emergency assistant."
+
+
+class ContentError(ValueError):
+    """Raised when an edited knowledge base or system prompt fails validation."""
+
+
+def validate_knowledge_base(kb):
+    if not isinstance(kb, dict) or not isinstance(kb.get('protocols'), list):
+        raise ContentError("knowledge base must be an object with a 'protocols' list")
+    seen = set()
+    for i, protocol in enumerate(kb['protocols']):
+        where = f"protocols[{i}]"
+        if not isinstance(protocol, dict):
+            raise ContentError(f"{where} is not an object")
+        pid = protocol.get('id')
+        if not isinstance(pid, str) or not pid.strip():
+            raise ContentError(f"{where} has no id")
+        if pid in seen:
+            raise ContentError(f"duplicate protocol id '{pid}'")
+        seen.add(pid)
+        if not isinstance(protocol.get('title'), str):
+            raise ContentError(f"protocol '{pid}' has no title")
+        steps = protocol.get('steps')
+        if not isinstance(steps, list) or not steps or not all(isinstance(s, str) for s in steps):
+            raise ContentError(f"protocol '{pid}' needs a non-empty list of steps")
+        for field in ('keywords', 'red_flags'):
+            value = protocol.get(field, [])
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                raise ContentError(f"protocol '{pid}' field '{field}' must be a list of strings")
+    return kb
+
+
+class ContentSnapshot:
+    """Everything derived from one version of the content files. Never mutated."""
+
+    def __init__(self, kb_text, knowledge_base, system_prompt, semantic=False, index_cache_dir=None):
+        self.kb_text = kb_text
+        self.knowledge_base = knowledge_base
+        self.system_prompt = system_prompt
+        self.protocols = knowledge_base.get('protocols', [])
+        self.version = hashlib.sha256(
+            (kb_text + "\0" + system_prompt).encode("utf-8")
+        ).hexdigest()[:12]
+        self.loaded_at = time.time()
+        self.protocol_index = retrieval.ProtocolIndex(self.protocols)
+        self.semantic_index = None
+        if semantic:
+            try:
+                self.semantic_index = embeddings.SemanticIndex(self.protocols, cache_dir=index_cache_dir)
+            except Exception as e:
+                print(f"Semantic index unavailable, falling back to keyword retrieval: {e}")
+        # Serialized once here instead of on every prompt
+        self.rendered = {p['id']: render_protocol(p) for p in self.protocols}
+
+
+class ContentManager:
+    def __init__(self, kb_path=KB_PATH, prompt_path=SYSTEM_PROMPT_PATH,
+                 poll_seconds=POLL_SECONDS, semantic=False, index_cache_dir=None, on_publish=None):
+        self.kb_path = kb_path
+        self.prompt_path = prompt_path
+        self.poll_seconds = poll_seconds
+        self.semantic = semantic
+        self.index_cache_dir = index_cache_dir
+        self.on_publish = on_publish  # called with the new snapshot after each hot reload
+        self.last_error = None
+        self.reloads = 0
+        self._reload_lock = threading.Lock()
+        self._next_check = 0.0
+        self._stamp = None
+        self._snapshot = None
+        self.reload()
+
+    def _file_stamp(self):
+        stamp = []
+        for path in (self.kb_path, self.prompt_path):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _read(self):
+        with open(self.kb_path, 'r', encoding='utf-8') as f:
+            kb_text = f.read()
+        try:
+            kb = json.loads(kb_text)
+        except ValueError as e:
+            raise ContentError(f"{os.path.basename(self.kb_path)} is not valid JSON: {e}")
+        validate_knowledge_base(kb)
+
+        try:
+            with open(self.prompt_path, 'r', encoding='utf-8') as f:
+                system_prompt = f.read()
+        except OSError as e:
+            print(f"Error loading system prompt: {e}")
+            system_prompt = DEFAULT_SYSTEM_PROMPT
+        if not system_prompt.strip():
+            raise ContentError(f"{os.path.basename(self.prompt_path)} is empty")
+        return kb_text, kb, system_prompt
+
+    def reload(self):
+        """Re-reads both files and swaps in a new snapshot. Returns True if it changed."""
+        stamp = self._file_stamp()
+        try:
+            kb_text, kb, system_prompt = self._read()
+            snapshot = ContentSnapshot(kb_text, kb, system_prompt, semantic=self.semantic,
+                                       index_cache_dir=self.index_cache_dir)
+        except Exception as e:
+            self._stamp = stamp # Don't retry the same broken edit on every poll
+            self.last_error = str(e)
+            print(f"Content reload rejected, keeping version {getattr(self._snapshot, 'version', None)}: {e}")
+            if self._snapshot is None:
+                # First load must still produce something servable
+                self._snapshot = ContentSnapshot('{"protocols": []}', {"protocols": []}, DEFAULT_SYSTEM_PROMPT)
+            return False
+
+        self._stamp = stamp
+        self.last_error = None
+        changed = self._snapshot is None or snapshot.version != self._snapshot.version
+        if changed:
+            if self._snapshot is not None:
+                print(f"Content reloaded: version {self._snapshot.version} -> {snapshot.version}")
+                self.reloads += 1
+            previous, self._snapshot = self._snapshot, snapshot # Atomic swap
+            if previous is not None and self.on_publish:
+                self.on_publish(snapshot)
+        return changed
+
+    def current(self):
+        """The live snapshot, re-checking file mtimes at most every poll_seconds."""
+        now = time.monotonic()
+        if self.poll_seconds >= 0 and now >= self._next_check:
+            self._next_check = now + self.poll_seconds
+            # Only one thread rebuilds; the rest keep serving the old snapshot
+            if self._reload_lock.acquire(blocking=False):
+                try:
+                    if self._file_stamp() != self._stamp:
+                        self.reload()
+                finally:
+                    self._reload_lock.release()
+        return self._snapshot
+
+    @property
+    def snapshot(self):
+        """The live snapshot, without checking the files."""
+        return self._snapshot
+
+    def version(self):
+        return self.current().version
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "version": snap.version,
+            "protocols": len(snap.protocols),
+            "loaded_at": snap.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
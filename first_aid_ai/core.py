@@ -1,177 +1,985 @@
 import os
 import json
-import google.generativeai as genai
-from PIL import Image
+import time
+import asyncio
+import threading
 from dotenv import load_dotenv
+import cache
+import imaging
+from inventory_store import InventoryStore
+from content import ContentManager
+from shards import ShardRouter
+import offline
+import singleflight
+import sessions
+import scheduler
+import structured
+import supplies
+import metrics
+from keys import KeyManager
+from clients import model_pool, load_sdk
+from prompts import PromptBuilder, split_image_keywords
 
 # Load Environment Variables
 load_dotenv()
 
-# Gemini Multi-Key Rotation Manager
-class KeyManager:
-    def __init__(self):
-        # Extract all keys that look like gemini/GEMINI API keys
-        self.keys = []
-        
-        # Load from .env - be flexible with names
-        for key, value in os.environ.items():
-            if 'gemini' in key.lower() or 'api_key' in key.lower():
-                if value and value.startswith('AIza'):
-                    self.keys.append(value)
-        
-        self.current_index = 0
-        if not self.keys:
-            print("WARNING: No Gemini API Keys found in .env. System will require manual key entry in UI.")
-
-    def get_next_key(self):
-        if not self.keys:
-            return None
-        key = self.keys[self.current_index]
-        self.current_index = (self.current_index + 1) % len(self.keys)
-        return key
-
+# Gemini Multi-Key Scheduler (token buckets + circuit breakers, shared across workers)
 key_manager = KeyManager()
 
-def load_knowledge_base():
+# Inventory (SQLite-backed, versioned; see inventory_store.py)
+inventory_store = InventoryStore()
+
+def load_inventory():
+    """In-process snapshot, only re-read when another writer bumps the version. Do not mutate."""
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        path = os.path.join(base_dir, 'knowledge_base.json')
-        with open(path, 'r') as f:
-            return json.load(f)
+        with metrics.span("inventory_load"):
+            return inventory_store.snapshot()
     except Exception as e:
-        print(f"Error loading knowledge base: {e}")
-        return {}
+        print(f"Error loading inventory: {e}")
+        return {"medicines": [], "equipment": []}
 
-def load_inventory():
+def inventory_version():
+    """Monotonic inventory version (used in cache and prompt fragment keys)."""
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        path = os.path.join(base_dir, 'inventory.json')
-        with open(path, 'r') as f:
-            return json.load(f)
+        return inventory_store.version()
     except Exception:
-        return {"medicines": [], "equipment": []}
+        return "none"
+
+# Prompt assembly (precompiled template, cached fragments, per-section token budgets)
+prompt_builder = PromptBuilder()
+
+# Response Cache (set RESPONSE_CACHE_ENABLED=0 to disable)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0"
+response_cache = cache.ResponseCache(db_path=os.getenv("RESPONSE_CACHE_DB") or None)
+
+# Vision keywords by perceptual hash, so a re-uploaded photo skips the vision call
+vision_cache = cache.ResponseCache(ttl=24 * 3600, max_entries=4096, max_bytes=4 * 1024 * 1024)
+
+# Retrieval mode: "keyword" (BM25 index), "semantic" (offline vectors) or "hybrid"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "keyword").lower()
+
+# Knowledge base + system prompt, hot-reloaded from disk (see content.py)
+content = ContentManager(semantic=RETRIEVAL_MODE in ("semantic", "hybrid"))
+
+def content_version():
+    """Version of the live knowledge base/system prompt snapshot (used in cache keys)."""
+    return content.version()
+
+# Per-tenant/language/grade protocol sets (see shards.py); falls back to `content`
+shard_router = ShardRouter(content, semantic=RETRIEVAL_MODE in ("semantic", "hybrid"))
+
+def _retire_stale_models(snapshot):
+    """A reload published a new system prompt: pooled models built for retired prompts are dropped."""
+    retired = model_pool.retain(shard_router.system_prompts())
+    if retired:
+        print(f"Dropped {retired} pooled models with an outdated system prompt")
+
+content.on_publish = _retire_stale_models
+
+def route_content(tenant=None, language=None, patient_metadata=None):
+    return shard_router.route(tenant, language, patient_metadata)
+
+def _merge_rankings(keyword_results, semantic_results, top_k):
+    """Blend both rankings after scaling each to its best score."""
+    combined = {}
+    for results in (keyword_results, semantic_results):
+        if not results:
+            continue
+        best = results[0][0] or 1.0
+        for score, protocol in results:
+            entry = combined.setdefault(protocol['id'], [0.0, protocol])
+            entry[0] += score / best
+    ranked = sorted(combined.values(), key=lambda x: x[0], reverse=True)
+    return [(round(s, 4), p) for s, p in ranked[:top_k]]
+
+def get_relevant_context(query, top_k=3, with_scores=False, snapshot=None):
+    """
+    Ranked RAG lookup over the prebuilt protocol index (BM25 + keyword matcher),
+    optionally blended with the offline semantic index (RETRIEVAL_MODE).
+    Searches the given shard snapshot (default: the global knowledge base).
+    Returns the top_k protocols, or (score, protocol) pairs when with_scores=True.
+    """
+    snapshot = snapshot or content.current()
+    with metrics.span("retrieval"):
+        results = _search(query, top_k, snapshot)
+    if with_scores:
+        return results
+    return [protocol for _, protocol in results]
 
-def load_system_prompt():
+def _search(query, top_k, snapshot):
+    protocol_index, semantic_index = snapshot.protocol_index, snapshot.semantic_index
+    if semantic_index is not None and RETRIEVAL_MODE == "semantic":
+        results = semantic_index.search(query, top_k=top_k)
+    elif semantic_index is not None and RETRIEVAL_MODE == "hybrid":
+        results = _merge_rankings(
+            protocol_index.search(query, top_k=top_k),
+            semantic_index.search(query, top_k=top_k),
+            top_k,
+        )
+    else:
+        results = protocol_index.search(query, top_k=top_k)
+    return results
+
+# Deterministic answers straight from the knowledge base (see offline.py)
+offline_responder = offline.OfflineResponder()
+
+def _local_answer(user_query, image, language, history, snapshot, degraded=False):
+    """
+    Fast path for confident single-protocol matches, or (degraded=True) the
+    fallback once no API key could answer. Photos and follow-up questions need
+    the model, so they only get the degraded answer.
+    """
+    if degraded:
+        if not offline.OFFLINE_FALLBACK:
+            return None
+    elif not offline.OFFLINE_ANSWERS or image is not None or history:
+        return None
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        path = os.path.join(base_dir, 'system_prompt.md')
-        with open(path, 'r') as f:
-            return f.read()
+        result = offline_responder.answer(user_query, snapshot, load_inventory(), language, degraded=degraded)
     except Exception as e:
-        print(f"Error loading system prompt: {e}")
-        return "You are First Aid Guardian, a professional emergency assistant."
-
-knowledge_base = load_knowledge_base()
-system_prompt_base = load_system_prompt()
-
-def get_relevant_context(query):
-    """
-    Primitive RAG implementation: Matches query keywords with protocol titles
-    In a production app, use vector embeddings (LangChain/ChromaDB).
-    """
-    matches = []
-    query_lower = query.lower()
-    
-    for protocol in knowledge_base.get('protocols', []):
-        title = protocol.get('title', '').lower()
-        keywords = protocol.get('keywords', [])
-        
-        # Simple match check
-        if any(kw.lower() in query_lower for kw in keywords) or title in query_lower:
-            matches.append(protocol)
-            
-    # Sort by relevance (basic)
-    matches.sort(key=lambda x: x[0] if isinstance(x, tuple) else 0, reverse=True)
-    return matches[:3] # Return top 3
-
-def generate_response(user_query, image=None, language="English", patient_metadata=None, manual_api_key=None, history_str="[]"):
-    errors = []
-    
-    # Parse history
+        print(f"Offline answer failed: {e}")
+        return None
+    if result:
+        offline_responder.record(result["source"])
+    return _shaped(result)
+
+def _shaped(result):
+    """Prose in "response", typed spot/procedure/search in "structured" (see structured.py)."""
+    return structured.shape(result, load_inventory())
+
+# Identical in-flight questions share one model call, across threads and workers
+inflight = singleflight.SingleFlight(shared=os.getenv("SINGLEFLIGHT_SHARED", "1") != "0")
+
+def _coalesce(cache_key):
+    return cache_key is not None and singleflight.SINGLEFLIGHT_ENABLED
+
+# Urgency-ordered, per-tenant fair admission for model calls (see scheduler.py)
+request_scheduler = scheduler.Scheduler(quota=key_manager.headroom)
+
+def _classify(user_query, matches):
+    priority = scheduler.classify(user_query, matches)
+    metrics.annotate(priority=scheduler.PRIORITY_NAMES[priority])
+    return priority
+
+def _busy_answer(user_query, image, language, history, snapshot, priority):
+    """Work the scheduler turned away: the knowledge base protocol, or a retry hint."""
+    name = scheduler.PRIORITY_NAMES[priority]
+    metrics.annotate(shed=True)
+    fallback = _local_answer(user_query, image, language, history, snapshot, degraded=True)
+    if fallback:
+        return dict(fallback, shed=name)
+    offline_responder.record("shed")
+    return {"error": "The assistant is busy with urgent cases right now. Please try again in a few seconds.",
+            "shed": name, "retry_after": scheduler.RETRY_AFTER_SECONDS}
+
+def _admit(priority, tenant, manual_api_key):
+    """True once the scheduler grants a model slot (hand it back with _release_slot), False to degrade."""
+    if not scheduler.SCHEDULER_ENABLED:
+        return True
+    return request_scheduler.admit(priority, tenant, own_key=bool(manual_api_key)) == scheduler.RUN
+
+async def _admit_async(priority, tenant, manual_api_key):
+    if not scheduler.SCHEDULER_ENABLED:
+        return True
+    return await request_scheduler.admit_async(priority, tenant, own_key=bool(manual_api_key)) == scheduler.RUN
+
+def _release_slot():
+    if scheduler.SCHEDULER_ENABLED:
+        request_scheduler.release()
+
+def _admitted(priority, tenant, manual_api_key, run, busy):
+    """run() once the scheduler grants a model slot, else busy()."""
+    if not _admit(priority, tenant, manual_api_key):
+        return busy()
+    try:
+        return run()
+    finally:
+        _release_slot()
+
+async def _admitted_async(priority, tenant, manual_api_key, run, busy):
+    if not await _admit_async(priority, tenant, manual_api_key):
+        return await asyncio.to_thread(busy)
+    try:
+        return await run()
+    finally:
+        _release_slot()
+
+def _admitted_stream(priority, tenant, manual_api_key, events, busy, started):
+    """Streaming _admitted: the slot is held until the generator finishes or is closed."""
+    if not _admit(priority, tenant, manual_api_key):
+        yield from _result_events(busy(), started)
+        return
+    try:
+        yield from events()
+    finally:
+        _release_slot()
+
+async def _admitted_stream_async(priority, tenant, manual_api_key, events, busy, started):
+    if not await _admit_async(priority, tenant, manual_api_key):
+        for event in _result_events(await asyncio.to_thread(busy), started):
+            yield event
+        return
     try:
-        history = json.loads(history_str)
+        async for event in events():
+            yield event
+    finally:
+        _release_slot()
+
+def _collect_metrics():
+    """Scrape-time export of the counters the components already keep."""
+    families = {}
+    lookups, entries = {}, {}
+    for name, c in (("response", response_cache), ("vision", vision_cache)):
+        stats = c.stats()
+        lookups[(("cache", name), ("result", "hit"))] = stats["hits"]
+        lookups[(("cache", name), ("result", "miss"))] = stats["misses"]
+        entries[(("cache", name),)] = stats["entries"]
+    families["cache_lookups_total"] = ("counter", "Cache lookups by cache and result", lookups)
+    families["cache_entries"] = ("gauge", "Entries held in each in-process cache", entries)
+    families["answers_total"] = ("counter", "Answers by source (llm, local, fallback, cached, failed)",
+                                 {(("source", k),): v for k, v in offline_responder.counts.items()})
+    flights = inflight.stats()
+    families["singleflight_total"] = ("counter", "Coalescing outcomes by role",
+                                      {(("role", k),): v for k, v in flights.items() if k != "in_flight"})
+    families["singleflight_in_flight"] = ("gauge", "Keys currently being answered", {(): flights["in_flight"]})
+    families["content_reloads_total"] = ("counter", "Knowledge base hot reloads", {(): content.reloads})
+    families["sessions_live"] = ("gauge", "Conversation sessions held in memory", {(): session_store.stats()["live"]})
+    sched = request_scheduler.stats()
+    families["scheduler_active"] = ("gauge", "Model calls holding a scheduler slot", {(): sched["active"]})
+    families["scheduler_queued"] = ("gauge", "Requests waiting for a model slot by priority",
+                                    {(("priority", k),): v for k, v in sched["queued"].items()})
+    pool = model_pool.stats()
+    families["model_pool_models"] = ("gauge", "Pooled Gemini model objects", {(): pool["models"]})
+    return families
+
+metrics.registry.register_collector(_collect_metrics)
+
+def _parse_history(history_str):
+    try:
+        return json.loads(history_str)
     except:
-        history = []
+        return []
+
+# Server-side conversation memory: clients send a session_id instead of the whole chat
+session_store = sessions.SessionStore()
+
+def _load_history(history_str, session_id):
+    # A session this machine doesn't know (expired, or spill disabled) falls back to what the client sent
+    history = session_store.history(session_id) if session_id else None
+    return history or _parse_history(history_str)
 
+def _remember(session_id, user_query, result):
+    """Appends this turn's question and answer to the session (only successful answers)."""
+    if session_id and result and result.get("response"):
+        session_store.append(session_id, user_query or "[Image Shared]", result["response"])
+
+def _response_cache_key(user_query, image, language, patient_metadata, matches, history, snapshot):
+    # Images are only cacheable once preprocessed. The key uses the exact content
+    # digest: a perceptual-hash match is close enough for vision keywords, not for an answer
+    image_hash = getattr(image, 'digest', None)
+    if not RESPONSE_CACHE_ENABLED or (image is not None and image_hash is None):
+        return None
+    return cache.make_key(
+        user_query, language, patient_metadata,
+        [m['id'] for m in matches], inventory_version(),
+        extra={"history": history[-6:] if history else None, "image": image_hash,
+               "content": snapshot.version},
+    )
+
+def _image_part(image):
+    """Prepared uploads are sent as their compact re-encoded bytes; PIL images as-is."""
+    return image.blob() if isinstance(image, imaging.PreparedImage) else image
+
+def _api_keys_to_try(manual_api_key):
     # If manual key is provided, use it first or exclusively
     api_keys_to_try = []
     if manual_api_key:
         api_keys_to_try.append(manual_api_key)
-    
-    # Add other keys from key_manager
+
+    # Add up to 3 healthy keys from key_manager (least loaded first)
+    api_keys_to_try.extend(key_manager.candidates(limit=3))
+    return api_keys_to_try
+
+def _cached_vision_keywords(image):
+    image_hash = getattr(image, 'phash', None)
+    return vision_cache.get(image_hash) if image_hash else None
+
+def _store_vision_keywords(image, keywords):
+    image_hash = getattr(image, 'phash', None)
+    if image_hash and keywords:
+        vision_cache.set(image_hash, keywords)
+
+VISION_PROMPT = "Analyze this medical situation. Identify the injury type and any visible tools/items. Return 3-5 keywords only."
+
+def _model_for_key(api_key, use_async=False, vision=False, snapshot=None):
+    """
+    Pooled model bound to its own per-key client, with the static system prompt
+    registered once as the system instruction instead of being re-sent inline.
+    The vision keyword pass gets a plain model without the system prompt.
+    """
+    system_instruction = None if vision else (snapshot or content.current()).system_prompt
+    return model_pool.get(api_key, 'gemini-1.5-flash', system_instruction=system_instruction, use_async=use_async)
+
+def _no_keys_error():
     if key_manager.keys:
-        for _ in range(min(3, len(key_manager.keys))): # Try up to 3 rotates
-            api_keys_to_try.append(key_manager.get_next_key())
-    
+        return "All API keys are rate limited or cooling down after errors. Please retry shortly or enter your own key."
+    return "No API Key provided. Please enter your Gemini API Key in the top header."
+
+# Image handling: "two_pass" runs a vision keyword call before the answer call;
+# "single" gets the answer and the image keywords from one call, and only
+# re-answers when those keywords point at materially different protocols.
+VISION_MODE = os.getenv("VISION_MODE", "two_pass").lower()
+SINGLE_PASS_RECHECK = os.getenv("SINGLE_PASS_RECHECK", "1") != "0"
+
+def _needs_vision_call(image, keywords):
+    return bool(image) and keywords is None and VISION_MODE != "single"
+
+def _visual_query(user_query, image, keywords):
+    """(query with the image keywords appended, whether the model should return them instead)."""
+    ask_keywords = image is not None and VISION_MODE == "single" and not keywords
+    return (f"{user_query} (Visuals: {keywords})" if keywords else user_query), ask_keywords
+
+def _build_parts(vision_model, user_query, image, language, patient_metadata, history, matches, snapshot, json_output=False):
+    """Runs the optional vision pass and assembles the final prompt parts."""
+    keywords = _cached_vision_keywords(image) if image else None
+    if _needs_vision_call(image, keywords):
+        try:
+            with metrics.span("vision_call"):
+                keywords = vision_model.generate_content([VISION_PROMPT, _image_part(image)]).text
+            _store_vision_keywords(image, keywords)
+        except Exception as ve:
+            print(f"Vision analysis failed: {ve}")
+
+    query, ask_keywords = _visual_query(user_query, image, keywords)
+    return _assemble_parts(query, image, language, patient_metadata, history, matches, snapshot, ask_keywords, json_output)
+
+async def _build_parts_async(vision_model, user_query, image, language, patient_metadata, history, matches, snapshot, json_output=False):
+    keywords = _cached_vision_keywords(image) if image else None
+    if _needs_vision_call(image, keywords):
+        try:
+            with metrics.span("vision_call"):
+                keywords = (await vision_model.generate_content_async([VISION_PROMPT, _image_part(image)])).text
+            _store_vision_keywords(image, keywords)
+        except Exception as ve:
+            print(f"Vision analysis failed: {ve}")
+
+    query, ask_keywords = _visual_query(user_query, image, keywords)
+    return await asyncio.to_thread(_assemble_parts, query, image, language, patient_metadata, history, matches, snapshot,
+                                   ask_keywords, json_output)
+
+def _assemble_parts(user_query, image, language, patient_metadata, history, matches, snapshot, ask_image_keywords=False, json_output=False):
+    # Load Inventory
+    inventory = load_inventory()
+
+    with metrics.span("prompt_assembly"):
+        found = None
+        if matches and supplies.INVENTORY_PROMPT == "relevant":
+            found = supplies.index_for(inventory).cross_reference(matches)
+        parts, sizes = prompt_builder.build(
+            user_query, language, patient_metadata, history, matches,
+            inventory, inventory.get('version', 'none'), kb_version=snapshot.version,
+            ask_image_keywords=ask_image_keywords, rendered_protocols=snapshot.rendered,
+            json_output=json_output, supplies=found,
+        )
+    metrics.record_prompt(sizes)
+    if image:
+        parts.append(_image_part(image))
+    return parts
+
+def _protocols_differ(used, detected):
+    """Material difference = the best protocol for the image keywords wasn't in the prompt."""
+    if not detected:
+        return False
+    return detected[0]['id'] not in {m['id'] for m in used}
+
+def _resolve_single_pass(text, user_query, image, matches, snapshot):
+    """
+    Single-call mode: strips the [KEYWORDS: ...] line, caches it for the image
+    and returns (text, keywords, matches_for_second_pass_or_None).
+    """
+    if image is None or VISION_MODE != "single":
+        return text, None, None
+    text, keywords = split_image_keywords(text)
+    if not keywords:
+        keywords = structured.image_keywords(text) # JSON output carries them as a field
+    if not keywords:
+        return text, None, None
+    _store_vision_keywords(image, keywords)
+    if not SINGLE_PASS_RECHECK:
+        return text, keywords, None
+    detected = get_relevant_context(f"{user_query} {keywords}", snapshot=snapshot)
+    if _protocols_differ(matches, detected):
+        print(f"Image keywords ({keywords}) point to different protocols; running second pass")
+        return text, keywords, detected
+    return text, keywords, None
+
+def _attempt_setup(api_key, snapshot, use_async=False):
+    """(answer model, vision model, json_output, generation_config) for one attempt with one key."""
+    json_output = structured.wants_json()
+    return (
+        _model_for_key(api_key, use_async=use_async, snapshot=snapshot),
+        _model_for_key(api_key, use_async=use_async, vision=True),
+        json_output,
+        structured.GENERATION_CONFIG if json_output else None,
+    )
+
+def _generate(api_key, user_query, image, language, patient_metadata, history, matches, snapshot):
+    """One attempt with one key. Returns (response_text, matches_used)."""
+    model, vision_model, json_output, config = _attempt_setup(api_key, snapshot)
+    parts = _build_parts(vision_model, user_query, image, language, patient_metadata, history, matches, snapshot, json_output)
+    with metrics.span("generation"):
+        response = model.generate_content(parts, generation_config=config)
+    metrics.record_usage(response)
+
+    text, keywords, recheck = _resolve_single_pass(response.text, user_query, image, matches, snapshot)
+    if recheck is None:
+        return text, matches
+    query, _ = _visual_query(user_query, image, keywords)
+    parts = _assemble_parts(query, image, language, patient_metadata, history, recheck, snapshot, json_output=json_output)
+    with metrics.span("generation_recheck"):
+        response = model.generate_content(parts, generation_config=config)
+    metrics.record_usage(response)
+    return response.text, recheck
+
+async def _generate_async(api_key, user_query, image, language, patient_metadata, history, matches, snapshot):
+    model, vision_model, json_output, config = _attempt_setup(api_key, snapshot, use_async=True)
+    parts = await _build_parts_async(vision_model, user_query, image, language, patient_metadata, history, matches, snapshot, json_output)
+    with metrics.span("generation"):
+        response = await model.generate_content_async(parts, generation_config=config)
+    metrics.record_usage(response)
+
+    text, keywords, recheck = _resolve_single_pass(response.text, user_query, image, matches, snapshot)
+    if recheck is None:
+        return text, matches
+    query, _ = _visual_query(user_query, image, keywords)
+    parts = await asyncio.to_thread(_assemble_parts, query, image, language, patient_metadata, history, recheck, snapshot,
+                                    json_output=json_output)
+    with metrics.span("generation_recheck"):
+        response = await model.generate_content_async(parts, generation_config=config)
+    metrics.record_usage(response)
+    return response.text, recheck
+
+# --- Key failover, shared by the blocking, streaming and async loops ---
+KEY_UNAVAILABLE = "Key benched or out of quota"
+
+def _without_keys(user_query, image, language, history, snapshot):
+    """No key to try: the knowledge base protocol, or the no-keys error."""
+    return _local_answer(user_query, image, language, history, snapshot, degraded=True) or {"error": _no_keys_error()}
+
+def _keys_failed(user_query, image, language, history, snapshot, attempts, errors):
+    """Every key failed: serve the protocol from the knowledge base rather than an error."""
+    fallback = _local_answer(user_query, image, language, history, snapshot, degraded=True)
+    if fallback:
+        return dict(fallback, errors=errors)
+    offline_responder.record("failed")
+    return {"error": f"Failed after {attempts} attempts. Errors: {', '.join(errors)}"}
+
+def _store_answer(text, context_used, cache_key):
+    """Shapes a model answer, counts it and caches it under cache_key."""
+    offline_responder.record("llm")
+    result = _shaped({"response": text, "context_used": context_used})
+    if cache_key:
+        response_cache.set(cache_key, result)
+    return result
+
+def _store_streamed(full_text, image, context_used, cache_key):
+    if image is not None and VISION_MODE == "single":
+        # Tokens are already out, so no second pass here; just keep the keywords
+        full_text, keywords = split_image_keywords(full_text)
+        _store_vision_keywords(image, keywords)
+    return _store_answer(full_text, context_used, cache_key)
+
+class _TokenStream:
+    """Chunks and first-token timing of one streamed attempt."""
+
+    def __init__(self, started):
+        self.started = started
+        self.generation_started = None
+        self.chunks = []
+        self.ttft_ms = None
+        self.last_chunk = None
+
+    def begin(self):
+        self.generation_started = time.perf_counter()
+
+    def token(self, chunk):
+        """The token event for a chunk, or None if it has no text (e.g. safety metadata only)."""
+        self.last_chunk = chunk
+        try:
+            text = chunk.text
+        except ValueError:
+            return None
+        if not text:
+            return None
+        if self.ttft_ms is None:
+            self.ttft_ms = round((time.perf_counter() - self.started) * 1000, 2)
+            metrics.observe_span("first_token", time.perf_counter() - self.generation_started)
+            metrics.annotate(ttft_ms=self.ttft_ms)
+        self.chunks.append(text)
+        return {"type": "token", "text": text}
+
+    def finish(self):
+        metrics.observe_span("generation", time.perf_counter() - self.generation_started)
+        metrics.record_usage(self.last_chunk) # The final chunk carries the usage totals
+        return "".join(self.chunks)
+
+    def done(self, result):
+        return dict(result, type="done", ttft_ms=self.ttft_ms, total_ms=round((time.perf_counter() - self.started) * 1000, 2))
+
+    def failed(self, error, errors):
+        """Error event once tokens reached the client (a retry would duplicate text), else None to try the next key."""
+        if self.chunks:
+            return {"type": "error", "error": str(error)}
+        errors.append(str(error))
+        return None
+
+# --- Blocking path ---
+def generate_response(user_query, image=None, language="English", patient_metadata=None, manual_api_key=None, history_str="[]", tenant=None, session_id=None):
+    history = _load_history(history_str, session_id)
+    result = _respond(user_query, image, language, patient_metadata, manual_api_key, history, tenant)
+    _remember(session_id, user_query, result)
+    return result
+
+def _lookup(user_query, image, language, patient_metadata, history, tenant):
+    """(snapshot, matches, cache_key, answer): answer is set when the cache or the knowledge base covers it."""
+    # Get RAG context from the tenant/language/grade shard
+    snapshot = route_content(tenant, language, patient_metadata)
+    matches = get_relevant_context(user_query, snapshot=snapshot)
+
+    # Cache lookup happens before any SDK work so hits return in milliseconds.
+    cache_key = _response_cache_key(user_query, image, language, patient_metadata, matches, history, snapshot)
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            offline_responder.record("cached")
+            return snapshot, matches, cache_key, dict(_shaped(cached), cached=True)
+
+    return snapshot, matches, cache_key, _local_answer(user_query, image, language, history, snapshot)
+
+def _shared_answer(result):
+    metrics.annotate(coalesced=True)
+    return dict(result, coalesced=True)
+
+def _respond(user_query, image, language, patient_metadata, manual_api_key, history, tenant):
+    snapshot, matches, cache_key, answer = _lookup(user_query, image, language, patient_metadata, history, tenant)
+    if answer:
+        return answer
+
+    priority = _classify(user_query, matches)
+
+    def compute():
+        return _admitted(
+            priority, tenant, manual_api_key,
+            lambda: _answer_with_keys(user_query, image, language, patient_metadata, manual_api_key, history, matches, snapshot, cache_key),
+            lambda: _busy_answer(user_query, image, language, history, snapshot, priority),
+        )
+
+    if not _coalesce(cache_key):
+        return compute()
+    result, shared = inflight.run(cache_key, compute)
+    return _shared_answer(result) if shared else result
+
+def _answer_with_keys(user_query, image, language, patient_metadata, manual_api_key, history, matches, snapshot, cache_key):
+    """Key failover loop behind generate_response (one caller per cache key at a time)."""
+    api_keys_to_try = _api_keys_to_try(manual_api_key)
     if not api_keys_to_try:
-        return {"error": "No API Key provided. Please enter your Gemini API Key in the top header."}
+        return _without_keys(user_query, image, language, history, snapshot)
+
+    errors = []
+    for attempt_key in api_keys_to_try:
+        if not key_manager.acquire(attempt_key):
+            errors.append(KEY_UNAVAILABLE)
+            continue
+        try:
+            text, used_matches = _generate(attempt_key, user_query, image, language, patient_metadata, history, matches, snapshot)
+        except Exception as e:
+            key_manager.release(attempt_key, error=e)
+            errors.append(str(e))
+            continue
+        key_manager.release(attempt_key)
+        return _store_answer(text, len(used_matches) > 0, cache_key)
+
+    return _keys_failed(user_query, image, language, history, snapshot, len(api_keys_to_try), errors)
+
+# --- Streaming path ---
+def generate_response_stream(user_query, image=None, language="English", patient_metadata=None, manual_api_key=None, history_str="[]", tenant=None, session_id=None):
+    """
+    Streaming version of generate_response.
+    Yields event dicts: {"type": "meta"}, then {"type": "token", "text"} chunks,
+    then {"type": "done", "response", "ttft_ms", "total_ms"} or {"type": "error"}.
+    A failing key is only rotated out before the first token has been sent.
+    """
+    history = _load_history(history_str, session_id)
+    for event in _respond_stream(user_query, image, language, patient_metadata, manual_api_key, history, tenant):
+        if event["type"] == "done":
+            _remember(session_id, user_query, event)
+        yield event
+
+def _meta_event(matches):
+    return {"type": "meta", "context_used": len(matches) > 0, "protocols": [m['id'] for m in matches]}
+
+def _streamed_answer(answer, matches):
+    """A cached answer reports whether this request's retrieval found context."""
+    return dict(answer, context_used=len(matches) > 0) if answer.get("cached") else answer
+
+def _whole_answer_events(result, started):
+    elapsed = round((time.perf_counter() - started) * 1000, 2)
+    yield {"type": "token", "text": result["response"]}
+    yield dict(result, type="done", ttft_ms=elapsed, total_ms=elapsed)
 
-    # Get RAG context
-    matches = get_relevant_context(user_query)
+def _result_events(result, started):
+    """A finished result as stream events: one error event, or the whole answer."""
+    if "error" in result:
+        yield dict(result, type="error")
+    else:
+        yield from _whole_answer_events(result, started)
 
+def _flight_result(event):
+    """What a coalesced follower receives from the leader's "done" event."""
+    return {k: v for k, v in event.items() if k not in ("type", "ttft_ms", "total_ms")}
+
+def _respond_stream(user_query, image, language, patient_metadata, manual_api_key, history, tenant):
+    started = time.perf_counter()
+    snapshot, matches, cache_key, answer = _lookup(user_query, image, language, patient_metadata, history, tenant)
+    yield _meta_event(matches)
+    if answer:
+        yield from _whole_answer_events(_streamed_answer(answer, matches), started)
+        return
+
+    priority = _classify(user_query, matches)
+    events = _admitted_stream(
+        priority, tenant, manual_api_key,
+        lambda: _stream_with_keys(user_query, image, language, patient_metadata, manual_api_key,
+                                  history, matches, snapshot, cache_key, started),
+        lambda: _busy_answer(user_query, image, language, history, snapshot, priority),
+        started,
+    )
+    if not _coalesce(cache_key):
+        yield from events
+        return
+
+    role, value = inflight.enter(cache_key)
+    if role == "shared":
+        # Someone else was already streaming this exact answer; send it in one piece
+        yield from _whole_answer_events(_shared_answer(value), started)
+        return
+    if role == "solo":
+        yield from events
+        return
+    result = None
+    try:
+        for event in events:
+            if event["type"] == "done":
+                result = _flight_result(event)
+            yield event
+    finally:
+        inflight.leave(cache_key, value, result)
+
+def _stream_with_keys(user_query, image, language, patient_metadata, manual_api_key, history, matches, snapshot, cache_key, started):
+    """Key failover loop behind generate_response_stream."""
+    api_keys_to_try = _api_keys_to_try(manual_api_key)
+    if not api_keys_to_try:
+        yield from _result_events(_without_keys(user_query, image, language, history, snapshot), started)
+        return
+
+    errors = []
     for attempt_key in api_keys_to_try:
+        if not key_manager.acquire(attempt_key):
+            errors.append(KEY_UNAVAILABLE)
+            continue
+        stream = _TokenStream(started)
+        try:
+            model = _model_for_key(attempt_key, snapshot=snapshot)
+            parts = _build_parts(_model_for_key(attempt_key, vision=True), user_query, image, language, patient_metadata,
+                                 history, matches, snapshot)
+            stream.begin()
+            for chunk in model.generate_content(parts, stream=True):
+                event = stream.token(chunk)
+                if event:
+                    yield event
+            full_text = stream.finish()
+        except GeneratorExit:
+            # Client went away mid-stream: not a key fault
+            key_manager.release(attempt_key, cancelled=True)
+            raise
+        except Exception as e:
+            key_manager.release(attempt_key, error=e)
+            failure = stream.failed(e, errors)
+            if failure:
+                yield failure
+                return
+            continue
+        key_manager.release(attempt_key)
+        yield stream.done(_store_streamed(full_text, image, len(matches) > 0, cache_key))
+        return
+
+    yield from _result_events(_keys_failed(user_query, image, language, history, snapshot, len(api_keys_to_try), errors), started)
+
+# --- Async serving path ---
+# Same steps as the blocking and streaming paths above; only the awaits differ.
+# Wait this long for a key before racing the next one (0 = plain sequential failover)
+HEDGE_AFTER_MS = int(os.getenv("HEDGE_AFTER_MS", "0"))
+
+async def _race_keys(attempt, keys, hedge_after_ms):
+    """
+    Runs attempt(key) over keys. Without hedging a key is only tried after the
+    previous one failed; with hedging the next key is also started when the
+    current ones haven't answered within hedge_after_ms. The first success wins
+    and every other in-flight attempt is cancelled.
+    """
+    errors = []
+    queue = list(keys)
+    pending = set()
+
+    def launch():
+        pending.add(asyncio.ensure_future(attempt(queue.pop(0))))
+
+    launch()
+    try:
+        while pending:
+            timeout = hedge_after_ms / 1000 if (hedge_after_ms and queue) else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch() # Hedge: the current attempt is slow, race the next key
+                continue
+            for task in done:
+                pending.discard(task)
+                if task.exception() is None:
+                    return task.result(), errors
+                errors.append(str(task.exception()))
+            if not pending and queue:
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+    return None, errors
+
+async def generate_response_async(user_query, image=None, language="English", patient_metadata=None, manual_api_key=None, history_str="[]", hedge_after_ms=None, tenant=None, session_id=None):
+    """
+    Non-blocking version of generate_response for the ASGI entry point (asgi.py).
+    Session, inventory and response-cache reads/writes go to SQLite, so they
+    run in worker threads instead of on the event loop.
+    """
+    history = await asyncio.to_thread(_load_history, history_str, session_id)
+    result = await _respond_async(user_query, image, language, patient_metadata, manual_api_key, history, hedge_after_ms, tenant)
+    await asyncio.to_thread(_remember, session_id, user_query, result)
+    return result
+
+async def _respond_async(user_query, image, language, patient_metadata, manual_api_key, history, hedge_after_ms, tenant):
+    snapshot, matches, cache_key, answer = await asyncio.to_thread(
+        _lookup, user_query, image, language, patient_metadata, history, tenant)
+    if answer:
+        return answer
+
+    priority = _classify(user_query, matches)
+
+    def compute():
+        return _admitted_async(
+            priority, tenant, manual_api_key,
+            lambda: _answer_with_keys_async(user_query, image, language, patient_metadata, manual_api_key,
+                                            history, matches, snapshot, cache_key, hedge_after_ms),
+            lambda: _busy_answer(user_query, image, language, history, snapshot, priority),
+        )
+
+    if not _coalesce(cache_key):
+        return await compute()
+    role, value = await inflight.enter_async(cache_key)
+    if role == "shared":
+        return _shared_answer(value)
+    if role == "solo":
+        return await compute()
+    result = None
+    try:
+        result = await compute()
+        return result
+    finally:
+        await asyncio.to_thread(inflight.leave, cache_key, value, result)
+
+async def _answer_with_keys_async(user_query, image, language, patient_metadata, manual_api_key, history, matches, snapshot, cache_key, hedge_after_ms):
+    # Key state is a shared SQLite file (BEGIN IMMEDIATE can wait on other workers): keep it off the loop
+    api_keys_to_try = await asyncio.to_thread(_api_keys_to_try, manual_api_key)
+    if not api_keys_to_try:
+        return await asyncio.to_thread(_without_keys, user_query, image, language, history, snapshot)
+
+    async def attempt(api_key):
+        if not await asyncio.to_thread(key_manager.acquire, api_key):
+            raise RuntimeError(KEY_UNAVAILABLE)
         try:
-            genai.configure(api_key=attempt_key)
-            
-            model_name = 'gemini-1.5-flash'
-            model = genai.GenerativeModel(model_name)
-            
-            # Load Inventory
-            inventory = load_inventory()
-            
-            # --- Vision Analysis for better keywords ---
-            if image:
-                try:
-                    vision_prompt = "Analyze this medical situation. Identify the injury type and any visible tools/items. Return 3-5 keywords only."
-                    v_res = model.generate_content([vision_prompt, image])
-                    user_query += f" (Visuals: {v_res.text})"
-                except Exception as ve:
-                    print(f"Vision analysis failed: {ve}")
-
-            # Format History Context
-            history_context = ""
-            if history:
-                history_context = "\nCONVERSATION HISTORY:\n"
-                for msg in history[-6:]: # Last 6 turns for context
-                    role = "Patient" if msg['role'] == 'user' else "Dr. Guardian"
-                    history_context += f"{role}: {msg['text']}\n"
-
-            system_prompt = [
-                f"""
-                {system_prompt_base}
-
-                --- TECHNICAL CONTEXT ---
-                {history_context}
-
-                AVAILABLE INVENTORY (Medicines & Equipment):
-                {json.dumps(inventory.get('medicines', []), indent=2)}
-
-                CONTEXT DATA: {json.dumps(matches, indent=2)}
-
-                PATIENT DETAILS:
-                - Age: {patient_metadata.get('age', 'N/A')},
-                Gender: {patient_metadata.get('gender', 'N/A')},
-                Location: {patient_metadata.get('location', 'N/A')},
-                Duration: {patient_metadata.get('duration', 'N/A')}
-
-                FORMAT (MUST BE LAST LINES):
-                [SPOT_ID: <number>]
-                [PROCEDURE: <step_1>, <step_2>, ...]
-                [SEARCH: <missing_item_1>, <item_to_use_from_inventory>, ...]
-
-                LANGUAGE: You must strictly respond in {language}.
-                """,
-            ]
-
-            parts = system_prompt + [f"User Query: {user_query}"]
-            if image:
-                parts.append(image)
-
-            response = model.generate_content(parts)
-            return {"response": response.text, "context_used": len(matches) > 0}
+            text, used_matches = await _generate_async(api_key, user_query, image, language, patient_metadata, history, matches, snapshot)
+        except asyncio.CancelledError:
+            # Lost a hedge race, not a key fault. The release runs in its thread even if this await is cancelled too.
+            await asyncio.to_thread(key_manager.release, api_key, cancelled=True)
+            raise
+        except Exception as e:
+            await asyncio.to_thread(key_manager.release, api_key, error=e)
+            raise
+        await asyncio.to_thread(key_manager.release, api_key)
+        return text, used_matches
 
+    if hedge_after_ms is None:
+        hedge_after_ms = HEDGE_AFTER_MS
+    outcome, errors = await _race_keys(attempt, api_keys_to_try, hedge_after_ms)
+    if outcome is None:
+        return await asyncio.to_thread(_keys_failed, user_query, image, language, history, snapshot, len(api_keys_to_try), errors)
+    text, used_matches = outcome
+    return await asyncio.to_thread(_store_answer, text, len(used_matches) > 0, cache_key)
+
+async def generate_response_stream_async(user_query, image=None, language="English", patient_metadata=None, manual_api_key=None, history_str="[]", tenant=None, session_id=None):
+    """
+    Non-blocking version of generate_response_stream for the ASGI entry point:
+    the same events, with tokens read from the async SDK stream and every
+    SQLite-backed step run in a worker thread.
+    """
+    history = await asyncio.to_thread(_load_history, history_str, session_id)
+    async for event in _respond_stream_async(user_query, image, language, patient_metadata, manual_api_key, history, tenant):
+        if event["type"] == "done":
+            await asyncio.to_thread(_remember, session_id, user_query, event)
+        yield event
+
+async def _respond_stream_async(user_query, image, language, patient_metadata, manual_api_key, history, tenant):
+    started = time.perf_counter()
+    snapshot, matches, cache_key, answer = await asyncio.to_thread(
+        _lookup, user_query, image, language, patient_metadata, history, tenant)
+    yield _meta_event(matches)
+    if answer:
+        for event in _whole_answer_events(_streamed_answer(answer, matches), started):
+            yield event
+        return
+
+    priority = _classify(user_query, matches)
+    events = _admitted_stream_async(
+        priority, tenant, manual_api_key,
+        lambda: _stream_with_keys_async(user_query, image, language, patient_metadata, manual_api_key,
+                                        history, matches, snapshot, cache_key, started),
+        lambda: _busy_answer(user_query, image, language, history, snapshot, priority),
+        started,
+    )
+    if not _coalesce(cache_key):
+        async for event in events:
+            yield event
+        return
+
+    role, value = await inflight.enter_async(cache_key)
+    if role == "shared":
+        for event in _whole_answer_events(_shared_answer(value), started):
+            yield event
+        return
+    if role == "solo":
+        async for event in events:
+            yield event
+        return
+    result = None
+    try:
+        async for event in events:
+            if event["type"] == "done":
+                result = _flight_result(event)
+            yield event
+    finally:
+        await asyncio.to_thread(inflight.leave, cache_key, value, result)
+
+async def _stream_with_keys_async(user_query, image, language, patient_metadata, manual_api_key, history, matches, snapshot, cache_key, started):
+    """Key failover loop behind generate_response_stream_async (no hedging: tokens go out as they arrive)."""
+    api_keys_to_try = await asyncio.to_thread(_api_keys_to_try, manual_api_key)
+    if not api_keys_to_try:
+        for event in _result_events(await asyncio.to_thread(_without_keys, user_query, image, language, history, snapshot), started):
+            yield event
+        return
+
+    errors = []
+    for attempt_key in api_keys_to_try:
+        if not await asyncio.to_thread(key_manager.acquire, attempt_key):
+            errors.append(KEY_UNAVAILABLE)
+            continue
+        stream = _TokenStream(started)
+        try:
+            model = _model_for_key(attempt_key, use_async=True, snapshot=snapshot)
+            parts = await _build_parts_async(_model_for_key(attempt_key, use_async=True, vision=True), user_query, image,
+                                             language, patient_metadata, history, matches, snapshot)
+            stream.begin()
+            async for chunk in await model.generate_content_async(parts, stream=True):
+                event = stream.token(chunk)
+                if event:
+                    yield event
+            full_text = stream.finish()
+        except (asyncio.CancelledError, GeneratorExit):
+            await asyncio.to_thread(key_manager.release, attempt_key, cancelled=True)
+            raise
         except Exception as e:
-            errors.append(str(e))
+            await asyncio.to_thread(key_manager.release, attempt_key, error=e)
+            failure = stream.failed(e, errors)
+            if failure:
+                yield failure
+                return
             continue
+        await asyncio.to_thread(key_manager.release, attempt_key)
+        yield stream.done(await asyncio.to_thread(_store_streamed, full_text, image, len(matches) > 0, cache_key))
+        return
+
+    result = await asyncio.to_thread(_keys_failed, user_query, image, language, history, snapshot, len(api_keys_to_try), errors)
+    for event in _result_events(result, started):
+        yield event
+
+# Startup
+# Importing core is kept cheap: the Gemini SDK and PIL load on first use.
+# warm_up() does the remaining first-request work (indexes, shards, inventory,
+# supply index, SDK and PIL imports) ahead of traffic. Under gunicorn with
+# preload_app (gunicorn.conf.py) the master runs it once before forking, so
+# workers share that memory copy-on-write; otherwise app.py starts it in a
+# background thread and /ready answers 503 until it is done.
+WARM_UP = os.getenv("WARM_UP", "background").lower()  # "background", "eager" or "off"
+
+_warm_lock = threading.Lock()
+_readiness = {"ready": False, "state": "cold", "steps_ms": {}, "took_ms": None, "error": None, "warmed_by": None}
+
+def _warm_steps():
+    return [
+        ("knowledge_base", content.current),
+        ("shards", shard_router.preload),
+        ("inventory", load_inventory),
+        ("supplies", lambda: supplies.index_for(load_inventory())),
+        ("gemini_sdk", load_sdk),
+        ("pil", imaging.load_pil),
+    ]
+
+def warm_up():
+    """Runs the first-request initialisation now. Idempotent; returns readiness()."""
+    with _warm_lock:
+        if _readiness["ready"]:
+            return readiness()
+        _readiness["state"] = "warming"
+        started = time.perf_counter()
+        for name, step in _warm_steps():
+            step_started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                # Whatever failed is retried lazily by the first request that needs it
+                _readiness["error"] = f"{name}: {e}"
+                print(f"Warm-up step {name} failed: {e}")
+            _readiness["steps_ms"][name] = round((time.perf_counter() - step_started) * 1000, 1)
+        _readiness.update(ready=True, state="ready", warmed_by=os.getpid(),
+                          took_ms=round((time.perf_counter() - started) * 1000, 1))
+        print(f"Warm-up finished in {_readiness['took_ms']} ms")
+    return readiness()
+
+def start_warm_up():
+    """Warms according to WARM_UP; called once by the web entry point."""
+    if WARM_UP == "eager":
+        warm_up()
+    elif WARM_UP == "background":
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+def readiness():
+    state = dict(_readiness, steps_ms=dict(_readiness["steps_ms"]), pid=os.getpid(),
+                 content_version=content.current().version if _readiness["ready"] else None)
+    if WARM_UP == "off":
+        state["ready"] = True  # everything loads on first use
+    # warmed_by != pid: this worker inherited the master's indexes copy-on-write
+    state["preloaded"] = state["warmed_by"] not in (None, state["pid"])
+    return state
 
-    return {"error": f"Failed after {len(api_keys_to_try)} attempts. Errors: {', '.join(errors)}"}
+def after_fork():
+    """gunicorn post_fork hook: reopen per-process handles inherited from a preloading master."""
+    for component in (response_cache, vision_cache, inventory_store, session_store, inflight,
+                      key_manager, model_pool):
+        component.after_fork()
@@ -0,0 +1,222 @@
+import glob
+import hashlib
+import json
+import os
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # Semantic mode is optional; keyword retrieval still works
+    np = None
+
+from retrieval import STOPWORDS, TOKEN_RE
+
+# Offline Semantic Retrieval
+# Dense vectors from a hashed word + char-n-gram projection (no network, no model
+# download). Vectors live in a float32 file that every worker memory-maps, so
+# gunicorn workers share the same page cache instead of holding private copies.
+
+DIM = 1024
+CHAR_NGRAMS = (3, 4, 5)
+FIELD_WEIGHTS = {"title": 2.0, "keywords": 3.0, "red_flags": 1.0, "steps": 1.0}
+# Calibrated on knowledge_base.json: greetings and small talk score <= 0.11,
+# real injury questions mostly 0.13-0.8 (see tests/test_embeddings.py)
+DEFAULT_MIN_SIMILARITY = 0.12
+# Bumped whenever features() changes, so cached matrices are re-embedded
+FEATURES_VERSION = 3
+
+WORD_RE = TOKEN_RE  # same words as keyword retrieval, in any script
+
+# Chat filler that otherwise lands on protocols through shared char n-grams
+# ("hello" ~ "help"/"head", "you" ~ step text)
+FILLER_WORDS = STOPWORDS | {
+    "hello", "hi", "hey", "there", "thanks", "thank", "ok", "okay", "please", "can", "could", "would",
+    "should", "will", "help", "who", "where", "when", "why", "not", "good", "morning", "afternoon",
+    "tell", "teacher", "student", "kid", "boy", "girl", "child", "today", "time", "about", "some",
+    "any", "just", "very", "much", "all", "this", "need", "want", "know",
+}
+
+MATRIX_FILE = "protocol_vectors.{version}.f32"
+MANIFEST_FILE = "protocol_vectors.json"
+
+
+def default_cache_dir():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.environ.get("INDEX_CACHE_DIR", os.path.join(base_dir, ".index_cache"))
+
+
+def _bucket(feature):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % DIM, (1.0 if (h >> 31) & 1 else -1.0)
+
+
+def features(text):
+    """Word unigrams plus boundary-marked char n-grams of each word."""
+    for word in WORD_RE.findall(text.lower()):
+        if word in FILLER_WORDS:
+            continue
+        yield "w:" + word
+        padded = f"<{word}>"
+        for n in CHAR_NGRAMS:
+            for i in range(len(padded) - n + 1):
+                yield "c:" + padded[i:i + n]
+
+
+def embed_text(text, weight=1.0, out=None):
+    """Raw (un-normalized, log-scaled) hashed term vector for one text."""
+    counts = {}
+    for feat in features(text):
+        counts[feat] = counts.get(feat, 0) + 1
+    vec = out if out is not None else np.zeros(DIM, dtype=np.float32)
+    for feat, c in counts.items():
+        idx, sign = _bucket(feat)
+        vec[idx] += sign * weight * (1.0 + np.log(c))
+    return vec
+
+
+def embed_protocol(protocol):
+    vec = np.zeros(DIM, dtype=np.float32)
+    for field, weight in FIELD_WEIGHTS.items():
+        value = protocol.get(field, [])
+        texts = value if isinstance(value, list) else [value]
+        for text in texts:
+            embed_text(str(text), weight, out=vec)
+    return vec
+
+
+def _matrix_version(row_hashes):
+    return hashlib.sha1(json.dumps([DIM, FEATURES_VERSION, row_hashes]).encode("utf-8")).hexdigest()[:16]
+
+
+def protocol_hash(protocol):
+    payload = json.dumps(protocol, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+class SemanticIndex:
+    """
+    Memory-mapped matrix of protocol vectors.
+    search() is one batched matrix-vector product plus argpartition for top-k.
+    """
+
+    def __init__(self, protocols, cache_dir=None):
+        if np is None:
+            raise RuntimeError("numpy is required for semantic retrieval")
+        self.protocols = list(protocols or [])
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.matrix = None
+        self.idf = None
+        self.doc_norms = None
+        self.rebuilt_rows = 0
+        self._load_or_build()
+
+    def _matrix_path(self, version):
+        return os.path.join(self.cache_dir, MATRIX_FILE.format(version=version))
+
+    def _manifest_path(self):
+        return os.path.join(self.cache_dir, MANIFEST_FILE)
+
+    def _read_manifest(self):
+        """(manifest, matrix) from the cache, or (None, None) if missing, stale or inconsistent."""
+        try:
+            with open(self._manifest_path(), "r") as f:
+                manifest = json.load(f)
+            if manifest.get("dim") != DIM or manifest.get("features") != FEATURES_VERSION:
+                return None, None
+            rows = len(manifest["row_hashes"])
+            if manifest.get("version") != _matrix_version(manifest["row_hashes"]):
+                return None, None
+            matrix_path = self._matrix_path(manifest["version"])
+            # The manifest names its own matrix, so a concurrent rebuild can't pair it with another one
+            if os.path.getsize(matrix_path) != rows * DIM * 4:
+                return None, None
+            old = np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(rows, DIM)) if rows else None
+            return manifest, old
+        except Exception:
+            return None, None
+
+    def _load_or_build(self):
+        hashes = [protocol_hash(p) for p in self.protocols]
+        manifest, old = self._read_manifest()
+
+        if manifest and manifest["row_hashes"] == hashes:
+            self._open(manifest)
+            return
+
+        # Incremental rebuild: only re-embed protocols whose content changed
+        previous = {}
+        if manifest and old is not None:
+            previous = {h: i for i, h in enumerate(manifest["row_hashes"])}
+
+        matrix = np.zeros((len(self.protocols), DIM), dtype=np.float32)
+        for i, (protocol, h) in enumerate(zip(self.protocols, hashes)):
+            if h in previous:
+                matrix[i] = old[previous[h]]
+            else:
+                matrix[i] = embed_protocol(protocol)
+                self.rebuilt_rows += 1
+
+        n = len(self.protocols)
+        df = (matrix != 0).sum(axis=0)
+        idf = np.log((1 + n) / (1 + df)).astype(np.float32) + 1.0
+        doc_norms = np.linalg.norm(matrix * idf, axis=1).astype(np.float32)
+        doc_norms[doc_norms == 0] = 1.0
+
+        manifest = {
+            "dim": DIM,
+            "features": FEATURES_VERSION,
+            "version": _matrix_version(hashes),
+            "row_hashes": hashes,
+            "idf": idf.tolist(),
+            "doc_norms": doc_norms.tolist(),
+        }
+        self._write(matrix, manifest)
+        self._open(manifest)
+
+    def _write(self, matrix, manifest):
+        """
+        Both files are written to temp names and renamed into place, matrix
+        first and manifest last. The matrix file name carries the content
+        version, so a reader always maps the matrix its manifest describes.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        matrix_path, manifest_path = self._matrix_path(manifest["version"]), self._manifest_path()
+        tmp_matrix = f"{matrix_path}.{os.getpid()}.tmp"
+        tmp_manifest = f"{manifest_path}.{os.getpid()}.tmp"
+        matrix.tofile(tmp_matrix)
+        with open(tmp_manifest, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_matrix, matrix_path)
+        os.replace(tmp_manifest, manifest_path)
+        # Older matrices: workers that still map one keep their open inode
+        for path in glob.glob(os.path.join(self.cache_dir, MATRIX_FILE.format(version="*"))):
+            if path != matrix_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _open(self, manifest):
+        matrix_path = self._matrix_path(manifest["version"])
+        rows = len(manifest["row_hashes"])
+        self.matrix = np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(rows, DIM)) if rows else None
+        self.idf = np.asarray(manifest["idf"], dtype=np.float32)
+        self.doc_norms = np.asarray(manifest["doc_norms"], dtype=np.float32)
+
+    def __len__(self):
+        return len(self.protocols)
+
+    def search(self, query, top_k=3, min_score=DEFAULT_MIN_SIMILARITY):
+        """Returns [(cosine_similarity, protocol), ...] sorted by descending score."""
+        if self.matrix is None or not query.strip():
+            return []
+        q = embed_text(query) * self.idf
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return []
+        scores = (self.matrix @ (q * self.idf)) / (self.doc_norms * q_norm)
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(round(float(scores[i]), 4), self.protocols[i]) for i in top if scores[i] > min_score]
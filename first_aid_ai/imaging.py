@@ -0,0 +1,88 @@
+import hashlib
+import io
+import os
+
+# Upload Preprocessing
+# Phone photos are often 12 MP. Decode them at reduced size (JPEG draft mode),
+# fix orientation, drop EXIF, re-encode once to a compact JPEG and reuse those
+# bytes for every model call. A perceptual hash finds repeat uploads for the
+# vision-keyword cache. Answers are cached by an exact digest of the bytes,
+# because two different wounds can share a perceptual hash.
+# PIL is imported on the first upload (or by core.warm_up), not at startup.
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("IMAGE_MAX_UPLOAD_MB", "10")) * 1024 * 1024)
+MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+
+MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+
+
+def load_pil():
+    """(Image, ImageOps), imported on first call."""
+    from PIL import Image, ImageOps
+    # Refuse decompression bombs well before they reach memory
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    return Image, ImageOps
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class PreparedImage:
+    """Re-encoded upload: compact bytes for the model, their sha256 digest and a perceptual hash."""
+
+    mime_type = "image/jpeg"
+
+    def __init__(self, data, size, phash, original_bytes):
+        self.data = data
+        self.size = size
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.phash = phash
+        self.original_bytes = original_bytes
+
+    def blob(self):
+        """Inline-data part accepted by generate_content()."""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    def to_pil(self):
+        Image, _ = load_pil()
+        return Image.open(io.BytesIO(self.data))
+
+    def __repr__(self):
+        return f"PreparedImage({self.size[0]}x{self.size[1]}, {len(self.data)} bytes, phash={self.phash})"
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash; near-identical photos share (almost) the same value."""
+    Image, _ = load_pil()
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()  # mode "L": one byte per pixel, row by row
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:016x}"
+
+
+def preprocess(image_data, max_edge=MAX_EDGE, quality=JPEG_QUALITY, max_bytes=None):
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    if len(image_data) > max_bytes:
+        raise ImageTooLarge(f"Image is {len(image_data) // 1024} KB; the limit is {max_bytes // 1024} KB")
+
+    Image, ImageOps = load_pil()
+    image = Image.open(io.BytesIO(image_data))
+    # For JPEGs this makes the decoder scale by 1/2, 1/4 or 1/8 while decoding,
+    # so a 12 MP photo never materializes at full resolution.
+    image.draft("RGB", (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    out = io.BytesIO()
+    # Saving without exif= drops EXIF (GPS, device info) from the re-encoded copy
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    return PreparedImage(out.getvalue(), image.size, dhash(image), len(image_data))
@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import threading
+
+# Inventory Store
+# SQLite (WAL) replaces whole-file rewrites of inventory.json. Every change is
+# an item-level transaction that bumps a monotonically increasing version, so
+# concurrent edits from several workers/nurses never overwrite each other.
+# Readers keep an in-process snapshot and only re-read when the version moves.
+
+KINDS = ("medicines", "equipment")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED_PATH = os.path.join(BASE_DIR, 'inventory.json')
+
+
+def default_db_path():
+    return os.getenv("INVENTORY_DB", os.path.join(BASE_DIR, 'inventory.db'))
+
+
+class VersionConflict(Exception):
+    """Raised when a write was based on an older inventory version."""
+
+
+def _as_version(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None  # never equal to a real version, so the write is refused as a conflict
+
+
+class InventoryStore:
+    def __init__(self, db_path=None, seed_path=SEED_PATH):
+        self.db_path = db_path or default_db_path()
+        self.seed_path = seed_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._init_db()
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """Called in each gunicorn worker after fork; SQLite handles must not be shared across processes."""
+        self._local = threading.local()
+
+    def _init_db(self):
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, name TEXT NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            seeded = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if seeded is None:
+                # First run: import the legacy inventory.json once
+                conn.execute("INSERT INTO meta (key, value) VALUES ('version', 1)")
+                for kind, name in self._read_seed():
+                    conn.execute("INSERT INTO items (kind, name) VALUES (?, ?)", (kind, name))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _read_seed(self):
+        try:
+            with open(self.seed_path, 'r') as f:
+                data = json.load(f)
+        except Exception:
+            return []
+        return [(kind, str(name)) for kind in KINDS for name in data.get(kind, []) if str(name).strip()]
+
+    def _write(self, fn, expected_version=None):
+        """Runs fn(conn) in one transaction and bumps the version. Returns (result, version)."""
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            if expected_version is not None and _as_version(expected_version) != version:
+                raise VersionConflict(f"Inventory changed (now version {version})")
+            result = fn(conn)
+            version += 1
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (version,))
+            conn.execute("COMMIT")
+            return result, version
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- Reads ---
+    def version(self):
+        return self._db().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def etag(self, version=None):
+        return f"inv-{self.version() if version is None else version}"
+
+    def snapshot(self):
+        """
+        {"medicines": [...], "equipment": [...], "items": [...], "version": n}.
+        Served from memory until another writer bumps the version.
+        """
+        version = self.version()
+        snap = self._snapshot
+        if snap is not None and snap["version"] == version:
+            return snap
+
+        conn = self._db()
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            rows = conn.execute("SELECT id, kind, name FROM items ORDER BY id").fetchall()
+        finally:
+            conn.execute("COMMIT")
+
+        snap = {kind: [] for kind in KINDS}
+        snap["items"] = []
+        for item_id, kind, name in rows:
+            snap.setdefault(kind, []).append(name)
+            snap["items"].append({"id": item_id, "kind": kind, "name": name})
+        snap["version"] = version
+        with self._lock:
+            self._snapshot = snap
+        return snap
+
+    # --- Writes ---
+    def add(self, name, kind="medicines", expected_version=None):
+        name = str(name).strip()
+        if not name:
+            raise ValueError("Item name is required")
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+
+        def insert(conn):
+            cur = conn.execute("INSERT INTO items (kind, name) VALUES (?, ?)", (kind, name))
+            return {"id": cur.lastrowid, "kind": kind, "name": name}
+        return self._write(insert, expected_version)
+
+    def remove(self, item_id, expected_version=None):
+        def delete(conn):
+            cur = conn.execute("DELETE FROM items WHERE id = ?", (int(item_id),))
+            if cur.rowcount == 0:
+                raise KeyError(item_id)
+        return self._write(delete, expected_version)
+
+    def patch(self, item_id, name=None, kind=None, expected_version=None):
+        if kind is not None and kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+        if name is not None and not str(name).strip():
+            raise ValueError("Item name cannot be empty")
+
+        def update(conn):
+            row = conn.execute("SELECT kind, name FROM items WHERE id = ?", (int(item_id),)).fetchone()
+            if row is None:
+                raise KeyError(item_id)
+            new_kind = kind or row[0]
+            new_name = str(name).strip() if name is not None else row[1]
+            conn.execute("UPDATE items SET kind = ?, name = ? WHERE id = ?", (new_kind, new_name, int(item_id)))
+            return {"id": int(item_id), "kind": new_kind, "name": new_name}
+        return self._write(update, expected_version)
+
+    def replace(self, data, expected_version=None):
+        """Whole-inventory replace (legacy POST /api/inventory body)."""
+        items = [(kind, str(name).strip()) for kind in KINDS for name in (data or {}).get(kind, []) if str(name).strip()]
+
+        def swap(conn):
+            conn.execute("DELETE FROM items")
+            conn.executemany("INSERT INTO items (kind, name) VALUES (?, ?)", items)
+        return self._write(swap, expected_version)
+
+    def clear(self, expected_version=None):
+        return self.replace({}, expected_version)
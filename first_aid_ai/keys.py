@@ -0,0 +1,356 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import metrics
+
+# Gemini Key Scheduler
+# Per-key token bucket + circuit breaker with exponential backoff, least-loaded
+# selection. State lives in a small SQLite file so every gunicorn worker on the
+# machine sees the same quotas, in-flight counts and benched keys. In-flight
+# calls are leases (one row per call, owned by the worker's pid, with an
+# expiry), so a worker that is killed mid-call can't leave a key looking busy.
+
+KEY_RPM = float(os.getenv("KEY_RPM", "15"))               # sustained requests/minute per key
+KEY_BURST = float(os.getenv("KEY_BURST", str(KEY_RPM)))   # bucket capacity
+KEY_MAX_BACKOFF = float(os.getenv("KEY_MAX_BACKOFF", "3600"))
+KEY_LEASE_SECONDS = float(os.getenv("KEY_LEASE_SECONDS", "180"))  # longer than any call (gunicorn timeout is 120)
+LEASE_REAP_INTERVAL = 30.0  # how often a worker checks for leases left by dead workers
+
+# Base bench time (seconds) per failure reason; doubles on each consecutive failure
+BACKOFF_BASE = {
+    "forbidden": 300.0,     # 403 / API_KEY_HTTP_REFERRER_BLOCKED / invalid key
+    "rate_limited": 30.0,   # 429 / RESOURCE_EXHAUSTED
+    "timeout": 5.0,
+    "error": 5.0,
+}
+
+
+def classify_error(error):
+    text = f"{type(error).__name__} {error}".lower()
+    if "403" in text or "permission" in text or "api_key" in text or "api key" in text:
+        return "forbidden"
+    if "429" in text or "resource_exhausted" in text or "resourceexhausted" in text or "quota" in text:
+        return "rate_limited"
+    if "timeout" in text or "deadline" in text:
+        return "timeout"
+    return "error"
+
+
+def key_id(api_key):
+    """Keys are never written to disk; state is stored under a hash."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _owner_alive(owner):
+    try:
+        os.kill(int(owner), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError, OSError):
+        return True  # someone else's process, or not a pid: let the lease expire instead
+    return True
+
+
+def default_state_path():
+    return os.getenv("KEY_STATE_DB", os.path.join(tempfile.gettempdir(), "first_aid_key_state.db"))
+
+
+class KeyManager:
+    def __init__(self, keys=None, state_path=None):
+        # Extract all keys that look like gemini/GEMINI API keys
+        self.keys = []
+
+        if keys is None:
+            # Load from .env - be flexible with names
+            for key, value in os.environ.items():
+                if 'gemini' in key.lower() or 'api_key' in key.lower():
+                    if value and value.startswith('AIza') and value not in self.keys:
+                        self.keys.append(value)
+        else:
+            self.keys = list(keys)
+
+        self.current_index = 0
+        self.rate = KEY_RPM / 60.0
+        self.capacity = KEY_BURST
+        self._ids = {key_id(k): k for k in self.keys}
+        self._lock = threading.Lock()
+        self._memory = {}  # fallback state when the shared file is unavailable
+        self.state_path = state_path or default_state_path()
+        self.owner = str(os.getpid())
+        self._conn = None
+        self._next_reap = 0.0
+        if self.keys:
+            self._init_store()
+
+        if not self.keys:
+            print("WARNING: No Gemini API Keys found in .env. System will require manual key entry in UI.")
+
+    # --- Shared state store ---
+    def _init_store(self):
+        try:
+            conn = sqlite3.connect(self.state_path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS key_state ("
+                "key_id TEXT PRIMARY KEY, tokens REAL, updated REAL, "
+                "failures INTEGER DEFAULT 0, open_until REAL DEFAULT 0, last_error TEXT, "
+                "successes INTEGER DEFAULT 0, total_failures INTEGER DEFAULT 0)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS key_leases (key_id TEXT, owner TEXT, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS key_leases_key ON key_leases (key_id, owner)")
+            now = time.time()
+            for kid in self._ids:
+                conn.execute(
+                    "INSERT OR IGNORE INTO key_state (key_id, tokens, updated) VALUES (?, ?, ?)",
+                    (kid, self.capacity, now),
+                )
+            self._conn = conn
+        except Exception as e:
+            print(f"KeyManager: shared state unavailable, using per-process state ({e})")
+            self._conn = None
+
+    def after_fork(self):
+        """Forked worker: reconnect to the shared state file (the parent's handle is not fork-safe)."""
+        self.owner = str(os.getpid())
+        self._conn = None
+        self._next_reap = 0.0
+        if self.keys:
+            self._init_store()
+
+    def _transaction(self, fn, write=True):
+        """
+        Runs fn(rows) -> (updates, result) atomically across threads and workers.
+        Read-only callers pass write=False and don't take the write lock.
+        """
+        with self._lock:
+            if self._conn is None:
+                rows = self._memory_rows()
+                updates, result = fn(rows)
+                for kid, row in updates.items():
+                    self._memory[kid].update(row)
+                return result
+
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                now = time.time()
+                if write:
+                    self._expire_leases(conn, now)
+                cur = conn.execute(
+                    "SELECT key_id, tokens, updated, failures, open_until, last_error, "
+                    "successes, total_failures FROM key_state"
+                )
+                cols = [d[0] for d in cur.description]
+                rows = {r[0]: dict(zip(cols[1:], r[1:]), in_flight=0) for r in cur.fetchall() if r[0] in self._ids}
+                for kid, count in conn.execute(
+                        "SELECT key_id, COUNT(*) FROM key_leases WHERE expires >= ? GROUP BY key_id", (now,)):
+                    if kid in rows:
+                        rows[kid]["in_flight"] = count
+                updates, result = fn(rows)
+                if updates and not write:
+                    raise RuntimeError("read-only key transaction tried to write")
+                for kid, row in updates.items():
+                    conn.execute(
+                        "UPDATE key_state SET tokens=?, updated=?, failures=?, open_until=?, "
+                        "last_error=?, successes=?, total_failures=? WHERE key_id=?",
+                        (row["tokens"], row["updated"], row["failures"], row["open_until"],
+                         row["last_error"], row["successes"], row["total_failures"], kid),
+                    )
+                    self._lease(conn, kid, row["in_flight"] - rows[kid]["in_flight"], now)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _memory_rows(self):
+        """This worker's own key state, used when the shared file is unavailable."""
+        now = time.time()
+        return {kid: self._memory.setdefault(kid, {
+            "tokens": self.capacity, "updated": now, "in_flight": 0, "failures": 0,
+            "open_until": 0.0, "last_error": None, "successes": 0, "total_failures": 0,
+        }) for kid in self._ids}
+
+    def _take_local(self, kid):
+        """Spends a token from this worker's own bucket for the key (the shared file just failed)."""
+        with self._lock:
+            row = self._refill(self._memory_rows()[kid], time.time())
+            if row["tokens"] < 1:
+                return False
+            row["tokens"] -= 1
+            return True
+
+    def _lease(self, conn, kid, delta, now):
+        """Takes (delta > 0) or returns (delta < 0) this worker's in-flight leases on a key."""
+        if delta > 0:
+            conn.executemany("INSERT INTO key_leases (key_id, owner, expires) VALUES (?, ?, ?)",
+                             [(kid, self.owner, now + KEY_LEASE_SECONDS)] * delta)
+        elif delta < 0:
+            conn.execute(
+                "DELETE FROM key_leases WHERE rowid IN ("
+                "SELECT rowid FROM key_leases WHERE key_id = ? AND owner = ? ORDER BY expires LIMIT ?)",
+                (kid, self.owner, -delta),
+            )
+
+    def _expire_leases(self, conn, now):
+        """Drops expired leases, and every so often those of workers that no longer exist."""
+        conn.execute("DELETE FROM key_leases WHERE expires < ?", (now,))
+        if now < self._next_reap:
+            return
+        self._next_reap = now + LEASE_REAP_INTERVAL
+        owners = [r[0] for r in conn.execute("SELECT DISTINCT owner FROM key_leases WHERE owner != ?", (self.owner,))]
+        for owner in owners:
+            if not _owner_alive(owner):
+                conn.execute("DELETE FROM key_leases WHERE owner = ?", (owner,))
+
+    def _refill(self, row, now):
+        elapsed = max(0.0, now - (row["updated"] or now))
+        row["tokens"] = min(self.capacity, (row["tokens"] or 0.0) + elapsed * self.rate)
+        row["updated"] = now
+        return row
+
+    # --- Scheduling ---
+    def candidates(self, limit=3):
+        """
+        Healthy keys ordered by preference: not benched, quota available,
+        fewest in-flight requests, most tokens left. Read-only.
+        """
+        if not self.keys:
+            return []
+
+        def pick(rows):
+            now = time.time()
+            ranked = []
+            for kid, row in rows.items():
+                row = self._refill(dict(row), now)
+                if row["open_until"] > now or row["tokens"] < 1:
+                    continue
+                ranked.append((row["in_flight"], -row["tokens"], kid))
+            ranked.sort()
+            return {}, [self._ids[kid] for _, _, kid in ranked[:limit]]
+
+        try:
+            return self._transaction(pick, write=False)
+        except Exception as e:
+            print(f"KeyManager: scheduling failed, falling back to round-robin ({e})")
+            return [self.get_next_key() for _ in range(min(limit, len(self.keys)))]
+
+    def headroom(self):
+        """Whole request tokens left across keys that are not benched (None without keys)."""
+        if not self.keys:
+            return None
+
+        def total(rows):
+            now = time.time()
+            tokens = 0.0
+            for row in rows.values():
+                row = self._refill(dict(row), now)
+                if row["open_until"] <= now:
+                    tokens += int(row["tokens"])
+            return {}, tokens
+
+        try:
+            return self._transaction(total, write=False)
+        except Exception:
+            return None
+
+    def acquire(self, api_key):
+        """Consumes a token and marks the key in flight. False if benched or out of quota."""
+        kid = key_id(api_key)
+        if kid not in self._ids:
+            metrics.key_attempts.inc(outcome="started")
+            return True # Manual keys from the UI are not scheduled
+
+        def take(rows):
+            now = time.time()
+            row = self._refill(dict(rows[kid]), now)
+            if row["open_until"] > now or row["tokens"] < 1:
+                return {kid: row}, False
+            row["tokens"] -= 1
+            row["in_flight"] += 1
+            return {kid: row}, True
+
+        try:
+            acquired = self._transaction(take)
+        except Exception as e:
+            # Never let a locked or broken state file turn into unlimited calls
+            print(f"KeyManager: could not take a token from shared state, using this worker's limit ({e})")
+            acquired = self._take_local(kid)
+        metrics.key_attempts.inc(outcome="started" if acquired else "skipped")
+        return acquired
+
+    def release(self, api_key, error=None, cancelled=False):
+        """Records the outcome of a call made with an acquired key."""
+        if cancelled:
+            metrics.key_attempts.inc(outcome="cancelled")
+        elif error is None:
+            metrics.key_attempts.inc(outcome="success")
+        else:
+            metrics.key_attempts.inc(outcome="failure")
+            metrics.key_failures.inc(reason=classify_error(error))
+        kid = key_id(api_key)
+        if kid not in self._ids:
+            return
+
+        def record(rows):
+            now = time.time()
+            row = self._refill(dict(rows[kid]), now)
+            row["in_flight"] = max(0, row["in_flight"] - 1)
+            if cancelled:
+                pass
+            elif error is None:
+                row["failures"] = 0
+                row["open_until"] = 0.0
+                row["successes"] += 1
+            else:
+                reason = classify_error(error)
+                row["failures"] += 1
+                row["total_failures"] += 1
+                row["last_error"] = reason
+                backoff = BACKOFF_BASE[reason] * (2 ** (row["failures"] - 1))
+                row["open_until"] = now + min(backoff, KEY_MAX_BACKOFF)
+                if reason == "rate_limited":
+                    row["tokens"] = 0.0
+            return {kid: row}, None
+
+        try:
+            self._transaction(record)
+        except Exception as e:
+            print(f"KeyManager: could not record key outcome ({e})")
+
+    def get_next_key(self):
+        """Legacy round-robin selection (kept for scripts that only need any key)."""
+        if not self.keys:
+            return None
+        key = self.keys[self.current_index]
+        self.current_index = (self.current_index + 1) % len(self.keys)
+        return key
+
+    def stats(self):
+        if not self.keys:
+            return []
+
+        def snapshot(rows):
+            now = time.time()
+            out = []
+            for kid, row in rows.items():
+                row = self._refill(dict(row), now)
+                # Every Gemini key starts "AIzaSy", so the prefix can't tell them apart
+                out.append({
+                    "key": "..." + self._ids[kid][-4:],
+                    "key_id": kid,
+                    "tokens": round(row["tokens"], 2),
+                    "in_flight": row["in_flight"],
+                    "benched_for_s": round(max(0.0, row["open_until"] - now), 1),
+                    "consecutive_failures": row["failures"],
+                    "last_error": row["last_error"],
+                    "successes": row["successes"],
+                    "failures": row["total_failures"],
+                })
+            return {}, out
+
+        return self._transaction(snapshot, write=False)
@@ -0,0 +1,276 @@
+import contextvars
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Request Metrics
+# Per-stage timing spans, counters and histograms rendered as Prometheus text
+# on /metrics, one structured JSON log line per request, and an optional
+# cProfile sampler. Metrics are per process: with several gunicorn workers
+# each scrape sees the worker that served it (scrape every worker, or sum
+# them in Prometheus by instance).
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # "json" or "off"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # e.g. 0.01 = 1% of requests
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '.profiles'))
+
+# Seconds; covers sub-ms local work up to slow model calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + list(extra or [])
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(k)} {v}" for k, v in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, row in self.values.items():
+                for bound, count in zip(self.buckets, row):
+                    out.append(f"{self.name}_bucket{_format_labels(key, [('le', str(bound))])} {count}")
+                out.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {row[-1]}")
+                out.append(f"{self.name}_sum{_format_labels(key)} {round(row[-2], 6)}")
+                out.append(f"{self.name}_count{_format_labels(key)} {row[-1]}")
+        return out
+
+
+class Registry:
+    def __init__(self, prefix="first_aid_"):
+        self.prefix = prefix
+        self.metrics = {}
+        self.collectors = []  # fn() -> {metric_name: (type, help, {label_tuple: value})}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        full = self.prefix + name
+        with self._lock:
+            metric = self.metrics.get(full)
+            if metric is None:
+                metric = self.metrics[full] = cls(full, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def register_collector(self, fn):
+        """fn() is called at scrape time and returns {name: (type, help, {labels_dict_items: value})}."""
+        self.collectors.append(fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collect in self.collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, (kind, help_text, values) in families.items():
+                full = self.prefix + name
+                lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                for labels, value in values.items():
+                    lines.append(f"{full}{_format_labels(_label_key(dict(labels)))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.histogram("request_seconds", "End-to-end request latency by route")
+stage_seconds = registry.histogram("stage_seconds", "Latency of each request stage")
+prompt_tokens = registry.histogram("prompt_tokens", "Estimated prompt tokens per section", buckets=TOKEN_BUCKETS)
+llm_tokens = registry.counter("llm_tokens_total", "Tokens reported by Gemini usage metadata")
+key_failures = registry.counter("key_failures_total", "Failed Gemini calls by key failure reason")
+key_attempts = registry.counter("key_attempts_total", "Gemini key attempts by outcome")
+requests_total = registry.counter("requests_total", "Requests by route and status")
+scheduler_decisions = registry.counter("scheduler_decisions_total", "Admission decisions by priority and outcome")
+scheduler_wait_seconds = registry.histogram("scheduler_wait_seconds", "Time queued for a model slot by priority")
+
+
+# --- Request traces ---
+_trace = contextvars.ContextVar("first_aid_trace", default=None)
+
+
+class Trace:
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans = []   # [(stage, ms)]; a stage can repeat (retries, hedged calls)
+        self.fields = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, ms):
+        with self._lock:
+            self.spans.append((stage, ms))
+
+    def summary(self):
+        with self._lock:
+            totals = {}
+            for stage, ms in self.spans:
+                totals[stage] = round(totals.get(stage, 0.0) + ms, 2)
+            return totals
+
+
+def current_trace():
+    return _trace.get()
+
+
+def annotate(**fields):
+    """Adds fields (status, source, cached, ...) to the current request's log line."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def log_event(event, **fields):
+    if LOG_FORMAT != "json":
+        return
+    record = {"ts": round(time.time(), 3), "event": event, "pid": os.getpid()}
+    record.update(fields)
+    print(json.dumps(record, default=str), flush=True)
+
+
+def observe_span(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_span(stage, seconds * 1000)
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_span(stage, time.perf_counter() - started)
+
+
+def _profile_path(route):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{route}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+
+
+@contextmanager
+def request_trace(route):
+    """
+    Wraps one request: times it, collects its spans, writes one JSON log line
+    and (for PROFILE_SAMPLE_RATE of requests) a cProfile dump. Open the .prof
+    files with snakeviz or turn them into a flamegraph with flameprof.
+    """
+    trace = Trace(route)
+    token = _trace.set(trace)
+    profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            profiler = None # Another profiler is already active on this thread
+    try:
+        yield trace
+    except Exception as e:
+        trace.fields.setdefault("status", 500)
+        trace.fields.setdefault("error", str(e))
+        raise
+    finally:
+        elapsed = time.perf_counter() - trace.started
+        if profiler is not None:
+            profiler.disable()
+            try:
+                path = _profile_path(route)
+                profiler.dump_stats(path)
+                trace.fields["profile"] = path
+            except Exception as e:
+                print(f"Could not write profile: {e}")
+        status = trace.fields.get("status", 200)
+        request_seconds.observe(elapsed, route=route)
+        requests_total.inc(route=route, status=status)
+        log_event("request", route=route, total_ms=round(elapsed * 1000, 2),
+                  spans=trace.summary(), **trace.fields)
+        _trace.reset(token)
+
+
+def record_prompt(sizes):
+    for section, tokens in sizes.items():
+        prompt_tokens.observe(tokens, section=section)
+    annotate(prompt_tokens=sizes.get("total"))
+
+
+def record_usage(response):
+    """Token counts from a Gemini response's usage_metadata, when present."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    completion = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt:
+        llm_tokens.inc(prompt, kind="prompt")
+    if completion:
+        llm_tokens.inc(completion, kind="completion")
+    trace = _trace.get()
+    if trace is not None:
+        trace.fields["llm_prompt_tokens"] = trace.fields.get("llm_prompt_tokens", 0) + prompt
+        trace.fields["llm_completion_tokens"] = trace.fields.get("llm_completion_tokens", 0) + completion
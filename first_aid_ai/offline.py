@@ -0,0 +1,190 @@
+import os
+import re
+import threading
+import time
+
+import metrics
+import scheduler
+import supplies
+from retrieval import tokenize
+
+# Offline Answer Engine
+# When the keyword index is confident about a single protocol, the answer is
+# rendered straight from the knowledge base (steps, red flags, inventory
+# cross-reference and the [SPOT_ID]/[PROCEDURE]/[SEARCH] trailer script.js
+# reads) instead of waiting seconds for Gemini. Questions that describe a red
+# flag, or match a protocol that can escalate to 112/CPR, always go to the
+# model. The same renderer is the degraded-mode answer when every API key is
+# failing. Either way the query must name a protocol keyword or title: a step
+# word like "after" never selects a protocol on its own.
+
+OFFLINE_ANSWERS = os.getenv("OFFLINE_ANSWERS", "1") != "0"
+OFFLINE_FALLBACK = os.getenv("OFFLINE_FALLBACK", "1") != "0"
+OFFLINE_MIN_SCORE = float(os.getenv("OFFLINE_MIN_SCORE", "6.0"))
+# Best protocol must beat the runner-up by this factor, otherwise the query is ambiguous
+OFFLINE_MIN_MARGIN = float(os.getenv("OFFLINE_MIN_MARGIN", "2.0"))
+# Degraded mode answers any protocol whose keyword or title the query names
+FALLBACK_MIN_SCORE = float(os.getenv("OFFLINE_FALLBACK_MIN_SCORE", "1.5"))
+
+DEGRADED_NOTICE = "⚠️ The AI assistant is unavailable right now. Showing the standard school first aid protocol."
+
+# Fixed wording around the protocol text. A translated knowledge base can
+# override any of these under metadata.labels, so its answers read in one language.
+LABELS = {
+    "degraded_notice": DEGRADED_NOTICE,
+    "other_language_notice": "(Not available offline in {requested}; shown in {language}.)",
+    "red_flags": "Call 112 and alert the school nurse if:",
+    "use_from_inventory": "Use from inventory:",
+    "missing_item": "WARNING: {item} is missing from inventory. Use a clean alternative or procure immediately.",
+}
+
+# Body map spots in static/index.html: id -> words that name that spot.
+# Left/right pairs are listed left first.
+BODY_SPOTS = [
+    (("top of head", "scalp", "head"), (1,)),
+    (("forehead",), (2,)),
+    (("face", "eye", "eyes", "nose", "cheek"), (3,)),
+    (("mouth", "jaw", "lip", "lips", "tooth", "teeth", "tongue"), (4,)),
+    (("neck", "throat"), (5,)),
+    (("shoulder",), (6, 7)),
+    (("chest",), (8,)),
+    (("stomach", "belly", "abdomen", "tummy"), (11,)),
+    (("upper arm", "arm"), (13, 14)),
+    (("elbow",), (15, 16)),
+    (("forearm", "wrist"), (17, 18)),
+    (("hand", "finger", "fingers", "palm", "thumb"), (19, 20)),
+    (("hip",), (21, 22)),
+    (("thigh",), (23, 24)),
+    (("knee",), (25, 26)),
+    (("leg", "shin", "ankle", "calf"), (27, 28)),
+    (("foot", "toe", "toes", "heel"), (29, 30)),
+]
+
+# Where the body map points when the query doesn't name a body part
+DEFAULT_SPOTS = {
+    "nosebleed": 3, "choking": 5, "cpr": 8, "anaphylaxis": 5,
+    "head_injury": 1, "fainting": 1, "seizure": 1, "minor_cuts": 25,
+}
+
+_TRAILER_UNSAFE = re.compile(r"[,\[\]]")
+
+
+def _phrase_in(phrase_tokens, tokens):
+    n = len(phrase_tokens)
+    return any(tokens[i:i + n] == phrase_tokens for i in range(len(tokens) - n + 1))
+
+
+def spot_for(query, protocol):
+    tokens = tokenize(query, drop_stopwords=False)
+    side = 1 if "right" in tokens else 0
+    for words, ids in BODY_SPOTS:
+        if any(_phrase_in(tokenize(w, drop_stopwords=False), tokens) for w in words):
+            return ids[min(side, len(ids) - 1)]
+    return protocol.get('spot_id') or DEFAULT_SPOTS.get(protocol.get('id'))
+
+
+def cross_reference(protocol, inventory):
+    """(inventory item names the protocol can use, supply labels that are missing)."""
+    found = supplies.index_for(inventory).cross_reference([protocol])
+    return [str(item['name']) for item in found["have"]], found["missing"]
+
+
+def _trailer_item(text):
+    return _TRAILER_UNSAFE.sub(" ", text).strip().rstrip(".")
+
+
+def labels_for(snapshot):
+    """LABELS with the knowledge base's own translations applied."""
+    overrides = snapshot.knowledge_base.get('metadata', {}).get('labels') or {}
+    return dict(LABELS, **{k: v for k, v in overrides.items() if k in LABELS and isinstance(v, str)})
+
+
+def render(protocol, query, inventory, degraded=False, labels=None, notice=None):
+    """Markdown answer in the same shape the model is asked to produce."""
+    labels = labels or LABELS
+    have, missing = cross_reference(protocol, inventory)
+    lines = []
+    if degraded:
+        lines += [labels["degraded_notice"] + (f" {notice}" if notice else ""), ""]
+    lines.append(f"**{protocol.get('title', protocol.get('id', 'First Aid'))}**")
+    lines.append("")
+    for i, step in enumerate(protocol.get('steps', []), 1):
+        lines.append(f"{i}. {step}")
+    if protocol.get('red_flags'):
+        lines.append("")
+        lines.append(f"🚨 **{labels['red_flags']}** {'; '.join(protocol['red_flags'])}.")
+    if have:
+        lines.append(f"✅ {labels['use_from_inventory']} {', '.join(have)}.")
+    for item in missing:
+        lines.append(f"⚠️ {labels['missing_item'].format(item=item)}")
+
+    lines.append("")
+    spot = spot_for(query, protocol)
+    if spot:
+        lines.append(f"[SPOT_ID: {spot}]")
+    lines.append(f"[PROCEDURE: {', '.join(_trailer_item(s) for s in protocol.get('steps', []))}]")
+    lines.append(f"[SEARCH: {', '.join(_trailer_item(s) for s in missing + have)}]")
+    return "\n".join(lines)
+
+
+class OfflineResponder:
+    def __init__(self, min_score=OFFLINE_MIN_SCORE, min_margin=OFFLINE_MIN_MARGIN,
+                 fallback_min_score=FALLBACK_MIN_SCORE):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.fallback_min_score = fallback_min_score
+        self._lock = threading.Lock()
+        self.counts = {"local": 0, "fallback": 0, "llm": 0, "cached": 0, "failed": 0}
+
+    def _confident(self, ranked):
+        if not ranked or ranked[0][0] < self.min_score:
+            return False
+        return len(ranked) < 2 or ranked[0][0] >= ranked[1][0] * self.min_margin
+
+    def answer(self, query, snapshot, inventory, language="English", degraded=False):
+        """
+        Renders a local answer from the snapshot's protocols, or returns None if
+        the match is too weak (or, outside degraded mode, the question is critical
+        or urgent, or the knowledge base is in another language than the one
+        requested). A degraded answer in another language says so, in the text
+        and in "language".
+        """
+        started = time.perf_counter()
+        requested = str(language or 'English')
+        kb_language = str(snapshot.knowledge_base.get('metadata', {}).get('language', 'English'))
+        other_language = requested.lower() != kb_language.lower()
+        if not degraded and other_language:
+            return None
+        ranked = snapshot.protocol_index.search(
+            query, top_k=2, min_score=self.fallback_min_score if degraded else self.min_score / self.min_margin,
+            require_phrase=True,
+        )
+        if not ranked or (not degraded and not self._confident(ranked)):
+            return None
+        if not degraded and scheduler.classify(query, [p for _, p in ranked]) != scheduler.ROUTINE:
+            return None # Red flag or escalating protocol: the model reads the details
+        score, protocol = ranked[0]
+        labels = labels_for(snapshot)
+        notice = labels["other_language_notice"].format(requested=requested, language=kb_language) if other_language else None
+        return {
+            "response": render(protocol, query, inventory, degraded=degraded, labels=labels, notice=notice),
+            "language": kb_language,
+            "context_used": True,
+            "source": "fallback" if degraded else "local",
+            "protocol": protocol.get('id'),
+            "confidence": score,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def record(self, source):
+        with self._lock:
+            self.counts[source] = self.counts.get(source, 0) + 1
+        metrics.annotate(source=source)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        local = counts["local"] + counts["fallback"]
+        return dict(counts, total=total, local_fraction=round(local / total, 4) if total else 0.0,
+                    min_score=self.min_score, min_margin=self.min_margin)
@@ -0,0 +1,240 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from string import Template
+
+# Prompt Assembly
+# The static template is compiled once; serialized inventory/protocol fragments
+# are cached by version; each dynamic section is capped against a token budget.
+
+# Rough tokens-per-character ratio for Gemini's tokenizer on English text
+CHARS_PER_TOKEN = 4
+
+SECTION_BUDGETS = {
+    "history": int(os.getenv("PROMPT_HISTORY_TOKENS", "600")),
+    "inventory": int(os.getenv("PROMPT_INVENTORY_TOKENS", "600")),
+    "protocols": int(os.getenv("PROMPT_PROTOCOL_TOKENS", "1500")),
+}
+MAX_HISTORY_TURNS = 6
+
+CONTEXT_TEMPLATE = Template("""--- TECHNICAL CONTEXT ---
+$history
+AVAILABLE INVENTORY (Medicines & Equipment):
+$inventory
+
+CONTEXT DATA:
+$protocols
+
+PATIENT DETAILS:
+- Age: $age, Gender: $gender, Location: $location, Duration: $duration
+
+$output_format
+LANGUAGE: You must strictly respond in $language.
+""")
+
+TRAILER_FORMAT = """FORMAT (MUST BE LAST LINES):
+[SPOT_ID: <number>]
+[PROCEDURE: <step_1>, <step_2>, ...]
+[SEARCH: <missing_item_1>, <item_to_use_from_inventory>, ...]
+"""
+# Structured output (see structured.py): same fields, as a JSON object
+JSON_FORMAT = """FORMAT: Reply with one JSON object:
+"answer": your advice in markdown (no bracketed tags),
+"spot_id": <number>,
+"procedure": [<step_1>, <step_2>, ...],
+"search": [<missing_item_1>, <item_to_use_from_inventory>, ...]
+"""
+
+# Single-call vision mode: the model reports what it saw in the same response
+KEYWORDS_FORMAT = "[KEYWORDS: <3-5 keywords for the injury type and items visible in the image>]\n"
+JSON_KEYWORDS_FORMAT = '"image_keywords": [<3-5 keywords for the injury type and items visible in the image>]\n'
+KEYWORDS_RE = re.compile(r"\[KEYWORDS:\s*(.*?)\]", re.IGNORECASE | re.DOTALL)
+
+
+def split_image_keywords(text):
+    """Removes the [KEYWORDS: ...] line from a response, returning (text, keywords)."""
+    match = KEYWORDS_RE.search(text or "")
+    if not match:
+        return text, None
+    cleaned = (text[:match.start()] + text[match.end():]).strip()
+    return cleaned, match.group(1).strip() or None
+
+
+def _output_format(json_output, ask_image_keywords):
+    if json_output:
+        return JSON_FORMAT + (JSON_KEYWORDS_FORMAT if ask_image_keywords else "")
+    return TRAILER_FORMAT + (KEYWORDS_FORMAT if ask_image_keywords else "")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _clip(text, max_tokens):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - 3)].rstrip() + "..."
+
+
+def render_protocol(protocol):
+    """Compact text form of a protocol (far fewer tokens than indented JSON)."""
+    lines = [f"- PROTOCOL: {protocol.get('title', protocol.get('id', ''))} ({protocol.get('grade_level', 'all')})"]
+    if protocol.get('steps'):
+        lines.append(f"  STEPS: {'; '.join(protocol['steps'])}")
+    if protocol.get('red_flags'):
+        lines.append(f"  RED FLAGS: {', '.join(protocol['red_flags'])}")
+    return "\n".join(lines)
+
+
+class PromptBuilder:
+    def __init__(self, budgets=None, fragment_cache_size=256):
+        self.budgets = dict(SECTION_BUDGETS, **(budgets or {}))
+        self._fragments = OrderedDict()
+        self._cache_size = fragment_cache_size
+        self._lock = threading.Lock()
+
+    def _fragment(self, key, build):
+        with self._lock:
+            value = self._fragments.get(key)
+            if value is not None:
+                self._fragments.move_to_end(key)
+                return value
+        value = build()
+        with self._lock:
+            self._fragments[key] = value
+            while len(self._fragments) > self._cache_size:
+                self._fragments.popitem(last=False)
+        return value
+
+    # --- Sections ---
+    def inventory_section(self, inventory, version):
+        def build():
+            items = list(inventory.get('medicines', []))
+            if not items:
+                return "None listed."
+            budget = self.budgets["inventory"]
+            out, used = [], 0
+            for i, item in enumerate(items):
+                cost = estimate_tokens(str(item)) + 1
+                if used + cost > budget:
+                    out.append(f"... (+{len(items) - i} more items not shown)")
+                    break
+                out.append(str(item))
+                used += cost
+            return json.dumps(out, ensure_ascii=False, separators=(',', ':'))
+        return self._fragment(("inventory", version, self.budgets["inventory"]), build)
+
+    def supplies_section(self, found, version, kb_version, protocol_ids, total_items=0):
+        """Only the have/missing supplies for the matched protocols (see supplies.py)."""
+        def build():
+            lines = []
+            if found["have"]:
+                lines.append("Have: " + "; ".join(str(item['name']) for item in found["have"]))
+            if found["missing"]:
+                lines.append("Missing: " + "; ".join(found["missing"]))
+            if not lines:
+                lines.append("No supplies needed for these protocols.")
+            others = total_items - len(found["have"])
+            if others > 0:
+                lines.append(f"(+{others} other items in stock)")
+            return _clip("\n".join(lines), self.budgets["inventory"])
+        # Same protocol ids can need different supplies in another shard or KB version
+        return self._fragment(("supplies", version, kb_version, protocol_ids, self.budgets["inventory"]), build)
+
+    def protocol_section(self, protocols, version, rendered=None):
+        ids = tuple(p.get('id', '') for p in protocols)
+
+        def build():
+            if not protocols:
+                return "No specific protocol matched in Knowledge Base."
+            budget = self.budgets["protocols"]
+            out, used = [], 0
+            # Protocols arrive ranked; lower-ranked ones are dropped first
+            for protocol in protocols:
+                text = (rendered or {}).get(protocol.get('id')) or render_protocol(protocol)
+                cost = estimate_tokens(text)
+                if used + cost > budget:
+                    if not out:
+                        out.append(_clip(text, budget))
+                    break
+                out.append(text)
+                used += cost
+            return "\n".join(out)
+        return self._fragment(("protocols", version, ids, self.budgets["protocols"]), build)
+
+    def history_section(self, history):
+        if not history:
+            return ""
+        # Server-side sessions (sessions.py) lead with a rolling summary of folded turns
+        rolled = history[0] if history[0].get('role') == 'summary' else None
+        if rolled:
+            history = history[1:]
+        budget = self.budgets["history"]
+        turns = history[-MAX_HISTORY_TURNS:]
+        older = history[:-MAX_HISTORY_TURNS]
+
+        kept, used = [], 0
+        # Keep the newest turns verbatim, dropping older ones once over budget
+        for msg in reversed(turns):
+            role = "Patient" if msg.get('role') == 'user' else "Dr. Guardian"
+            line = f"{role}: {msg.get('text', '')}"
+            cost = estimate_tokens(line)
+            if used + cost > budget:
+                if not kept:
+                    kept.append(_clip(line, budget))
+                older = history[:len(history) - len(kept)]
+                break
+            kept.append(line)
+            used += cost
+        kept.reverse()
+
+        summary = ""
+        omitted = len(older) + (rolled.get('folded', 0) if rolled else 0)
+        earlier_questions = (rolled.get('topics', []) if rolled else []) + \
+            [m.get('text', '') for m in older if m.get('role') == 'user']
+        if earlier_questions:
+            topics = "; ".join(_clip(q, 12) for q in earlier_questions[-3:])
+            summary = f"(Earlier: {omitted} turns omitted. Patient asked about: {topics})\n"
+        if rolled and rolled.get('advice'):
+            summary += f"(Advice already given: {'; '.join(_clip(a, 20) for a in rolled['advice'])})\n"
+        return "\nCONVERSATION HISTORY:\n" + summary + "\n".join(kept) + "\n"
+
+    # --- Assembly ---
+    def build(self, user_query, language, patient_metadata, history, matches,
+              inventory, inventory_version, kb_version="", ask_image_keywords=False,
+              rendered_protocols=None, json_output=False, supplies=None):
+        """
+        Returns (prompt_parts, section_token_counts). With supplies (the
+        cross-reference for matches) the inventory section lists only those
+        items instead of the whole medicines list.
+        """
+        meta = patient_metadata or {}
+        if supplies is not None:
+            inventory_text = self.supplies_section(
+                supplies, inventory_version, kb_version, tuple(m.get('id', '') for m in matches),
+                len(inventory.get('items') or []),
+            )
+        else:
+            inventory_text = self.inventory_section(inventory, inventory_version)
+        sections = {
+            "history": self.history_section(history),
+            "inventory": inventory_text,
+            "protocols": self.protocol_section(matches, kb_version, rendered_protocols),
+        }
+        context = CONTEXT_TEMPLATE.substitute(
+            sections,
+            age=meta.get('age', 'N/A'),
+            gender=meta.get('gender', 'N/A'),
+            location=meta.get('location', 'N/A'),
+            duration=meta.get('duration', 'N/A'),
+            language=language,
+            output_format=_output_format(json_output, ask_image_keywords),
+        )
+        query = f"User Query: {user_query}"
+        sizes = {name: estimate_tokens(text) for name, text in sections.items()}
+        sizes["query"] = estimate_tokens(query)
+        sizes["total"] = estimate_tokens(context) + sizes["query"]
+        return [context, query], sizes
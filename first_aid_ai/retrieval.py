@@ -0,0 +1,214 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import defaultdict, deque
+
+# Protocol Retrieval Engine
+# Built once per knowledge base load. Query cost depends on the query length,
+# not on (protocols x keywords) like the old linear substring scan.
+
+
+def _mark_ranges(last=0x1FFFF):
+    """Regex class ranges for every combining mark (Mn, Mc, Me) in the BMP and SMP."""
+    ranges, start = [], None
+    for cp in range(last + 2):
+        is_mark = cp <= last and unicodedata.category(chr(cp)).startswith("M")
+        if is_mark and start is None:
+            start = cp
+        elif not is_mark and start is not None:
+            ranges.append(f"\\U{start:08x}" if start == cp - 1 else f"\\U{start:08x}-\\U{cp - 1:08x}")
+            start = None
+    return "".join(ranges)
+
+
+# Combining marks (vowel signs, viramas, diacritics) that Python's \w leaves
+# out, plus ZWNJ/ZWJ; without them Hindi "साँस" would split into "स", "स".
+# Only marks: danda, digits and other script punctuation still split words.
+MARKS = _mark_ranges() + "\\u200c\\u200d"
+# Words in any script: letters and digits (not "_") plus their combining marks
+TOKEN_RE = re.compile(rf"(?:[^\W_]|[{MARKS}])+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "he",
+    "her", "his", "i", "in", "is", "it", "its", "my", "of", "on", "or", "she",
+    "so", "that", "the", "their", "them", "they", "this", "to", "was", "were",
+    "with", "you", "your", "do", "did", "have", "had", "what", "how", "me",
+}
+
+# Field weights used when building the weighted term frequencies (BM25F-lite)
+FIELD_WEIGHTS = {
+    "keywords": 3.0,
+    "title": 2.0,
+    "red_flags": 1.0,
+    "steps": 0.5,
+}
+
+# Bonus added when a whole keyword / title phrase appears in the query
+KEYWORD_HIT_BONUS = 2.0
+TITLE_HIT_BONUS = 5.0
+
+# Fields whose words name the emergency itself. A protocol is only returned when
+# the query shares at least one of these terms with it; a step word like "after"
+# or "cool" on its own is incidental, whatever it scores.
+ANCHOR_FIELDS = ("keywords", "title", "red_flags")
+
+# Floor on top of the anchor requirement, for single weak anchor terms
+DEFAULT_MIN_SCORE = 1.5
+
+
+def stem(token):
+    """Very light suffix stripping so 'bleeding'/'bleed' and 'burns'/'burn' meet."""
+    if len(token) > 5 and token.endswith("ing"):
+        return token[:-3]
+    if len(token) > 4 and token.endswith("ed"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text, drop_stopwords=True):
+    tokens = TOKEN_RE.findall(text.lower())
+    if drop_stopwords:
+        tokens = [t for t in tokens if t not in STOPWORDS]
+    return [stem(t) for t in tokens]
+
+
+def terms(tokens):
+    """Unigrams plus adjacent bigrams, so phrases like 'not breathing' score as a unit."""
+    out = list(tokens)
+    out.extend(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return out
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over token sequences.
+    Finds every registered phrase in a single pass over the query tokens.
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, phrase_tokens, payload):
+        if not phrase_tokens:
+            return
+        node = 0
+        for tok in phrase_tokens:
+            nxt = self.goto[node].get(tok)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][tok] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append(payload)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for tok, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and tok not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(tok, 0) if node else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, tokens):
+        node = 0
+        for tok in tokens:
+            while node and tok not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(tok, 0)
+            for payload in self.output[node]:
+                yield payload
+
+
+class ProtocolIndex:
+    """
+    Inverted index with BM25 scoring plus an Aho-Corasick keyword matcher.
+    search() returns [(score, protocol), ...] sorted by descending score.
+    """
+
+    def __init__(self, protocols, k1=1.2, b=0.75):
+        self.protocols = list(protocols or [])
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(doc_idx, weighted_tf)]
+        self.doc_len = []
+        self.anchors = defaultdict(set)  # term -> {doc_idx} it names in ANCHOR_FIELDS
+        self.matcher = KeywordMatcher()
+        self._build()
+
+    def _build(self):
+        for idx, protocol in enumerate(self.protocols):
+            tf = defaultdict(float)
+            for field, weight in FIELD_WEIGHTS.items():
+                value = protocol.get(field, [])
+                texts = value if isinstance(value, list) else [value]
+                for text in texts:
+                    for term in terms(tokenize(str(text))):
+                        tf[term] += weight
+                    if field in ANCHOR_FIELDS:
+                        # "Unconscious -> Start CPR": the action after the arrow isn't a symptom
+                        for term in terms(tokenize(str(text).split("->")[0])):
+                            self.anchors[term].add(idx)
+            for term, freq in tf.items():
+                self.postings[term].append((idx, freq))
+            self.doc_len.append(sum(tf.values()))
+
+            for kw in protocol.get("keywords", []):
+                self.matcher.add(tokenize(kw, drop_stopwords=False), (idx, KEYWORD_HIT_BONUS))
+            title = protocol.get("title", "")
+            if title:
+                self.matcher.add(tokenize(title, drop_stopwords=False), (idx, TITLE_HIT_BONUS))
+
+        self.matcher.build()
+        n = len(self.protocols)
+        self.avg_len = (sum(self.doc_len) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.protocols)
+
+    def score(self, query, require_phrase=False):
+        """
+        Returns {doc_idx: score} for every protocol that shares a keyword, title or
+        red-flag term with the query (require_phrase: a whole keyword or title).
+        """
+        scores = defaultdict(float)
+        anchored, phrased = set(), set()
+        query_terms = set(terms(tokenize(query)))
+        for term in query_terms:
+            anchored.update(self.anchors.get(term, ()))
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for idx, tf in docs:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[idx] / (self.avg_len or 1.0))
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        for idx, bonus in self.matcher.find(tokenize(query, drop_stopwords=False)):
+            scores[idx] += bonus
+            phrased.add(idx)
+        keep = phrased if require_phrase else anchored | phrased
+        return {idx: s for idx, s in scores.items() if idx in keep}
+
+    def search(self, query, top_k=3, min_score=DEFAULT_MIN_SCORE, require_phrase=False):
+        scores = self.score(query, require_phrase)
+        ranked = heapq.nlargest(
+            top_k,
+            ((s, idx) for idx, s in scores.items() if s > min_score),
+            key=lambda x: x[0],
+        )
+        return [(round(s, 4), self.protocols[idx]) for s, idx in ranked]
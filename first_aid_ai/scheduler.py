@@ -0,0 +1,317 @@
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+import metrics
+from retrieval import tokenize
+
+# Priority Scheduling & Admission Control
+# Chat requests that need a model call are classified by urgency from what
+# retrieval already found: the question describes a red flag of a matched
+# protocol (or a general emergency sign) -> critical; the top protocol is one
+# that can escalate to 112/CPR -> urgent; everything else -> routine. Model
+# calls then go through a fixed number of slots per process. Waiters queue per
+# priority (bounded), critical first, and within a priority tenants take turns
+# so one busy school can't fill the queue. Routine work never takes the last
+# RESERVED_SLOTS or the last KEY_RESERVE key tokens. When a routine/urgent
+# request can't get a slot in time it is degraded to the offline protocol
+# answer (or shed with a retry hint); critical requests are never turned away.
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER", "1") != "0"
+
+CRITICAL, URGENT, ROUTINE = 0, 1, 2
+PRIORITY_NAMES = ("critical", "urgent", "routine")
+
+MAX_ACTIVE = int(os.getenv("SCHED_MAX_ACTIVE", "8"))              # concurrent model calls per process
+RESERVED_SLOTS = int(os.getenv("SCHED_RESERVED_SLOTS", "2"))      # never used by routine work
+QUEUE_DEPTH = (
+    int(os.getenv("SCHED_QUEUE_CRITICAL", "64")),
+    int(os.getenv("SCHED_QUEUE_URGENT", "32")),
+    int(os.getenv("SCHED_QUEUE_ROUTINE", "16")),
+)
+MAX_WAIT = (
+    float(os.getenv("SCHED_WAIT_CRITICAL_SECONDS", "5")),   # then runs over the slot limit
+    float(os.getenv("SCHED_WAIT_URGENT_SECONDS", "10")),
+    float(os.getenv("SCHED_WAIT_ROUTINE_SECONDS", "3")),
+)
+TENANT_SHARE = float(os.getenv("SCHED_TENANT_SHARE", "0.5"))      # max share of a queue one tenant may hold
+KEY_RESERVE = float(os.getenv("SCHED_KEY_RESERVE", "2"))          # key tokens kept for urgent/critical calls
+QUOTA_CHECK_SECONDS = 0.5
+RETRY_AFTER_SECONDS = 5
+
+RUN, DEGRADE = "run", "degrade"
+
+# Signs that make any question critical, whatever protocol it matched
+EMERGENCY_SIGNS = (
+    "not breathing", "stopped breathing", "can't breathe", "cannot breathe", "difficulty breathing",
+    "struggling to breathe", "unconscious", "unresponsive", "not responding", "not waking up", "passed out",
+    "collapsed", "no pulse", "choking", "seizure", "fitting", "convulsing", "anaphylaxis", "throat closing",
+    "throat swelling", "turning blue", "blue lips", "heavy bleeding", "bleeding heavily", "severe bleeding",
+    "won't stop bleeding", "bone sticking out", "neck injury", "back injury",
+)
+_ESCALATION_RE = re.compile(r"\b(112|cpr|call|ambulance|paramedic)\b", re.IGNORECASE)
+
+
+def _phrase(text):
+    return tuple(tokenize(text, drop_stopwords=False))
+
+
+# First word -> sign phrases starting with it, so a query is scanned once
+_SIGNS = {}
+for _sign in EMERGENCY_SIGNS:
+    _SIGNS.setdefault(_phrase(_sign)[0], []).append(_phrase(_sign))
+
+
+def _has_sign(tokens):
+    for i, token in enumerate(tokens):
+        for phrase in _SIGNS.get(token, ()):
+            if tuple(tokens[i:i + len(phrase)]) == phrase:
+                return True
+    return False
+
+
+@lru_cache(maxsize=4096)
+def _flag_terms(red_flags):
+    """Content words of each red flag, without the '-> CALL 112' action and numbers."""
+    out = []
+    for flag in red_flags:
+        condition = flag.split("->")[0]
+        words = tuple(t for t in tokenize(condition) if not t.isdigit())
+        if words:
+            out.append(frozenset(words))
+    return tuple(out)
+
+
+@lru_cache(maxsize=4096)
+def _escalates(red_flags):
+    return any(_ESCALATION_RE.search(flag) for flag in red_flags)
+
+
+def _flag_hit(terms, query_terms):
+    # Short flags ("Vomiting", "Heavy bleeding") need every word, longer ones two thirds
+    needed = len(terms) if len(terms) <= 2 else math.ceil(len(terms) * 2 / 3)
+    return len(terms & query_terms) >= needed
+
+
+def classify(query, matches):
+    """CRITICAL, URGENT or ROUTINE for a question and its retrieved protocols (microseconds)."""
+    tokens = tokenize(query or "", drop_stopwords=False)
+    if _has_sign(tokens):
+        return CRITICAL
+    query_terms = frozenset(tokenize(query or ""))
+    for protocol in matches:
+        red_flags = tuple(protocol.get('red_flags') or ())
+        if any(_flag_hit(terms, query_terms) for terms in _flag_terms(red_flags)):
+            return CRITICAL
+    if matches and _escalates(tuple(matches[0].get('red_flags') or ())):
+        return URGENT
+    return ROUTINE
+
+
+class _Ticket:
+    __slots__ = ("priority", "tenant", "enqueued", "admitted", "wake")
+
+    def __init__(self, priority, tenant, wake):
+        self.priority = priority
+        self.tenant = tenant
+        self.enqueued = time.perf_counter()
+        self.admitted = False
+        self.wake = wake
+
+
+class Scheduler:
+    def __init__(self, max_active=MAX_ACTIVE, reserved=RESERVED_SLOTS, queue_depth=QUEUE_DEPTH,
+                 max_wait=MAX_WAIT, tenant_share=TENANT_SHARE, key_reserve=KEY_RESERVE, quota=None):
+        self.max_active = max(1, max_active)
+        self.reserved = min(max(0, reserved), self.max_active - 1)
+        self.queue_depth = queue_depth
+        self.max_wait = max_wait
+        self.tenant_share = tenant_share
+        self.key_reserve = key_reserve
+        self.quota = quota  # callable -> key tokens available now, or None to skip the check
+        self.active = 0
+        self._queues = [OrderedDict() for _ in PRIORITY_NAMES]  # tenant -> deque of tickets, in turn order
+        self._depth = [0] * len(PRIORITY_NAMES)
+        self._lock = threading.Lock()
+        self._quota_value = None
+        self._quota_checked = 0.0
+        self.counts = {name: {"run": 0, "queued": 0, "degraded": 0, "overflow": 0} for name in PRIORITY_NAMES}
+
+    # --- Bookkeeping (call with the lock held) ---
+    def _limit(self, priority):
+        return self.max_active - self.reserved if priority == ROUTINE else self.max_active
+
+    def _can_run(self, priority):
+        # A free slot for this class, and nobody at this priority or above is already waiting
+        return self.active < self._limit(priority) and not any(self._depth[:priority + 1])
+
+    def _tenant_full(self, priority, tenant):
+        cap = max(1, int(self.queue_depth[priority] * self.tenant_share))
+        return len(self._queues[priority].get(tenant, ())) >= cap
+
+    def _dispatch(self):
+        """Hands freed slots to waiters: highest priority first, tenants round-robin."""
+        for priority, queue in enumerate(self._queues):
+            while queue and self.active < self._limit(priority):
+                tenant, tickets = next(iter(queue.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    queue.move_to_end(tenant)
+                else:
+                    del queue[tenant]
+                self._depth[priority] -= 1
+                ticket.admitted = True
+                self.active += 1
+                ticket.wake()
+            if queue:
+                return  # lower priorities wait behind this one
+
+    def _remove(self, ticket):
+        tickets = self._queues[ticket.priority].get(ticket.tenant)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            self._depth[ticket.priority] -= 1
+            if not tickets:
+                del self._queues[ticket.priority][ticket.tenant]
+
+    def _record(self, priority, outcome):
+        self.counts[PRIORITY_NAMES[priority]][outcome] += 1
+        metrics.scheduler_decisions.inc(priority=PRIORITY_NAMES[priority], outcome=outcome)
+
+    # --- Key quota ---
+    # quota() reads the shared key state (SQLite), so admit() refreshes the cached
+    # value in the caller's thread and admit_async() in a worker thread; _enter
+    # only ever reads the cache.
+    def _quota_due(self, priority, own_key):
+        """True if this caller should refresh the key headroom (at most every QUOTA_CHECK_SECONDS)."""
+        if self.quota is None or priority != ROUTINE or own_key:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now < self._quota_checked:
+                return False
+            self._quota_checked = now + QUOTA_CHECK_SECONDS
+            return True
+
+    def _refresh_quota(self):
+        try:
+            self._quota_value = self.quota()
+        except Exception:
+            self._quota_value = None
+
+    def _quota_short(self, priority):
+        """True when only the reserve is left, which routine work may not spend."""
+        if self.quota is None or priority != ROUTINE:
+            return False
+        return self._quota_value is not None and self._quota_value < self.key_reserve
+
+    # --- Admission ---
+    def _enter(self, priority, tenant, own_key, wake):
+        """(decision, ticket): RUN or DEGRADE right away with no ticket, or a queued ticket."""
+        tenant = tenant or "default"
+        if not own_key and self._quota_short(priority):
+            with self._lock:
+                self._record(priority, "degraded")
+            return DEGRADE, None
+        with self._lock:
+            if self._can_run(priority):
+                self.active += 1
+                self._record(priority, "run")
+                return RUN, None
+            if self._depth[priority] >= self.queue_depth[priority] or self._tenant_full(priority, tenant):
+                if priority == CRITICAL:
+                    self.active += 1
+                    self._record(priority, "overflow")
+                    return RUN, None
+                self._record(priority, "degraded")
+                return DEGRADE, None
+            ticket = _Ticket(priority, tenant, wake)
+            self._queues[priority].setdefault(tenant, deque()).append(ticket)
+            self._depth[priority] += 1
+            self._record(priority, "queued")
+            return None, ticket
+
+    def _leave_queue(self, ticket):
+        """After a wait timed out: RUN if the slot arrived meanwhile, else overflow or degrade."""
+        with self._lock:
+            if not ticket.admitted:
+                self._remove(ticket)
+                if ticket.priority == CRITICAL:
+                    # Bounded wait for critical cases: run over the limit rather than wait longer
+                    self.active += 1
+                    ticket.admitted = True
+                    self._record(ticket.priority, "overflow")
+                else:
+                    self._record(ticket.priority, "degraded")
+        metrics.scheduler_wait_seconds.observe(time.perf_counter() - ticket.enqueued,
+                                               priority=PRIORITY_NAMES[ticket.priority])
+        return RUN if ticket.admitted else DEGRADE
+
+    def _cancel(self, ticket):
+        # Client went away while queued: give the slot back if it was already granted
+        with self._lock:
+            if ticket.admitted:
+                self.active = max(0, self.active - 1)
+                self._dispatch()
+            else:
+                self._remove(ticket)
+
+    def admit(self, priority, tenant=None, own_key=False):
+        """
+        RUN (a slot is held; call release() when the model call ends) or DEGRADE
+        (answer from the knowledge base, or shed). Blocks up to max_wait[priority].
+        """
+        if self._quota_due(priority, own_key):
+            self._refresh_quota()
+        event = threading.Event()
+        decision, ticket = self._enter(priority, tenant, own_key, event.set)
+        if ticket is None:
+            return decision
+        event.wait(self.max_wait[priority])
+        return self._leave_queue(ticket)
+
+    async def admit_async(self, priority, tenant=None, own_key=False):
+        """admit() for the event loop: waiting suspends the coroutine, not the thread."""
+        if self._quota_due(priority, own_key):
+            await asyncio.to_thread(self._refresh_quota)
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(True))
+
+        decision, ticket = self._enter(priority, tenant, own_key, wake)
+        if ticket is None:
+            return decision
+        try:
+            await asyncio.wait_for(woken, self.max_wait[priority])
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            self._cancel(ticket)
+            raise
+        return self._leave_queue(ticket)
+
+    def release(self):
+        with self._lock:
+            self.active = max(0, self.active - 1)
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SCHEDULER_ENABLED,
+                "active": self.active,
+                "max_active": self.max_active,
+                "reserved_slots": self.reserved,
+                "queued": {name: self._depth[p] for p, name in enumerate(PRIORITY_NAMES)},
+                "queue_depth": dict(zip(PRIORITY_NAMES, self.queue_depth)),
+                "key_tokens": self._quota_value,
+                "key_reserve": self.key_reserve,
+                "counts": {name: dict(c) for name, c in self.counts.items()},
+            }
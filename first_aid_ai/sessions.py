@@ -0,0 +1,224 @@
+import json
+import os
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Conversation Sessions
+# The browser sends a session_id instead of re-posting the whole chat. Each turn
+# appends only its delta (question + answer). Turns beyond SESSION_KEEP_TURNS
+# are folded into a rolling summary (turn count, recent questions, advice
+# given), so prompt size stays bounded however long a case runs. Sessions live
+# in an in-memory LRU with a TTL, and every turn is also written to a SQLite
+# file (SESSION_DB, a temp-dir file by default, empty to disable) so other
+# gunicorn workers and evicted sessions can read it back (a row revision keeps
+# each worker's copy fresh).
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "2000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL_SECONDS", "7200"))
+SESSION_KEEP_TURNS = int(os.getenv("SESSION_KEEP_TURNS", "6"))
+SUMMARY_TOPICS = 5
+SUMMARY_ADVICE = 3
+MAX_TURN_CHARS = 4000
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+# The answer trailer is UI markup, not conversation; no need to replay it
+_TRAILER_RE = re.compile(r"^\s*\[(SPOT_ID|PROCEDURE|SEARCH|KEYWORDS):.*$", re.IGNORECASE | re.MULTILINE)
+
+
+def default_db_path():
+    return os.getenv("SESSION_DB", os.path.join(tempfile.gettempdir(), "first_aid_sessions.db")) or None
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+def valid_session_id(session_id):
+    return bool(session_id) and bool(_ID_RE.match(str(session_id)))
+
+
+def _clip(text, limit):
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def _headline(answer):
+    """First meaningful line of an answer (usually the protocol title or first step)."""
+    for line in answer.splitlines():
+        line = line.strip().strip("*#").strip()
+        if line and not line.startswith(("⚠️", "🚨")):
+            return _clip(line, 80)
+    return ""
+
+
+class Session:
+    def __init__(self, session_id, turns=None, summary=None, rev=0, updated=None):
+        self.id = session_id
+        self.turns = turns or []  # [{"role": "user"|"model", "text": ...}]
+        self.summary = summary or {"folded": 0, "topics": [], "advice": []}
+        self.rev = rev
+        self.updated = updated or time.time()
+
+    def append(self, role, text, keep_turns):
+        if role == "model":
+            text = _TRAILER_RE.sub("", text).strip()
+        self.turns.append({"role": role, "text": _clip(text, MAX_TURN_CHARS) if role == "user" else text[:MAX_TURN_CHARS]})
+        while len(self.turns) > keep_turns:
+            self._fold(self.turns.pop(0))
+        self.rev += 1
+        self.updated = time.time()
+
+    def _fold(self, turn):
+        summary = self.summary
+        summary["folded"] += 1
+        if turn["role"] == "user":
+            summary["topics"] = (summary["topics"] + [_clip(turn["text"], 60)])[-SUMMARY_TOPICS:]
+        else:
+            headline = _headline(turn["text"])
+            if headline and headline not in summary["advice"]:
+                summary["advice"] = (summary["advice"] + [headline])[-SUMMARY_ADVICE:]
+
+    def history(self):
+        """Prompt history: a summary entry (when turns were folded) followed by the raw turns."""
+        if not self.summary["folded"]:
+            return list(self.turns)
+        return [dict(self.summary, role="summary")] + self.turns
+
+    def to_json(self):
+        return json.dumps({"turns": self.turns, "summary": self.summary})
+
+
+class SessionStore:
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL, keep_turns=SESSION_KEEP_TURNS, db_path=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.keep_turns = keep_turns
+        self.db_path = db_path if db_path is not None else default_db_path()
+        self._sessions = OrderedDict()  # id -> Session, least recently used first
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counts = {"created": 0, "hits": 0, "restored": 0, "evicted": 0, "expired": 0}
+        if self.db_path:
+            try:
+                self._db().execute(
+                    "CREATE TABLE IF NOT EXISTS sessions ("
+                    "id TEXT PRIMARY KEY, rev INTEGER, updated REAL, data TEXT)"
+                )
+            except Exception as e:
+                print(f"SessionStore: SQLite spill unavailable, sessions stay in memory ({e})")
+                self.db_path = None
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        # The parent's connection is unusable after fork(); _db() reconnects lazily
+        self._local = threading.local()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    # --- SQLite spill ---
+    def _load(self, session_id, newer_than=-1):
+        try:
+            row = self._db().execute(
+                "SELECT rev, updated, data FROM sessions WHERE id = ? AND rev > ?", (session_id, newer_than),
+            ).fetchone()
+        except Exception as e:
+            print(f"SessionStore: could not read session ({e})")
+            return None
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        data = json.loads(row[2])
+        return Session(session_id, data.get("turns"), data.get("summary"), rev=row[0], updated=row[1])
+
+    def _save(self, session):
+        try:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, rev, updated, data) VALUES (?, ?, ?, ?)",
+                (session.id, session.rev, session.updated, session.to_json()),
+            )
+            if session.rev % 50 == 1:
+                conn.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+        except Exception as e:
+            print(f"SessionStore: could not save session ({e})")
+
+    # --- Public API ---
+    def get(self, session_id):
+        """The live session, or None if it never existed or has expired."""
+        if not valid_session_id(session_id):
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if session.updated < time.time() - self.ttl:
+                    del self._sessions[session_id]
+                    self.counts["expired"] += 1
+                    session = None
+                else:
+                    self._sessions.move_to_end(session_id)
+        if self.db_path:
+            # Another worker may have appended since this copy was cached
+            fresher = self._load(session_id, newer_than=session.rev if session else -1)
+            if fresher is not None:
+                self._count("restored" if session is None else "hits")
+                self._put(fresher)
+                return fresher
+        if session is not None:
+            self._count("hits")
+        return session
+
+    def _put(self, session):
+        with self._lock:
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.counts["evicted"] += 1
+
+    def history(self, session_id):
+        session = self.get(session_id)
+        return session.history() if session else []
+
+    def append(self, session_id, user_text, answer_text):
+        """Adds one question/answer turn, creating the session on first use."""
+        if not valid_session_id(session_id):
+            return None
+        session = self.get(session_id)
+        if session is None:
+            session = Session(session_id)
+            self._count("created")
+        with self._lock:
+            session.append("user", user_text, self.keep_turns)
+            session.append("model", answer_text, self.keep_turns)
+        self._put(session)
+        if self.db_path:
+            self._save(session)
+        return session
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if self.db_path:
+            try:
+                self._db().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            except Exception as e:
+                print(f"SessionStore: could not delete session ({e})")
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, live=len(self._sessions), max_sessions=self.max_sessions,
+                        keep_turns=self.keep_turns, spill=bool(self.db_path))
@@ -0,0 +1,163 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import embeddings
+from content import ContentManager, SYSTEM_PROMPT_PATH
+
+# Knowledge Base Shards
+# Schools (tenants) can ship their own protocol sets per language and grade band:
+#
+#   knowledge_bases/<tenant>/<language>.json           e.g. greenvalley/hindi.json
+#   knowledge_bases/<tenant>/<language>.<grade>.json   e.g. greenvalley/hindi.6-8.json
+#   knowledge_bases/<tenant>/system_prompt.md          optional per-tenant prompt
+#
+# A request is routed to the most specific shard that exists, falling back to
+# the tenant's English set and finally to the global knowledge_base.json.
+# Shard indexes are built on first use and kept in an LRU, so each search only
+# touches one shard and idle tenants are evicted from memory.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARDS_DIR = os.getenv("KB_SHARDS_DIR", os.path.join(BASE_DIR, 'knowledge_bases'))
+MAX_LOADED_SHARDS = int(os.getenv("KB_MAX_LOADED_SHARDS", "32"))
+DEFAULT_TENANT = "default"
+FALLBACK_LANGUAGE = "english"
+
+_SLUG_RE = re.compile(r"[^a-z0-9_-]+")
+
+
+def slug(value):
+    return _SLUG_RE.sub("", str(value or "").strip().lower().replace(" ", "_"))
+
+
+def grade_band(age):
+    """School grade band for a patient age (grade ~= age - 5), or None outside school age."""
+    try:
+        age = int(float(str(age).strip()))
+    except (TypeError, ValueError):
+        return None
+    if 6 <= age <= 10:
+        return "1-5"
+    if 11 <= age <= 13:
+        return "6-8"
+    if 14 <= age <= 18:
+        return "9-12"
+    return None
+
+
+class ShardRouter:
+    def __init__(self, fallback, root=SHARDS_DIR, max_loaded=MAX_LOADED_SHARDS,
+                 semantic=False, rescan_seconds=None):
+        self.fallback = fallback  # ContentManager for the global knowledge base
+        self.root = root
+        self.max_loaded = max_loaded
+        self.semantic = semantic
+        self.rescan_seconds = fallback.poll_seconds if rescan_seconds is None else rescan_seconds
+        self._loaded = OrderedDict()  # shard name -> ContentManager
+        self._catalog = frozenset()
+        self._next_scan = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def _scan(self):
+        """Shard files on disk as 'tenant/name' strings (a directory listing, no parsing)."""
+        now = time.monotonic()
+        if now < self._next_scan:
+            return self._catalog
+        self._next_scan = now + max(self.rescan_seconds, 0)
+        found = set()
+        try:
+            for tenant in os.listdir(self.root):
+                tenant_dir = os.path.join(self.root, tenant)
+                if not os.path.isdir(tenant_dir):
+                    continue
+                for name in os.listdir(tenant_dir):
+                    if name.endswith(".json"):
+                        found.add(f"{tenant}/{name[:-5]}")
+        except OSError:
+            pass # No shards directory: everything routes to the global knowledge base
+        self._catalog = frozenset(found)
+        return self._catalog
+
+    def shard_for(self, tenant=None, language=None, age=None):
+        """Most specific existing shard name for the request, or None for the global one."""
+        catalog = self._scan()
+        if not catalog:
+            return None
+        tenant = slug(tenant) or DEFAULT_TENANT
+        grade = grade_band(age)
+        languages = [slug(language) or FALLBACK_LANGUAGE]
+        if languages[0] != FALLBACK_LANGUAGE:
+            languages.append(FALLBACK_LANGUAGE)
+        for tenant_name in dict.fromkeys((tenant, DEFAULT_TENANT)):
+            for lang in languages:
+                for name in ([f"{lang}.{grade}"] if grade else []) + [lang]:
+                    if f"{tenant_name}/{name}" in catalog:
+                        return f"{tenant_name}/{name}"
+        return None
+
+    def _open(self, shard):
+        tenant, name = shard.split("/", 1)
+        tenant_prompt = os.path.join(self.root, tenant, 'system_prompt.md')
+        return ContentManager(
+            kb_path=os.path.join(self.root, tenant, f"{name}.json"),
+            prompt_path=tenant_prompt if os.path.exists(tenant_prompt) else SYSTEM_PROMPT_PATH,
+            poll_seconds=self.fallback.poll_seconds,
+            semantic=self.semantic,
+            index_cache_dir=os.path.join(embeddings.default_cache_dir(), 'shards', tenant, name),
+            on_publish=self.fallback.on_publish,
+        )
+
+    def manager(self, shard):
+        if shard is None:
+            return self.fallback
+        with self._lock:
+            manager = self._loaded.get(shard)
+            if manager is not None:
+                self._loaded.move_to_end(shard)
+                return manager
+        # Built outside the lock so one tenant's cold load doesn't stall the others
+        manager = self._open(shard)
+        with self._lock:
+            existing = self._loaded.get(shard)
+            if existing is not None:
+                return existing
+            self._loaded[shard] = manager
+            self.loads += 1
+            while len(self._loaded) > self.max_loaded:
+                evicted, _ = self._loaded.popitem(last=False)
+                self.evictions += 1
+                print(f"Evicted idle knowledge base shard {evicted}")
+        return manager
+
+    def preload(self, limit=None):
+        """Builds up to `limit` (default max_loaded) shard indexes ahead of the first request."""
+        shards = sorted(self._scan())[:self.max_loaded if limit is None else limit]
+        for shard in shards:
+            self.manager(shard).current()
+        return len(shards)
+
+    def route(self, tenant=None, language=None, patient_metadata=None):
+        """Live ContentSnapshot for the request's tenant, language and patient age."""
+        age = (patient_metadata or {}).get('age')
+        return self.manager(self.shard_for(tenant, language, age)).current()
+
+    def system_prompts(self):
+        """System prompts of the fallback and every loaded shard."""
+        with self._lock:
+            managers = [self.fallback, *self._loaded.values()]
+        return {m.snapshot.system_prompt for m in managers}
+
+    def stats(self):
+        with self._lock:
+            loaded = {name: m.stats() for name, m in self._loaded.items()}
+        return {
+            "available": sorted(self._scan()),
+            "loaded": loaded,
+            "max_loaded": self.max_loaded,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# Request Coalescing (single-flight)
+# Identical questions that arrive while one is already being answered wait for
+# that answer instead of starting their own Gemini call. Within a worker the
+# followers block on a Future; across gunicorn workers the first one claims a
+# lease row in a small SQLite file and publishes the result there, and the
+# others poll for it. Async callers await the same in-process future without
+# tying up a thread. A follower whose leader fails or stalls runs the request
+# itself, so coalescing can delay an answer but never lose it.
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT", "1") != "0"
+WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_SECONDS", "45"))
+# A blocking follower ties up a worker thread while it waits, so it gives up sooner
+SYNC_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_SYNC_WAIT_SECONDS", "10"))
+POLL_INTERVAL = 0.05
+RESULT_TTL = 30.0  # how long a published result stays readable for late pollers
+
+
+def default_db_path():
+    return os.getenv("SINGLEFLIGHT_DB", os.path.join(tempfile.gettempdir(), "first_aid_singleflight.db"))
+
+
+def shareable(result):
+    """Only successful answers are handed to followers; errors are retried by each caller."""
+    return isinstance(result, dict) and "error" not in result
+
+
+class _Call:
+    def __init__(self):
+        self.future = Future()  # resolves to the shareable result or None
+
+
+class SharedLeases:
+    """Cross-process lease + result rows (one per in-flight key)."""
+
+    def __init__(self, db_path, lease_seconds=WAIT_TIMEOUT):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.owner = str(os.getpid())
+        self._local = threading.local()
+        conn = self._db()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            "key TEXT PRIMARY KEY, owner TEXT, expires REAL, done INTEGER DEFAULT 0, result TEXT)"
+        )
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """Forked worker: own connection, and leases are claimed under the worker's pid."""
+        self.owner = str(os.getpid())
+        self._local = threading.local()
+
+    def claim(self, key):
+        """True if this process now owns the key; False if another worker is answering it."""
+        conn = self._db()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT done, expires FROM flights WHERE key = ?", (key,)).fetchone()
+            if row and not row[0] and row[1] > now:
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO flights (key, owner, expires, done, result) VALUES (?, ?, ?, 0, NULL)",
+                (key, self.owner, now + self.lease_seconds),
+            )
+            conn.execute("DELETE FROM flights WHERE expires < ?", (now - RESULT_TTL,))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def wait(self, key, timeout):
+        """Polls for another worker's result. None if it failed, expired or timed out."""
+        deadline = time.time() + timeout
+        conn = self._db()
+        while time.time() < deadline:
+            row = conn.execute("SELECT done, expires, result FROM flights WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            done, expires, result = row
+            if done:
+                return json.loads(result) if result else None
+            if expires < time.time():
+                return None # Leader died without publishing
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    def complete(self, key, result):
+        payload = json.dumps(result) if shareable(result) else None
+        self._db().execute(
+            "UPDATE flights SET done = 1, result = ?, expires = ? WHERE key = ? AND owner = ?",
+            (payload, time.time() + RESULT_TTL, key, self.owner),
+        )
+
+
+class SingleFlight:
+    def __init__(self, db_path=None, wait_timeout=WAIT_TIMEOUT, shared=True, sync_wait_timeout=SYNC_WAIT_TIMEOUT):
+        self.wait_timeout = wait_timeout
+        self.sync_wait_timeout = min(sync_wait_timeout, wait_timeout)
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counts = {"leader": 0, "shared_local": 0, "shared_remote": 0, "solo": 0}
+        self._shared = None
+        if shared:
+            try:
+                self._shared = SharedLeases(db_path or default_db_path(), lease_seconds=wait_timeout)
+            except Exception as e:
+                print(f"SingleFlight: shared store unavailable, coalescing within this worker only ({e})")
+
+    def after_fork(self):
+        with self._lock:
+            self._calls = {}
+        if self._shared is not None:
+            self._shared.after_fork()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _join(self, key):
+        """(call, is_leader) for the in-process flight on key."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                return call, True
+            return call, False
+
+    def _followed(self, result):
+        if result is not None:
+            self._count("shared_local")
+            return "shared", result
+        self._count("solo")
+        return "solo", None
+
+    def enter(self, key):
+        """
+        Returns ("leader", call) when the caller must produce the result and hand
+        it to leave(), ("shared", result) when another request already did, or
+        ("solo", None) when it should just run without coalescing. Followers
+        wait at most sync_wait_timeout before answering on their own.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                return self._followed(call.future.result(self.sync_wait_timeout))
+            except FutureTimeout:
+                return self._followed(None)
+        return self._lead(key, call, self.sync_wait_timeout)
+
+    async def enter_async(self, key):
+        """enter() for coroutines: in-process followers await instead of blocking a thread."""
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call.future)), self.wait_timeout)
+            except asyncio.TimeoutError:
+                result = None
+            return self._followed(result)
+        if self._shared is None:
+            return self._lead(key, call, self.wait_timeout)
+        # Polling another worker's lease blocks, so it runs off the event loop
+        return await asyncio.to_thread(self._lead, key, call, self.wait_timeout)
+
+    def _lead(self, key, call, timeout):
+        if self._shared is not None:
+            try:
+                if not self._shared.claim(key):
+                    result = self._shared.wait(key, timeout)
+                    if result is not None:
+                        self._count("shared_remote")
+                        self._finish(key, call, result)
+                        return "shared", result
+                    self._shared.claim(key)
+            except Exception as e:
+                print(f"SingleFlight: shared lease failed ({e})")
+        self._count("leader")
+        return "leader", call
+
+    def _finish(self, key, call, result):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        if not call.future.done():
+            call.future.set_result(result if shareable(result) else None)
+
+    def leave(self, key, call, result):
+        """Publishes the leader's result (None = failed) to local and remote followers."""
+        if self._shared is not None:
+            try:
+                self._shared.complete(key, result)
+            except Exception as e:
+                print(f"SingleFlight: could not publish result ({e})")
+        self._finish(key, call, result)
+
+    def run(self, key, fn):
+        """fn() once per key across concurrent callers. Returns (result, shared)."""
+        role, value = self.enter(key)
+        if role == "shared":
+            return value, True
+        if role == "solo":
+            return fn(), False
+        result = None
+        try:
+            result = fn()
+            return result, False
+        finally:
+            self.leave(key, value, result)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, in_flight=len(self._calls))
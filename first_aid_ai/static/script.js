@@ -39,7 +39,8 @@ document.addEventListener('DOMContentLoaded', () => {
     let currentFile = null;
     let uploadedImageURL = null;
     let cameraStream = null;
-    let chatHistory = []; // Conv Memory
+    // Conversation memory lives on the server; we only keep the session id
+    let sessionId = ''; // a page reload starts a fresh case, like the chat window
 
     // Theme Management
     const currentTheme = localStorage.getItem('theme') || 'light';
@@ -66,17 +67,18 @@ document.addEventListener('DOMContentLoaded', () => {
 
     function renderInventory(data) {
         inventoryList.innerHTML = '';
-        const medicines = data.medicines || [];
-        if (medicines.length === 0) {
+        // Item-level entries (with ids) from the inventory store; fall back to plain names
+        const items = data.items || (data.medicines || []).map((name) => ({ id: null, name }));
+        if (items.length === 0) {
             inventoryList.innerHTML = '<div class="empty-state">No items in inventory.</div>';
             return;
         }
-        medicines.forEach((item, index) => {
+        items.forEach((item) => {
             const div = document.createElement('div');
             div.className = 'inventory-item';
             div.innerHTML = `
-                <span>${item}</span>
-                <span class="remove-btn" data-index="${index}">×</span>
+                <span>${item.name}</span>
+                <span class="remove-btn" data-id="${item.id}">×</span>
             `;
             inventoryList.appendChild(div);
         });
@@ -85,14 +87,10 @@ document.addEventListener('DOMContentLoaded', () => {
     addInventoryBtn.addEventListener('click', async () => {
         const item = inventoryInput.value.trim();
         if (!item) return;
-        const res = await fetch('/api/inventory');
-        const data = await res.json();
-        if (!data.medicines) data.medicines = [];
-        data.medicines.push(item);
-        await fetch('/api/inventory', {
+        await fetch('/api/inventory/items', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(data)
+            body: JSON.stringify({ name: item, kind: 'medicines' })
         });
         inventoryInput.value = '';
         loadInventory();
@@ -100,15 +98,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
     inventoryList.addEventListener('click', async (e) => {
         if (e.target.classList.contains('remove-btn')) {
-            const index = e.target.getAttribute('data-index');
-            const res = await fetch('/api/inventory');
-            const data = await res.json();
-            data.medicines.splice(index, 1);
-            await fetch('/api/inventory', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(data)
-            });
+            const id = e.target.getAttribute('data-id');
+            await fetch(`/api/inventory/items/${id}`, { method: 'DELETE' });
             loadInventory();
         }
     });
@@ -308,10 +299,11 @@ document.addEventListener('DOMContentLoaded', () => {
         formData.append('location', pLocation);
         formData.append('duration', pDuration);
         if (currentFile) formData.append('image', currentFile);
-        formData.append('history', JSON.stringify(chatHistory));
-
-        // Add user msg to history
-        chatHistory.push({ role: 'user', text: text || "[Image Shared]" });
+        // School deployments link to /?tenant=<school> to get their own protocol set
+        const tenant = new URLSearchParams(window.location.search).get('tenant');
+        if (tenant) formData.append('tenant', tenant);
+        // Empty on the first message: the server starts a session and returns its id
+        formData.append('session_id', sessionId);
 
         messageInput.value = '';
         messageInput.style.height = '44px';
@@ -323,52 +315,103 @@ document.addEventListener('DOMContentLoaded', () => {
         if (displayGender) displayGender.textContent = `Gender: ${pGender}`;
 
         try {
-            const response = await fetch('/api/chat', { method: 'POST', body: formData });
-            const data = await response.json();
-            removeLoading(loadingId);
-
-            if (data.error) appendMessage(`Error: ${data.error}`, 'assistant');
-            else if (data.response === 'hello') appendMessage(`Hello! How can I help you today?`, 'assistant');
-            else {
-                handleAIResponse(data.response);
-                // Add AI msg to history
-                chatHistory.push({ role: 'model', text: data.response });
+            const requestStart = performance.now();
+            const response = await fetch('/api/chat/stream', { method: 'POST', body: formData });
+            if (!response.ok || !response.body) {
+                const data = await response.json();
+                removeLoading(loadingId);
+                appendMessage(`Error: ${data.error || response.statusText}`, 'assistant');
+                return;
             }
+
+            let streamedText = '';
+            let contentEl = null;
+            await readEventStream(response, (event) => {
+                if (event.type === 'meta' && event.session_id) {
+                    sessionId = event.session_id;
+                } else if (event.type === 'token') {
+                    if (!contentEl) {
+                        removeLoading(loadingId);
+                        contentEl = appendMessage('', 'assistant');
+                        console.info(`Time to first token: ${Math.round(performance.now() - requestStart)} ms`);
+                    }
+                    streamedText += event.text;
+                    // Hide the (possibly half-received) trailer tags while streaming
+                    renderMarkdown(contentEl, streamedText.replace(/\[(SPOT_ID|PROCEDURE|SEARCH|KEYWORDS)[\s\S]*$/i, ''));
+                    chatContainer.scrollTop = chatContainer.scrollHeight;
+                } else if (event.type === 'done') {
+                    removeLoading(loadingId);
+                    if (!contentEl) contentEl = appendMessage('', 'assistant');
+                    console.info(`Stream complete: server TTFT ${event.ttft_ms} ms, total ${event.total_ms} ms`);
+                    const fullText = event.response === 'hello' ? 'Hello! How can I help you today?' : event.response;
+                    finalizeAIResponse(fullText, contentEl, event.structured);
+                } else if (event.type === 'error') {
+                    removeLoading(loadingId);
+                    appendMessage(`Error: ${event.error}`, 'assistant');
+                }
+            });
         } catch (err) {
             removeLoading(loadingId);
             appendMessage(`Network Error: ${err.message}`, 'assistant');
         }
     }
 
-    function handleAIResponse(fullText) {
-        // Tag Regex
+    // Parses `data: {...}` Server-Sent Events from a fetch() response body
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const raw = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                const line = raw.split('\n').find(l => l.startsWith('data: '));
+                if (line) onEvent(JSON.parse(line.slice(6)));
+            }
+        }
+    }
+
+    // The server sends the prose plus a parsed `structured` result; the regex
+    // fallback only covers servers that predate it
+    function parseTrailer(fullText, structured) {
+        if (structured) {
+            return { spotId: structured.spot_id, steps: structured.procedure || [], cleanedText: fullText };
+        }
         const spotMatch = fullText.match(/\[SPOT_ID:\s*(\d+)\]/i);
         const procMatch = fullText.match(/\[PROCEDURE:\s*(.*?)\]/i);
-        const searchMatch = fullText.match(/\[SEARCH:\s*(.*?)\]/i);
 
-        let cleanedText = fullText
+        const cleanedText = fullText
             .replace(/\[SPOT_ID:.*?\]/gi, '')
             .replace(/\[PROCEDURE:.*?\]/gi, '')
             .replace(/\[SEARCH:.*?\]/gi, '')
             .trim();
 
-        // Creative Staggered Response
-        const loadingId = appendLoading();
-        setTimeout(() => {
-            removeLoading(loadingId);
-            appendMessage(cleanedText, 'assistant');
+        return {
+            spotId: spotMatch ? spotMatch[1] : null,
+            steps: procMatch ? procMatch[1].split(',').map(s => s.trim()).filter(Boolean) : [],
+            cleanedText,
+        };
+    }
 
-            // Update Visualization
-            if (spotMatch) moveIndicator(spotMatch[1]);
-            else document.getElementById('target-indicator-solid').style.visibility = 'hidden';
+    function applyTrailer({ spotId, steps }) {
+        // Update Visualization
+        if (spotId) moveIndicator(spotId);
+        else document.getElementById('target-indicator-solid').style.visibility = 'hidden';
 
-            // Update Left Panels
-            updateProcedures(procMatch ? procMatch[1] : null);
-            // Ignore updateDiscovery(searchMatch ? searchMatch[1] : null); as discovery panel is removed/repurposed
+        // Update Left Panels
+        updateProcedures(steps);
+    }
 
-            // Speak Response
-            speakText(cleanedText);
-        }, 600);
+    // Called once the stream completes with the final answer
+    function finalizeAIResponse(fullText, contentEl, structured) {
+        const parsed = parseTrailer(fullText, structured);
+        renderMarkdown(contentEl, parsed.cleanedText);
+        applyTrailer(parsed);
+        speakText(parsed.cleanedText);
     }
 
     function moveIndicator(spotId) {
@@ -414,13 +457,12 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    function updateProcedures(procStr) {
+    function updateProcedures(steps) {
         actionsContent.innerHTML = '';
-        if (procStr) {
+        if (steps && steps.length) {
             // Expand panel
             if (proceduresPanel) proceduresPanel.classList.add('expanded-view');
 
-            const steps = procStr.split(',');
             steps.forEach((step, index) => {
                 const div = document.createElement('div');
                 div.className = 'action-step stagger-item';
@@ -483,7 +525,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     </div>
                 </div>
             `;
-            chatHistory = [];
+            if (sessionId) fetch(`/api/sessions/${encodeURIComponent(sessionId)}`, { method: 'DELETE' });
+            sessionId = '';
             actionsContent.innerHTML = '<div class="empty-state">Procedural steps will appear here.</div>';
             document.getElementById('target-indicator-solid').style.visibility = 'hidden';
             activePartDisplay.textContent = 'All Systems Normal';
@@ -501,14 +544,18 @@ document.addEventListener('DOMContentLoaded', () => {
 
         const content = document.createElement('div');
         content.className = 'message-content';
-
-        if (window.marked) content.innerHTML = marked.parse(text);
-        else content.innerText = text;
+        renderMarkdown(content, text);
 
         div.appendChild(avatar);
         div.appendChild(content);
         chatContainer.appendChild(div);
         chatContainer.scrollTop = chatContainer.scrollHeight;
+        return content;
+    }
+
+    function renderMarkdown(el, text) {
+        if (window.marked) el.innerHTML = marked.parse(text);
+        else el.innerText = text;
     }
 
     function appendLoading() {
@@ -0,0 +1,246 @@
+import json
+import os
+import re
+
+import supplies
+from retrieval import tokenize
+
+# Structured Answers
+# Blocking and async calls ask Gemini for JSON matching RESPONSE_SCHEMA
+# (STRUCTURED_OUTPUT=json). Streaming keeps prose + the [SPOT_ID]/[PROCEDURE]/
+# [SEARCH] trailer so tokens stay readable as they arrive. Whatever comes back
+# (clean JSON, JSON in code fences or cut off mid-object, the trailer, or plain
+# prose) is parsed here into one compact result; broken output is repaired
+# locally instead of paying for a second generation. Search items are resolved
+# to inventory item ids, so clients no longer regex the answer text.
+
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "json").lower()  # "json" or "trailer"
+
+SPOT_IDS = range(1, 31)  # body map spots in static/index.html
+MAX_STEPS = 12
+MAX_ITEMS = 12
+MAX_ITEM_CHARS = 80
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "answer": {"type": "string"},
+        "spot_id": {"type": "integer"},
+        "procedure": {"type": "array", "items": {"type": "string"}},
+        "search": {"type": "array", "items": {"type": "string"}},
+        "image_keywords": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["answer", "procedure", "search"],
+}
+GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": RESPONSE_SCHEMA}
+
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_TAG_RE = {
+    "spot_id": re.compile(r"\[SPOT_ID:\s*(.*?)\]", re.IGNORECASE | re.DOTALL),
+    "procedure": re.compile(r"\[PROCEDURE:\s*(.*?)\]", re.IGNORECASE | re.DOTALL),
+    "search": re.compile(r"\[SEARCH:\s*(.*?)\]", re.IGNORECASE | re.DOTALL),
+    "image_keywords": re.compile(r"\[KEYWORDS:\s*(.*?)\]", re.IGNORECASE | re.DOTALL),
+}
+# An unclosed tag at the very end (answer cut off by the token limit)
+_DANGLING_TAG_RE = re.compile(r"\[(SPOT_ID|PROCEDURE|SEARCH|KEYWORDS):([^\]]*)$", re.IGNORECASE)
+_TAG_FIELDS = {"SPOT_ID": "spot_id", "PROCEDURE": "procedure", "SEARCH": "search", "KEYWORDS": "image_keywords"}
+
+
+def wants_json(stream=False):
+    return STRUCTURED_OUTPUT == "json" and not stream
+
+
+# --- Repair ---
+def _close_json(text):
+    """Closes a string and any brackets left open by a truncated JSON object."""
+    stack, in_string, escaped = [], False, False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    return text + "".join(reversed(stack))
+
+
+def _load_json(text, repairs):
+    """The JSON object in text, repairing fences, trailing commas and truncation. None if hopeless."""
+    start = text.find("{")
+    if start < 0:
+        return None
+    candidate = text[start:]
+    if _FENCE_RE.search(text):
+        candidate = _FENCE_RE.sub("", candidate)
+        repairs.append("fence")
+    end = candidate.rfind("}")
+    for attempt in (candidate[:end + 1] if end >= 0 else None, candidate):
+        if attempt is None:
+            continue
+        try:
+            data = json.loads(attempt)
+            return data if isinstance(data, dict) else None
+        except ValueError:
+            pass
+    fixed = _TRAILING_COMMA_RE.sub(r"\1", candidate)
+    if fixed != candidate:
+        repairs.append("trailing_comma")
+    closed = _close_json(fixed)
+    if closed != fixed.rstrip():
+        repairs.append("truncated")
+    try:
+        data = json.loads(_TRAILING_COMMA_RE.sub(r"\1", closed))
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+# --- Field validation ---
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    out = []
+    for item in value:
+        item = " ".join(str(item).split()).strip(" .;")
+        if item and item not in out:
+            out.append(item[:MAX_ITEM_CHARS])
+    return out
+
+
+def _spot(value, repairs):
+    if value in (None, ""):
+        return None
+    match = re.search(r"\d+", str(value))
+    spot = int(match.group()) if match else None
+    if spot not in SPOT_IDS:
+        repairs.append("spot_id")
+        return None
+    return spot
+
+
+def parse(text):
+    """
+    (prose, fields, repairs) from raw model output. fields has spot_id,
+    procedure, search and image_keywords; repairs names what had to be fixed.
+    """
+    text = text or ""
+    repairs = []
+    fields = None
+    stripped = text.strip()
+    if stripped.startswith(("{", "```")):
+        data = _load_json(stripped, repairs)
+        if data is not None:
+            prose = str(data.get("answer") or "").strip()
+            fields = {k: data.get(k) for k in ("spot_id", "procedure", "search", "image_keywords")}
+            if not prose:
+                # No prose came back: the steps are still worth reading
+                prose = "\n".join(f"{i}. {step}" for i, step in enumerate(_as_list(fields["procedure"]), 1))
+                repairs.append("answer")
+        else:
+            repairs.append("unparsed_json")
+    if fields is None:
+        # Trailer format (streaming, offline answers, older cache entries) or plain prose
+        fields = {}
+        prose = text
+        for name, pattern in _TAG_RE.items():
+            match = pattern.search(prose)
+            if match:
+                fields[name] = match.group(1)
+            prose = pattern.sub("", prose)
+        dangling = _DANGLING_TAG_RE.search(prose)
+        if dangling:
+            # Keep what arrived of the cut-off tag (its last item may be partial)
+            fields.setdefault(_TAG_FIELDS[dangling.group(1).upper()], dangling.group(2))
+            prose = prose[:dangling.start()]
+            repairs.append("truncated")
+        prose = prose.strip()
+        if "unparsed_json" in repairs:
+            # Show something readable rather than a broken JSON blob
+            match = re.search(r'"answer"\s*:\s*"((?:[^"\\]|\\.)*)', stripped)
+            try:
+                prose = json.loads(f'"{match.group(1)}"') if match else prose
+            except ValueError:
+                prose = match.group(1)
+
+    procedure = _as_list(fields.get("procedure"))
+    search = _as_list(fields.get("search"))
+    if len(procedure) > MAX_STEPS or len(search) > MAX_ITEMS:
+        repairs.append("clipped")
+    return prose, {
+        "spot_id": _spot(fields.get("spot_id"), repairs),
+        "procedure": procedure[:MAX_STEPS],
+        "search": search[:MAX_ITEMS],
+        "image_keywords": _as_list(fields.get("image_keywords")),
+    }, repairs
+
+
+def image_keywords(text):
+    """Single-call vision mode: the model's image keywords as one string, or None."""
+    keywords = parse(text)[1]["image_keywords"]
+    return ", ".join(keywords) or None
+
+
+# --- Inventory resolution ---
+def resolve_items(names, inventory):
+    """
+    [{"name", "inventory_id", "in_stock"}] for each search item. Known supplies
+    resolve through the synonym/brand index (supplies.py); otherwise an
+    inventory item matches when it covers at least half of the item's words,
+    and the tightest such item wins.
+    """
+    index = supplies.index_for(inventory)
+    stock = [(item, set(tokenize(str(item.get("name", "")), drop_stopwords=False)))
+             for item in (inventory or {}).get("items", [])]
+    resolved = []
+    for name in names:
+        known = index.item_for(name)
+        if known is not None:
+            resolved.append({"name": name, "inventory_id": known.get("id"), "in_stock": True})
+            continue
+        wanted = set(tokenize(name, drop_stopwords=False))
+        best, best_score = None, (0.0, 0)
+        for item, tokens in stock:
+            if not tokens or not wanted:
+                continue
+            score = (len(wanted & tokens) / len(wanted), -len(tokens))
+            if score > best_score:
+                best, best_score = item, score
+        if best is not None and best_score[0] >= 0.5:
+            resolved.append({"name": name, "inventory_id": best.get("id"), "in_stock": True})
+        else:
+            resolved.append({"name": name, "inventory_id": None, "in_stock": False})
+    return resolved
+
+
+def shape(result, inventory):
+    """
+    Rewrites a {"response": raw_text, ...} result into the compact form:
+    "response" holds only the prose and "structured" the typed fields. Results
+    that are already shaped pass through untouched.
+    """
+    if not result or "response" not in result or "structured" in result:
+        return result
+    prose, fields, repairs = parse(result["response"])
+    structured = {
+        "spot_id": fields["spot_id"],
+        "procedure": fields["procedure"],
+        "search": resolve_items(fields["search"], inventory),
+    }
+    if repairs:
+        structured["repaired"] = repairs
+    return dict(result, response=prose, structured=structured)
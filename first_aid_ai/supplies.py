@@ -0,0 +1,241 @@
+import difflib
+import os
+import threading
+from functools import lru_cache
+
+from retrieval import STOPWORDS, tokenize
+
+# Supply Matching Index
+# Maps inventory items (by generic name, synonym or brand) to the supplies the
+# protocols call for, e.g. "Dettol liquid" -> antiseptic, "Crocin" -> paracetamol.
+# A one-word name only counts when nothing after it qualifies it ("Inhaler
+# spacer" is a spacer, not an inhaler). Items no name matches fall back to the
+# last distinctive word of their name against each supply's vocabulary ("Ice"
+# -> cold compress, "Cotton" -> gauze, misspelt "Guaze" -> gauze), so a supply
+# isn't reported missing while a stocked item could stand in.
+# The inventory side is rebuilt once per inventory version and protocol needs
+# are memoized per step list, so the "have / missing" cross-reference for the
+# matched protocols is a few dict lookups instead of the model reading the
+# whole medicines list.
+
+# "relevant" = only have/missing items for the matched protocols; "full" = old full list
+INVENTORY_PROMPT = os.getenv("INVENTORY_PROMPT", "relevant").lower()
+
+KINDS = ("medicines", "equipment")
+
+# Supply shown to the user -> (words a protocol step uses for it, names an inventory item may use)
+SUPPLIES = {
+    "Antiseptic wipes": (
+        ("antiseptic",),
+        ("antiseptic", "dettol", "savlon", "betadine", "povidone iodine", "chlorhexidine",
+         "alcohol swab", "alcohol wipe", "rubbing alcohol", "isopropyl alcohol", "spirit"),
+    ),
+    "Gauze": (("gauze",), ("gauze", "cotton wool", "cotton roll")),
+    "Adhesive plasters": (
+        ("plaster", "adhesive dressing"),
+        ("plaster", "band aid", "bandaid", "hansaplast", "adhesive bandage", "adhesive dressing"),
+    ),
+    "Sterile dressing": (
+        ("sterile dressing", "non-fluffy dressing"),
+        ("sterile dressing", "wound dressing", "dressing pad", "non adherent dressing", "melolin", "eye pad"),
+    ),
+    "Cold compress / ice pack": (
+        ("cold compress", "ice pack"),
+        ("cold compress", "ice pack", "cold pack", "instant cold pack", "gel pack", "ice bag"),
+    ),
+    "Cling film": (("cling film",), ("cling film", "cling wrap", "plastic wrap", "burn dressing", "burn gel")),
+    "Sling / splint": (
+        ("sling", "splint"),
+        ("sling", "triangular bandage", "splint", "sam splint", "crepe bandage", "elastic bandage"),
+    ),
+    "Adrenaline auto-injector (EpiPen)": (
+        ("epipen", "auto-injector", "adrenaline"),
+        ("epipen", "auto injector", "adrenaline", "epinephrine", "anapen", "jext"),
+    ),
+    "Soap": (("soap",), ("soap", "hand wash", "handwash", "hand sanitizer", "sanitiser", "sanitizer")),
+    "Gloves": (("gloves", "glove"), ("gloves", "glove", "nitrile", "latex")),
+    "Paracetamol": (("paracetamol",), ("paracetamol", "acetaminophen", "crocin", "dolo", "calpol", "tylenol")),
+    "Antihistamine": (
+        ("antihistamine",),
+        ("antihistamine", "cetirizine", "loratadine", "avil", "benadryl", "allegra", "fexofenadine"),
+    ),
+    "ORS": (("ors", "oral rehydration"), ("ors", "oral rehydration", "electral", "rehydration salts")),
+    "Reliever inhaler": (("inhaler",), ("inhaler", "salbutamol", "asthalin", "ventolin", "albuterol")),
+}
+
+
+# Words too generic to tie an item to a supply on their own ("First aid kit", "Eye drops",
+# "Baby wipes", "Salt"), including forms and variants that follow a brand ("Calpol syrup")
+GENERIC_WORDS = {
+    "aid", "first", "kit", "box", "pack", "bag", "pad", "gel", "roll", "wash", "hand", "eye", "liquid",
+    "cream", "tablets", "spray", "solution", "strips", "small", "large", "medium", "sterile", "non",
+    "adherent", "instant", "auto", "oral", "salts", "bottle", "tube", "refill", "drops", "syrup",
+    "suspension", "ointment", "infant", "junior", "kids", "adult", "plus", "forte", "extra", "original",
+    "swab", "wipes", "dressing", "wrap", "plastic", "burn", "wound", "band", "adhesive", "cold", "spirit",
+    "elastic", "fluffy", "sam", "sachets", "powder", "packets", "cubes", "jr", "pcs",
+}
+# Tokens are stemmed ("salts" -> "salt"), so the set is too
+_GENERIC = {t for word in GENERIC_WORDS for t in tokenize(word, drop_stopwords=False)}
+FUZZY_CUTOFF = 0.9  # difflib ratio for misspelt words ("antiseptik"); swapped letters ("guaze") also match
+
+
+def _phrases(words):
+    return tuple(tuple(tokenize(w, drop_stopwords=False)) for w in words)
+
+
+_MENTIONS = {label: _phrases(mentions) for label, (mentions, _) in SUPPLIES.items()}
+_ALIASES = {label: _phrases(mentions + aliases) for label, (mentions, aliases) in SUPPLIES.items()}
+
+
+def _distinctive(tokens):
+    """Tokens that can name a supply, in order (no generic words, stopwords or sizes like "500mg" and "M")."""
+    return [t for t in tokens if len(t) > 1 and t not in _GENERIC and t not in STOPWORDS and not any(c.isdigit() for c in t)]
+
+
+def _head(tokens):
+    """Last distinctive word: what the item is ("Latex balloon" is a balloon)."""
+    words = _distinctive(tokens)
+    return words[-1] if words else None
+
+
+# Supply label -> distinctive words of its mentions and aliases, and word -> the
+# one label it names ("bandage" is both a plaster and a sling, so it names neither)
+_VOCABULARY = {label: set(_distinctive(t for phrase in phrases for t in phrase)) for label, phrases in _ALIASES.items()}
+_WORD_LABELS = {}
+for _label, _words in _VOCABULARY.items():
+    for _word in _words:
+        _WORD_LABELS.setdefault(_word, []).append(_label)
+_WORD_LABELS = {word: labels[0] for word, labels in _WORD_LABELS.items() if len(labels) == 1}
+
+
+def _phrase_in(phrase, tokens):
+    n = len(phrase)
+    return n > 0 and any(tuple(tokens[i:i + n]) == phrase for i in range(len(tokens) - n + 1))
+
+
+def _concepts(text, table):
+    tokens = tokenize(text, drop_stopwords=False)
+    return [label for label, phrases in table.items() if any(_phrase_in(p, tokens) for p in phrases)]
+
+
+@lru_cache(maxsize=4096)
+def _needs(steps):
+    return tuple(_concepts(" ".join(steps), _MENTIONS))
+
+
+def needs(protocol):
+    """Supplies a protocol's steps call for, in SUPPLIES order (memoized per step list)."""
+    return _needs(tuple(protocol.get('steps', [])))
+
+
+def concept_for(text):
+    """The supply a name refers to (generic, synonym, brand or a stand-in word), mapped like an inventory item, or None."""
+    found = _item_concepts(text) or could_cover(text)
+    return found[0] if found else None
+
+
+def _swapped(a, b):
+    diff = [i for i, (x, y) in enumerate(zip(a, b)) if x != y]
+    return len(a) == len(b) and len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+
+
+def _misspelt(word, known):
+    # A word containing a known one is a different word ("plasticine"), not a typo
+    if known in word or word in known:
+        return False
+    return _swapped(word, known) or difflib.SequenceMatcher(None, word, known).ratio() >= FUZZY_CUTOFF
+
+
+@lru_cache(maxsize=4096)
+def _word_label(word):
+    if word in _WORD_LABELS:
+        return _WORD_LABELS[word]
+    if len(word) < 5:
+        return None
+    return next((label for known, label in _WORD_LABELS.items() if _misspelt(word, known)), None)
+
+
+def could_cover(text):
+    """Supplies the last distinctive word of a name (or a near-identical word) names, as a list."""
+    head = _head(tokenize(text, drop_stopwords=False))
+    label = _word_label(head) if head else None
+    return [label] if label else []
+
+
+def _item_concepts(name):
+    """Supplies an inventory item name provides; one-word aliases must not be qualified by a later word."""
+    tokens = tokenize(name, drop_stopwords=False)
+    head = _head(tokens)
+    return [
+        label for label, phrases in _ALIASES.items()
+        if any(_phrase_in(p, tokens) and (len(p) > 1 or head in _VOCABULARY[label]) for p in phrases)
+    ]
+
+
+def _items(inventory):
+    items = (inventory or {}).get('items')
+    if items is not None:
+        return items
+    # Plain {"medicines": [...], "equipment": [...]} without ids (e.g. inventory.json)
+    return [{"id": None, "kind": kind, "name": str(name)} for kind in KINDS for name in (inventory or {}).get(kind, [])]
+
+
+class SupplyIndex:
+    def __init__(self, inventory):
+        self.version = (inventory or {}).get('version')
+        self.items = _items(inventory)
+        self.stock = {}  # supply label -> [inventory items that provide it]
+        self.substitutes = {}  # supply label -> [unmapped items whose words fit it]
+        for item in self.items:
+            name = str(item.get('name', ''))
+            labels = _item_concepts(name)
+            for label in labels:
+                self.stock.setdefault(label, []).append(item)
+            if not labels:
+                for label in could_cover(name):
+                    self.substitutes.setdefault(label, []).append(item)
+
+    def _provider(self, label):
+        stocked = self.stock.get(label) or self.substitutes.get(label)
+        return stocked[0] if stocked else None
+
+    def cross_reference(self, protocols):
+        """
+        {"have": [inventory items], "missing": [supply labels]} for the supplies
+        the given protocols need, without duplicates.
+        """
+        have, missing, seen = [], [], set()
+        for protocol in protocols:
+            for label in needs(protocol):
+                if label in seen:
+                    continue
+                seen.add(label)
+                item = self._provider(label)
+                if item is None:
+                    missing.append(label)
+                elif item not in have:
+                    have.append(item)
+        return {"have": have, "missing": missing}
+
+    def item_for(self, text):
+        """Inventory item that provides the supply text names, or None."""
+        label = concept_for(text)
+        return self._provider(label) if label else None
+
+
+_index_lock = threading.Lock()
+_latest = None
+
+
+def index_for(inventory):
+    """SupplyIndex for this inventory snapshot, rebuilt only when its version changes."""
+    global _latest
+    version = (inventory or {}).get('version')
+    latest = _latest
+    if latest is not None and version is not None and latest.version == version:
+        return latest
+    index = SupplyIndex(inventory)
+    if version is not None:
+        with _index_lock:
+            _latest = index
+    return index
@@ -0,0 +1,21 @@
+# Gunicorn settings (Procfile / render.yaml: gunicorn -c gunicorn.conf.py app:app)
+# Workers, threads and bind still come from WEB_CONCURRENCY, GUNICORN_CMD_ARGS
+# and PORT as usual.
+import os
+import sys
+
+# Import the app and warm it (knowledge base and shard indexes, inventory,
+# supply index, Gemini SDK, PIL) once in the master. Workers fork from it and
+# share those pages copy-on-write instead of each rebuilding them on boot.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+if preload_app:
+    # Warm synchronously while loading: no warm-up thread may be running at fork()
+    os.environ.setdefault("WARM_UP", "eager")
+
+
+def post_fork(server, worker):
+    core = sys.modules.get("core")
+    if core is not None:
+        # SQLite handles, single-flight leases and gRPC clients are per process
+        core.after_fork()
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'first_aid_ai'))
+sys.path.insert(0, ROOT)
+
+# Shared state files, caches and logs go to a throwaway directory, never the
+# developer's real inventory.db or the temp-dir files a running server uses.
+_STATE_DIR = tempfile.mkdtemp(prefix="first_aid_tests_")
+for name, filename in (("INVENTORY_DB", "inventory.db"), ("KEY_STATE_DB", "keys.db"),
+                       ("SINGLEFLIGHT_DB", "singleflight.db"), ("SESSION_DB", "sessions.db")):
+    os.environ.setdefault(name, os.path.join(_STATE_DIR, filename))
+os.environ.setdefault("INDEX_CACHE_DIR", os.path.join(_STATE_DIR, "index_cache"))
+os.environ.setdefault("LOG_FORMAT", "off")
+os.environ.setdefault("WARM_UP", "off")
@@ -0,0 +1,28 @@
+import pytest
+
+import app as app_module
+
+ADMIN_PATHS = ["/metrics", "/api/keys/stats"]
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize("path", ADMIN_PATHS)
+def test_local_requests_are_allowed_without_a_token(client, path):
+    assert client.get(path).status_code == 200
+
+
+@pytest.mark.parametrize("path", ADMIN_PATHS)
+def test_remote_requests_need_a_token(client, path):
+    assert client.get(path, environ_base={"REMOTE_ADDR": "203.0.113.7"}).status_code == 403
+
+
+@pytest.mark.parametrize("path", ADMIN_PATHS)
+def test_token_is_checked_when_configured(client, path, monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "s3cret")
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert client.get(path, headers={"Authorization": "Bearer s3cret"}).status_code == 200
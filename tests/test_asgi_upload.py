@@ -0,0 +1,45 @@
+import asyncio
+import io
+
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+import imaging
+
+
+class _Upload:
+    """Counts how much of the file the endpoint actually pulls in."""
+
+    def __init__(self, size):
+        self.data = io.BytesIO(b"x" * size)
+        self.read_bytes = 0
+
+    async def read(self, size=-1):
+        chunk = self.data.read(size)
+        self.read_bytes += len(chunk)
+        return chunk
+
+
+def test_read_upload_returns_files_under_the_limit():
+    assert asyncio.run(asgi.read_upload(_Upload(1000), max_bytes=1000)) == b"x" * 1000
+
+
+def test_read_upload_stops_once_the_limit_is_passed():
+    upload = _Upload(10 * asgi.UPLOAD_CHUNK_BYTES)
+    with pytest.raises(imaging.ImageTooLarge):
+        asyncio.run(asgi.read_upload(upload, max_bytes=asgi.UPLOAD_CHUNK_BYTES + 1))
+    assert upload.read_bytes == 2 * asgi.UPLOAD_CHUNK_BYTES
+
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream"])
+def test_oversized_content_length_is_rejected_before_parsing(path, monkeypatch):
+    async def parse_form(*args, **kwargs):
+        raise AssertionError("form parsed")
+
+    monkeypatch.setattr("starlette.requests.Request.form", parse_form)
+    response = TestClient(asgi.app).post(path, content=b"x", headers={
+        "content-type": "multipart/form-data; boundary=b",
+        "content-length": str(asgi.MAX_BODY_BYTES + 1),
+    })
+    assert response.status_code == 413
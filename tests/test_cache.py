@@ -0,0 +1,100 @@
+import pytest
+
+import cache
+from cache import ResponseCache, make_key
+
+ANSWER = {"response": "Pinch the soft part of the nose.", "context_used": True}
+
+
+def key(query="my student has a nosebleed", language="English", meta=None, protocols=("nosebleed",), inventory=1):
+    return make_key(query, language, meta or {"age": "9"}, list(protocols), inventory)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize("variant", [
+    "My student has a NOSEBLEED!",
+    "  my student   has a nosebleed?? ",
+    "my student, has a nosebleed.",
+])
+def test_make_key_collapses_case_punctuation_and_spacing(variant):
+    assert key(variant) == key()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("साँस नहीं ले पा रहा।", "साँस नहीं ले पा रहा"),          # vowel signs kept, danda dropped
+    ("बच्चे को बुखार है!!", "बच्चे को बुखार है"),             # virama keeps the conjunct whole
+    ("जल गया॥ क्या करें?", "जल गया क्या करें"),
+])
+def test_normalize_query_keeps_devanagari_marks_and_drops_punctuation(text, expected):
+    assert cache.normalize_query(text) == expected
+
+
+def test_devanagari_questions_differing_only_in_vowel_signs_stay_apart():
+    assert key("साँस नहीं") != key("सस नह")
+
+
+def test_make_key_collapses_ages_within_a_band():
+    assert key(meta={"age": "7"}) == key(meta={"age": "10"})
+    assert key(meta={"age": "10"}) != key(meta={"age": "11"})
+
+
+@pytest.mark.parametrize("other", [
+    dict(query="my student has a nosebleed and fainted"),
+    dict(query="my student had a nosebleed"),
+    dict(language="Hindi"),
+    dict(meta={"age": "16"}),
+    dict(meta={"age": "9", "location": "chemistry lab"}),
+    dict(protocols=("nosebleed", "head_injury")),
+    dict(inventory=2),
+])
+def test_make_key_keeps_answers_apart_when_anything_material_differs(other):
+    assert key(**other) != key()
+
+
+def test_lru_evicts_least_recently_used():
+    c = ResponseCache(max_entries=2)
+    c.set("a", ANSWER)
+    c.set("b", ANSWER)
+    assert c.get("a") == ANSWER  # "b" is now the oldest
+    c.set("c", ANSWER)
+    assert c.get("b") is None
+    assert c.get("a") == ANSWER and c.get("c") == ANSWER
+    assert c.stats()["evictions"] == 1
+
+
+def test_byte_cap_evicts_and_skips_oversized_values():
+    size = len(cache.json.dumps(ANSWER))
+    c = ResponseCache(max_bytes=size * 2)
+    for name in ("a", "b", "c"):
+        c.set(name, ANSWER)
+    assert c.get("a") is None
+    assert c.stats()["bytes"] <= size * 2
+    c.set("huge", {"response": "x" * size * 3})
+    assert c.get("huge") is None
+
+
+def test_entries_expire_after_ttl(clock):
+    c = ResponseCache(ttl=60)
+    c.set("a", ANSWER)
+    clock[0] += 59
+    assert c.get("a") == ANSWER
+    clock[0] += 2
+    assert c.get("a") is None
+    assert c.stats()["entries"] == 0
+
+
+def test_sqlite_tier_is_shared_between_instances(tmp_path, clock):
+    db = str(tmp_path / "responses.db")
+    first, second = ResponseCache(db_path=db, ttl=60), ResponseCache(db_path=db, ttl=60)
+    first.set("a", ANSWER)
+    assert second.get("a") == ANSWER
+    assert second.stats()["disk_hits"] == 1
+
+    clock[0] += 61
+    assert ResponseCache(db_path=db).get("a") is None
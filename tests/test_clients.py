@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+import clients
+import core
+
+KEY = "AIzaTestPoolKey"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(clients, "TRANSPORT", None)
+    return clients.ModelPool()
+
+
+def test_pooled_model_uses_the_injected_client(pool):
+    model = pool.get(KEY, system_instruction="Be brief.")
+    # generate_content only builds its own client when _client is None, i.e. from global configure()
+    assert model._client is not None
+    assert model._client is pool._manager(KEY).get_default_client("generative")
+    assert pool.get(KEY, system_instruction="Be brief.") is model
+
+
+def test_pooled_async_model_uses_the_injected_client(pool):
+    async def main():
+        return pool.get(KEY, system_instruction="Be brief.", use_async=True)
+
+    model = asyncio.run(main())
+    assert model._async_client is not None
+
+
+def test_retain_drops_models_for_retired_prompts(pool):
+    old = pool.get(KEY, system_instruction="Old prompt")
+    vision = pool.get(KEY)
+    assert pool.retain({"New prompt"}) == 1
+    assert pool.get(KEY) is vision
+    assert pool.get(KEY, system_instruction="Old prompt") is not old
+
+
+def test_content_reload_retires_models_for_the_old_prompt(tmp_path, monkeypatch):
+    monkeypatch.setattr(clients, "TRANSPORT", None)
+    pool = clients.ModelPool()
+    monkeypatch.setattr(core, "model_pool", pool)
+    kb, prompt = tmp_path / "kb.json", tmp_path / "prompt.md"
+    kb.write_text('{"protocols": []}')
+    prompt.write_text("Old prompt")
+    manager = core.ContentManager(kb_path=str(kb), prompt_path=str(prompt), poll_seconds=-1,
+                                  on_publish=core._retire_stale_models)
+    monkeypatch.setattr(core.shard_router, "fallback", manager)
+
+    stale = pool.get(KEY, system_instruction=manager.snapshot.system_prompt)
+    prompt.write_text("New prompt")
+    assert manager.reload()
+    assert pool.get(KEY, system_instruction="Old prompt") is not stale
+    assert pool.stats()["models"] == 1
@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+import content
+import core
+
+BURNS = {"id": "burns", "title": "Burns", "keywords": ["burn", "scald"],
+         "steps": ["Cool the burn under running water for 20 minutes"]}
+SNAKE_BITE = {"id": "snake_bite", "title": "Snake bite", "keywords": ["snake bite", "snakebite"],
+              "steps": ["Keep the bitten limb still and below heart level"]}
+
+
+@pytest.fixture
+def files(tmp_path):
+    kb, prompt = tmp_path / "knowledge_base.json", tmp_path / "system_prompt.md"
+    kb.write_text(json.dumps({"protocols": [BURNS]}))
+    prompt.write_text("You are a first aid assistant.")
+    return kb, prompt
+
+
+@pytest.fixture
+def manager(files):
+    kb, prompt = files
+    # poll_seconds=0: every current() call re-checks the files
+    return content.ContentManager(kb_path=str(kb), prompt_path=str(prompt), poll_seconds=0)
+
+
+def rewrite(path, text):
+    before = os.stat(path).st_mtime_ns
+    path.write_text(text)
+    os.utime(path, ns=(before + 10**9, before + 10**9))  # Coarse filesystem clocks must still see a change
+
+
+def ids(snapshot, query):
+    return [p["id"] for p in core.get_relevant_context(query, snapshot=snapshot)]
+
+
+def test_edited_knowledge_base_is_picked_up(files, manager):
+    kb, _ = files
+    old = manager.current()
+    assert ids(old, "snake bite on the ankle") == []
+
+    rewrite(kb, json.dumps({"protocols": [BURNS, SNAKE_BITE]}))
+    new = manager.current()
+    assert new.version != old.version
+    assert ids(new, "snake bite on the ankle") == ["snake_bite"]
+    assert manager.stats()["reloads"] == 1
+    # Requests that started on the old snapshot keep it
+    assert ids(old, "snake bite on the ankle") == []
+
+
+@pytest.mark.parametrize("broken", [
+    '{"protocols": [',                                   # truncated JSON
+    json.dumps({"protocols": [{"id": "burns"}]}),         # no title or steps
+    json.dumps({"protocols": [BURNS, BURNS]}),            # duplicate id
+])
+def test_broken_edit_keeps_the_previous_snapshot(files, manager, broken):
+    kb, _ = files
+    live = manager.current()
+    rewrite(kb, broken)
+    assert manager.current() is live
+    assert ids(manager.current(), "scald from boiling water") == ["burns"]
+    assert manager.stats()["last_error"]
+
+    # The next good edit is still picked up
+    rewrite(kb, json.dumps({"protocols": [BURNS, SNAKE_BITE]}))
+    assert ids(manager.current(), "snake bite") == ["snake_bite"]
+    assert manager.stats()["last_error"] is None
+
+
+def test_emptied_system_prompt_is_rejected(files, manager):
+    _, prompt = files
+    live = manager.current()
+    rewrite(prompt, "   ")
+    assert manager.current() is live
+    assert live.system_prompt == "You are a first aid assistant."
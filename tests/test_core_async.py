@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+import core
+import offline
+import sessions
+
+
+@pytest.fixture
+def blocking_calls(monkeypatch):
+    """Records the thread every SQLite-backed call runs on."""
+    seen = []
+
+    def record(name, fn):
+        def wrapper(*args, **kwargs):
+            seen.append((name, threading.get_ident()))
+            return fn(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(core, "load_inventory", record("inventory", core.load_inventory))
+    monkeypatch.setattr(core.response_cache, "get", record("cache_get", core.response_cache.get))
+    monkeypatch.setattr(core.response_cache, "set", record("cache_set", core.response_cache.set))
+    monkeypatch.setattr(core.session_store, "history", record("session_read", core.session_store.history))
+    monkeypatch.setattr(core.session_store, "append", record("session_write", core.session_store.append))
+    return seen
+
+
+def run_on_loop(coro_fn):
+    async def main():
+        return threading.get_ident(), await coro_fn()
+    return asyncio.run(main())
+
+
+def test_async_model_path_keeps_sqlite_off_the_event_loop(blocking_calls, monkeypatch):
+    async def fake_generate(api_key, user_query, image, language, patient_metadata, history, matches, snapshot):
+        await asyncio.to_thread(core._assemble_parts, user_query, image, language, patient_metadata, history, matches, snapshot)
+        return "Pinch the nose and lean forward.", matches
+
+    monkeypatch.setattr(offline, "OFFLINE_ANSWERS", False)
+    monkeypatch.setattr(core, "_api_keys_to_try", lambda manual: ["AIzaTestKey"])
+    monkeypatch.setattr(core.key_manager, "acquire", lambda key: blocking_calls.append(("key_acquire", threading.get_ident())) or True)
+    monkeypatch.setattr(core.key_manager, "release", lambda key, **kwargs: blocking_calls.append(("key_release", threading.get_ident())))
+    monkeypatch.setattr(core, "_generate_async", fake_generate)
+
+    session = sessions.new_session_id()
+    loop_thread, result = run_on_loop(lambda: core.generate_response_async(
+        "my student has a nosebleed that started at lunch", session_id=session))
+
+    assert result["response"].startswith("Pinch the nose")
+    names = {name for name, _ in blocking_calls}
+    assert {"inventory", "cache_get", "cache_set", "session_read", "session_write", "key_acquire", "key_release"} <= names
+    assert all(thread != loop_thread for _, thread in blocking_calls)
+
+
+def test_async_local_answer_keeps_sqlite_off_the_event_loop(blocking_calls):
+    loop_thread, result = run_on_loop(lambda: core.generate_response_async("nosebleed"))
+    assert result.get("source") or result.get("cached")
+    assert blocking_calls
+    assert all(thread != loop_thread for _, thread in blocking_calls)
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class _StreamingModel:
+    async def generate_content_async(self, parts, stream=False):
+        async def chunks():
+            for text in ("Pinch the nose ", "and lean forward."):
+                yield _Chunk(text)
+        return chunks()
+
+
+def test_async_stream_keeps_sqlite_off_the_event_loop(blocking_calls, monkeypatch):
+    monkeypatch.setattr(offline, "OFFLINE_ANSWERS", False)
+    monkeypatch.setattr(core, "_api_keys_to_try", lambda manual: ["AIzaTestKey"])
+    monkeypatch.setattr(core.key_manager, "acquire", lambda key: blocking_calls.append(("key_acquire", threading.get_ident())) or True)
+    monkeypatch.setattr(core.key_manager, "release", lambda key, **kwargs: blocking_calls.append(("key_release", threading.get_ident())))
+    monkeypatch.setattr(core, "_model_for_key", lambda *args, **kwargs: _StreamingModel())
+    monkeypatch.setattr(core.inflight, "leave", lambda *args: blocking_calls.append(("inflight_leave", threading.get_ident())))
+
+    async def collect():
+        return [event async for event in core.generate_response_stream_async(
+            "my student has a nosebleed that started after assembly", session_id=sessions.new_session_id())]
+
+    loop_thread, events = run_on_loop(collect)
+
+    assert [e["type"] for e in events] == ["meta", "token", "token", "done"]
+    assert events[-1]["response"].startswith("Pinch the nose and lean forward")
+    names = {name for name, _ in blocking_calls}
+    assert {"inventory", "cache_set", "session_read", "session_write", "key_acquire", "key_release", "inflight_leave"} <= names
+    assert all(thread != loop_thread for _, thread in blocking_calls)
+
+
+def test_sync_stream_answers_through_lookup(monkeypatch):
+    calls = []
+    lookup = core._lookup
+    monkeypatch.setattr(core, "_lookup", lambda *args: calls.append(args) or lookup(*args))
+
+    events = list(core.generate_response_stream("nosebleed"))
+
+    assert calls
+    assert [e["type"] for e in events] == ["meta", "token", "done"]
+    assert events[-1].get("source") == "local" or events[-1].get("cached")
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import embeddings
+from conftest import ROOT
+
+
+@pytest.fixture(scope="module")
+def protocols():
+    with open(os.path.join(ROOT, 'first_aid_ai', 'knowledge_base.json'), encoding='utf-8') as f:
+        return json.load(f)['protocols']
+
+
+@pytest.fixture
+def index(protocols, tmp_path):
+    return embeddings.SemanticIndex(protocols, cache_dir=str(tmp_path))
+
+
+@pytest.mark.parametrize("query", ["hello there", "can you help me", "good morning", "thanks",
+                                   "I need help with homework", "what time is lunch"])
+def test_small_talk_matches_nothing(index, query):
+    assert index.search(query) == []
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("nose is bleeding", "nosebleed"),
+    ("burned hand on hot pan", "burns"),
+    ("child is choking", "choking"),
+    ("not breathing", "cpr"),
+    ("broken arm", "fracture"),
+])
+def test_injury_questions_match(index, query, expected):
+    assert index.search(query)[0][1]['id'] == expected
+
+
+def test_cache_is_reused_and_rebuilt_incrementally(protocols, tmp_path):
+    first = embeddings.SemanticIndex(protocols, cache_dir=str(tmp_path))
+    assert first.rebuilt_rows == len(protocols)
+    assert embeddings.SemanticIndex(protocols, cache_dir=str(tmp_path)).rebuilt_rows == 0
+
+    changed = [dict(protocols[0], title=protocols[0]['title'] + " (updated)")] + protocols[1:]
+    assert embeddings.SemanticIndex(changed, cache_dir=str(tmp_path)).rebuilt_rows == 1
+    # The old version's matrix is gone and the manifest names the new one
+    matrices = [n for n in os.listdir(tmp_path) if n.endswith(".f32")]
+    with open(tmp_path / embeddings.MANIFEST_FILE) as f:
+        assert matrices == [embeddings.MATRIX_FILE.format(version=json.load(f)["version"])]
+
+
+def test_manifest_without_its_matrix_is_rebuilt(protocols, tmp_path):
+    embeddings.SemanticIndex(protocols, cache_dir=str(tmp_path))
+    for name in os.listdir(tmp_path):
+        if name.endswith(".f32"):
+            with open(tmp_path / name, "r+b") as f:
+                f.truncate(16)  # a torn write from another process
+    rebuilt = embeddings.SemanticIndex(protocols, cache_dir=str(tmp_path))
+    assert rebuilt.rebuilt_rows == len(protocols)
+    assert rebuilt.search("nose is bleeding")[0][1]['id'] == "nosebleed"
@@ -0,0 +1,42 @@
+import io
+
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image, ImageDraw
+
+import core
+import imaging
+
+
+def photo(mark=None):
+    image = Image.new("RGB", (640, 480))
+    draw = ImageDraw.Draw(image)
+    for x in range(640):
+        draw.line([(x, 0), (x, 479)], fill=(x * 255 // 639, 90, 60))
+    if mark:
+        draw.rectangle(mark, fill=(200, 0, 0))  # a small wound the perceptual hash can't see
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_preprocess_shrinks_and_hashes():
+    prepared = imaging.preprocess(photo(), max_edge=320)
+    assert max(prepared.size) == 320
+    assert prepared.blob()["data"] == prepared.data
+    assert len(prepared.digest) == 64 and len(prepared.phash) == 16
+
+
+def test_response_cache_key_uses_exact_digest():
+    plain, marked = imaging.preprocess(photo()), imaging.preprocess(photo(mark=(300, 200, 330, 230)))
+    assert plain.phash == marked.phash
+    assert plain.digest != marked.digest
+
+    snapshot = core.route_content()
+    key = lambda image: core._response_cache_key("what is this", image, "English", None, [], [], snapshot)
+    assert key(plain) != key(marked)
+    assert key(plain) == key(imaging.preprocess(photo()))
+    # The vision keyword cache still treats them as the same photo
+    core._store_vision_keywords(plain, "abrasion, knee")
+    assert core._cached_vision_keywords(marked) == "abrasion, knee"
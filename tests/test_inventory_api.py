@@ -0,0 +1,51 @@
+import pytest
+
+import app as app_module
+import core
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def current_etag(client):
+    return client.get('/api/inventory').headers['ETag']
+
+
+def test_add_with_current_etag(client):
+    response = client.post('/api/inventory/items', json={"name": "Ice pack", "kind": "equipment"},
+                           headers={'If-Match': current_etag(client)})
+    assert response.status_code == 201
+    assert response.headers['ETag'] == f'"{core.inventory_store.etag()}"'
+
+
+def test_stale_etag_is_a_conflict(client):
+    stale = current_etag(client)
+    client.post('/api/inventory/items', json={"name": "Plasters"})
+    response = client.post('/api/inventory/items', json={"name": "Gauze"}, headers={'If-Match': stale})
+    assert response.status_code == 412
+
+
+@pytest.mark.parametrize("if_match", ['"inv-abc"', '"v7"', '"inv-"'])
+def test_malformed_if_match_is_refused_not_a_server_error(client, if_match):
+    version = core.inventory_store.version()
+    for response in (
+        client.post('/api/inventory/items', json={"name": "Gauze"}, headers={'If-Match': if_match}),
+        client.post('/api/inventory', json={"medicines": []}, headers={'If-Match': if_match}),
+        client.delete('/api/inventory/items/1', headers={'If-Match': if_match}),
+    ):
+        assert response.status_code == 412
+    assert core.inventory_store.version() == version
+
+
+def test_wildcard_if_match_is_unconditional(client):
+    response = client.post('/api/inventory/items', json={"name": "Tweezers", "kind": "equipment"},
+                           headers={'If-Match': '*'})
+    assert response.status_code == 201
+
+
+def test_store_treats_malformed_version_as_conflict():
+    from inventory_store import VersionConflict
+    with pytest.raises(VersionConflict):
+        core.inventory_store.add("Gauze", expected_version="abc")
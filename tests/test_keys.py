@@ -0,0 +1,78 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+import keys
+from conftest import ROOT
+
+KEY_A, KEY_B = "AIzaTestKeyA", "AIzaTestKeyB"
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "keys.db")
+
+
+def in_flight(manager):
+    return {row["key_id"]: row["in_flight"] for row in manager.stats()}
+
+
+def test_least_loaded_key_is_preferred(state_path):
+    manager = keys.KeyManager(keys=[KEY_A, KEY_B], state_path=state_path)
+    assert manager.acquire(KEY_A)
+    assert manager.candidates(limit=2) == [KEY_B, KEY_A]
+    assert in_flight(manager) == {keys.key_id(KEY_A): 1, keys.key_id(KEY_B): 0}
+    manager.release(KEY_A)
+    assert in_flight(manager) == {keys.key_id(KEY_A): 0, keys.key_id(KEY_B): 0}
+
+
+def test_stats_rows_are_distinguishable(state_path):
+    manager = keys.KeyManager(keys=[KEY_A, KEY_B], state_path=state_path)
+    assert sorted(row["key"] for row in manager.stats()) == ["...KeyA", "...KeyB"]
+
+
+def test_in_flight_is_shared_between_workers(state_path):
+    first = keys.KeyManager(keys=[KEY_A], state_path=state_path)
+    second = keys.KeyManager(keys=[KEY_A], state_path=state_path)
+    first.acquire(KEY_A)
+    second.acquire(KEY_A)
+    assert in_flight(first)[keys.key_id(KEY_A)] == 2
+    second.release(KEY_A)
+    assert in_flight(first)[keys.key_id(KEY_A)] == 1
+
+
+def test_leases_of_a_dead_worker_are_reaped(state_path):
+    # A worker takes a key and is killed before it can release it
+    child = (f"import sys; sys.path.insert(0, {ROOT + '/first_aid_ai'!r}); import keys, os; "
+             f"keys.KeyManager(keys=[{KEY_A!r}], state_path={state_path!r}).acquire({KEY_A!r}); os._exit(1)")
+    subprocess.run([sys.executable, "-c", child], check=False, timeout=60)
+
+    manager = keys.KeyManager(keys=[KEY_A], state_path=state_path)
+    assert in_flight(manager)[keys.key_id(KEY_A)] == 1
+    manager.acquire(KEY_A)  # the next write notices the owner is gone
+    assert in_flight(manager)[keys.key_id(KEY_A)] == 1
+    manager.release(KEY_A)
+    assert in_flight(manager)[keys.key_id(KEY_A)] == 0
+
+
+def test_leases_expire(state_path, monkeypatch):
+    monkeypatch.setattr(keys, "KEY_LEASE_SECONDS", 0.05)
+    manager = keys.KeyManager(keys=[KEY_A], state_path=state_path)
+    manager.acquire(KEY_A)
+    assert in_flight(manager)[keys.key_id(KEY_A)] == 1
+    time.sleep(0.1)
+    assert in_flight(manager)[keys.key_id(KEY_A)] == 0
+
+
+class _BrokenConnection:
+    def execute(self, *args, **kwargs):
+        raise RuntimeError("database is locked")
+
+
+def test_acquire_keeps_to_a_local_limit_when_shared_state_fails(state_path, monkeypatch):
+    monkeypatch.setattr(keys, "KEY_BURST", 2)
+    manager = keys.KeyManager(keys=[KEY_A], state_path=state_path)
+    manager._conn = _BrokenConnection()
+    assert [manager.acquire(KEY_A) for _ in range(3)] == [True, True, False]
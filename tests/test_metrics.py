@@ -0,0 +1,65 @@
+import metrics
+
+
+def rendered(registry):
+    return registry.render().splitlines()
+
+
+def test_counter_renders_help_type_and_labelled_samples():
+    registry = metrics.Registry(prefix="t_")
+    hits = registry.counter("cache_hits_total", "Cache hits")
+    hits.inc(tier="memory")
+    hits.inc(2, tier="memory")
+    hits.inc(tier="sqlite")
+    assert rendered(registry) == [
+        "# HELP t_cache_hits_total Cache hits",
+        "# TYPE t_cache_hits_total counter",
+        't_cache_hits_total{tier="memory"} 3',
+        't_cache_hits_total{tier="sqlite"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry(prefix="t_")
+    latency = registry.histogram("stage_seconds", "Stage latency", buckets=(0.1, 1.0, 10.0))
+    for value in (0.05, 0.5, 0.5, 5.0, 50.0):
+        latency.observe(value, stage="generation")
+    assert rendered(registry)[2:] == [
+        't_stage_seconds_bucket{stage="generation",le="0.1"} 1',
+        't_stage_seconds_bucket{stage="generation",le="1.0"} 3',
+        't_stage_seconds_bucket{stage="generation",le="10.0"} 4',
+        't_stage_seconds_bucket{stage="generation",le="+Inf"} 5',
+        't_stage_seconds_sum{stage="generation"} 56.05',
+        't_stage_seconds_count{stage="generation"} 5',
+    ]
+
+
+def test_collector_families_are_rendered_at_scrape_time():
+    registry = metrics.Registry(prefix="t_")
+    state = {"models": 1}
+    registry.register_collector(lambda: {
+        "pool_models": ("gauge", "Pooled models", {(): state["models"]}),
+        "key_tokens": ("gauge", "Tokens left", {(("key", "...KeyA"),): 4.5}),
+    })
+    state["models"] = 3
+    assert rendered(registry) == [
+        "# HELP t_pool_models Pooled models",
+        "# TYPE t_pool_models gauge",
+        "t_pool_models 3",
+        "# HELP t_key_tokens Tokens left",
+        "# TYPE t_key_tokens gauge",
+        't_key_tokens{key="...KeyA"} 4.5',
+    ]
+
+
+def test_failing_collector_does_not_break_the_scrape():
+    registry = metrics.Registry(prefix="t_")
+    registry.counter("requests_total", "Requests").inc()
+    registry.register_collector(lambda: 1 / 0)
+    assert rendered(registry)[-1] == "t_requests_total 1"
+
+
+def test_label_values_are_escaped():
+    registry = metrics.Registry(prefix="t_")
+    registry.counter("errors_total").inc(reason='bad "key" \\ retry\nlater')
+    assert rendered(registry)[-1] == 't_errors_total{reason="bad \\"key\\" \\\\ retry\\nlater"} 1'
@@ -0,0 +1,68 @@
+import pytest
+
+import offline
+from content import ContentManager
+
+INVENTORY = {"version": None, "items": []}
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return ContentManager().current()
+
+
+@pytest.fixture
+def responder():
+    return offline.OfflineResponder()
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("nosebleed", "nosebleed"),
+    ("burned her hand on a hot pan", "burns"),
+])
+def test_confident_routine_match_is_answered_locally(responder, snapshot, query, expected):
+    assert responder.answer(query, snapshot, INVENTORY)["protocol"] == expected
+
+
+@pytest.mark.parametrize("query", [
+    "bee sting and now face swelling and trouble breathing",  # red flag of the matched protocol
+    "hit head, now vomiting and confused",
+    "bee sting on the arm",  # insect bites can escalate to 112
+])
+def test_critical_and_urgent_questions_go_to_the_model(responder, snapshot, query):
+    assert responder.answer(query, snapshot, INVENTORY) is None
+    assert responder.answer(query, snapshot, INVENTORY, degraded=True) is not None
+
+
+@pytest.mark.parametrize("query", [
+    "what should I do after school",
+    "a girl has a sore tummy after lunch",
+    "my student has a fever and a cough",
+])
+def test_fallback_needs_a_keyword_or_title(responder, snapshot, query):
+    assert responder.answer(query, snapshot, INVENTORY, degraded=True) is None
+
+
+class _Snapshot:
+    def __init__(self, base, metadata):
+        self.knowledge_base = dict(base.knowledge_base, metadata=metadata)
+        self.protocol_index = base.protocol_index
+
+
+def test_degraded_answer_in_another_language_is_labelled(responder, snapshot):
+    result = responder.answer("nosebleed", snapshot, INVENTORY, language="Hindi", degraded=True)
+    assert result["language"] == "English"
+    assert "shown in English" in result["response"].splitlines()[0]
+    assert "language" in responder.answer("nosebleed", snapshot, INVENTORY, degraded=True)
+    assert "shown in" not in responder.answer("nosebleed", snapshot, INVENTORY, degraded=True)["response"]
+
+
+def test_translated_knowledge_base_renders_its_own_labels(responder, snapshot):
+    hindi = _Snapshot(snapshot, {"language": "Hindi", "labels": {
+        "degraded_notice": "⚠️ एआई सहायक अभी उपलब्ध नहीं है।",
+        "red_flags": "112 पर कॉल करें अगर:",
+    }})
+    result = responder.answer("nosebleed", hindi, INVENTORY, language="Hindi", degraded=True)
+    assert result["language"] == "Hindi"
+    assert result["response"].startswith("⚠️ एआई सहायक अभी उपलब्ध नहीं है।\n")
+    assert "**112 पर कॉल करें अगर:**" in result["response"]
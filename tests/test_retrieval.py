@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+
+from conftest import ROOT
+from retrieval import ProtocolIndex, tokenize
+
+
+@pytest.fixture(scope="module")
+def index():
+    with open(os.path.join(ROOT, 'first_aid_ai', 'knowledge_base.json'), encoding='utf-8') as f:
+        return ProtocolIndex(json.load(f)['protocols'])
+
+
+def top(index, query):
+    results = index.search(query)
+    return results[0][1]['id'] if results else None
+
+
+def test_tokenize_stems_and_drops_stopwords():
+    assert tokenize("The burns are bleeding") == ["burn", "bleed"]
+    assert tokenize("is it", drop_stopwords=False) == ["is", "it"]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("nosebleed", "nosebleed"),
+    ("my student has a nose bleed", "nosebleed"),
+    ("burned her hand on a hot pan", "burns"),
+    ("bee sting on the arm", "insect_bite"),
+    ("boy is choking on food", "choking"),
+])
+def test_search_ranks_expected_protocol_first(index, query, expected):
+    assert top(index, query) == expected
+
+
+def test_unrelated_query_matches_nothing(index):
+    assert index.search("where is the library") == []
+
+
+@pytest.mark.parametrize("query", [
+    "what should I do after school",
+    "a girl has a sore tummy after lunch",
+    "my student has a fever and a cough",
+])
+def test_step_words_alone_match_nothing(index, query):
+    assert index.search(query) == []
+
+
+def test_red_flag_terms_anchor_a_match(index):
+    assert top(index, "he is vomiting") == "head_injury"
+
+
+def test_top_k_and_descending_scores(index):
+    results = index.search("head injury bleeding", top_k=2)
+    assert len(results) <= 2
+    assert [s for s, _ in results] == sorted((s for s, _ in results), reverse=True)
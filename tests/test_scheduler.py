@@ -0,0 +1,37 @@
+import asyncio
+import threading
+
+import scheduler
+
+
+def test_routine_work_leaves_the_key_reserve():
+    sched = scheduler.Scheduler(key_reserve=2, quota=lambda: 1)
+    assert sched.admit(scheduler.ROUTINE) == scheduler.DEGRADE
+    assert sched.admit(scheduler.ROUTINE, own_key=True) == scheduler.RUN
+    assert sched.admit(scheduler.URGENT) == scheduler.RUN
+
+
+def test_async_admission_reads_the_quota_off_the_event_loop():
+    threads = []
+
+    def quota():
+        threads.append(threading.get_ident())
+        return 1
+
+    sched = scheduler.Scheduler(key_reserve=2, quota=quota)
+
+    async def main():
+        return threading.get_ident(), await sched.admit_async(scheduler.ROUTINE)
+
+    loop_thread, decision = asyncio.run(main())
+    assert decision == scheduler.DEGRADE
+    assert threads and loop_thread not in threads
+
+
+def test_quota_is_read_at_most_once_per_interval():
+    calls = []
+    sched = scheduler.Scheduler(quota=lambda: calls.append(1) or 100)
+    for _ in range(5):
+        assert sched.admit(scheduler.ROUTINE) == scheduler.RUN
+        sched.release()
+    assert len(calls) == 1
@@ -0,0 +1,47 @@
+import pytest
+
+import core
+import sessions
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def test_sessions_are_shared_between_workers(db_path):
+    # Two stores on one file stand in for two gunicorn workers
+    first = sessions.SessionStore(db_path=db_path)
+    second = sessions.SessionStore(db_path=db_path)
+    session_id = sessions.new_session_id()
+
+    first.append(session_id, "my student has a nosebleed", "Pinch the soft part of the nose.")
+    assert [turn["text"] for turn in second.history(session_id)] == [
+        "my student has a nosebleed", "Pinch the soft part of the nose."]
+
+    # The next turn lands on the other worker; the first one picks it up too
+    second.append(session_id, "it is still bleeding", "Keep pressing for 10 more minutes.")
+    assert len(first.history(session_id)) == 4
+
+
+def test_default_db_is_a_shared_temp_file(monkeypatch):
+    monkeypatch.delenv("SESSION_DB", raising=False)
+    assert sessions.default_db_path().endswith("first_aid_sessions.db")
+    monkeypatch.setenv("SESSION_DB", "")
+    assert sessions.default_db_path() is None
+
+
+def test_turns_beyond_keep_are_summarised(db_path):
+    store = sessions.SessionStore(db_path=db_path, keep_turns=4)
+    session_id = sessions.new_session_id()
+    for i in range(5):
+        store.append(session_id, f"question {i}", f"answer {i}")
+    history = store.history(session_id)
+    assert history[0]["role"] == "summary"
+    assert [turn["text"] for turn in history[1:]] == ["question 3", "answer 3", "question 4", "answer 4"]
+
+
+def test_unknown_session_falls_back_to_client_history():
+    history = '[{"role": "user", "text": "bee sting"}]'
+    assert core._load_history(history, sessions.new_session_id()) == [{"role": "user", "text": "bee sting"}]
+    assert core._load_history("[]", sessions.new_session_id()) == []
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import shards
+from content import ContentManager
+
+HINDI_KB = {
+    "metadata": {"version": "hi-1"},
+    "protocols": [
+        {
+            "id": "nosebleed",
+            "title": "नाक से खून बहना",
+            "keywords": ["नकसीर", "नाक से खून"],
+            "steps": ["आगे झुककर बैठें", "नाक के नरम हिस्से को 10 मिनट दबाएँ"],
+            "red_flags": ["20 मिनट बाद भी खून नहीं रुकता -> CALL 112"],
+        },
+        {
+            "id": "burns",
+            "title": "जलना",
+            "keywords": ["जल गया", "जली त्वचा"],
+            "steps": ["ठंडे बहते पानी में 20 मिनट रखें"],
+            "red_flags": ["चेहरे या हाथ पर बड़ा जला हुआ हिस्सा -> CALL 112"],
+        },
+    ],
+}
+
+
+@pytest.fixture
+def router(tmp_path):
+    (tmp_path / "greenvalley").mkdir()
+    with open(tmp_path / "greenvalley" / "hindi.json", "w", encoding="utf-8") as f:
+        json.dump(HINDI_KB, f, ensure_ascii=False)
+    return shards.ShardRouter(ContentManager(), root=str(tmp_path), rescan_seconds=0)
+
+
+def test_routes_to_most_specific_shard(router):
+    assert router.shard_for("greenvalley", "Hindi", 12) == "greenvalley/hindi"
+    assert router.shard_for("greenvalley", "English") is None
+    assert router.shard_for("other", "Hindi") is None
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("बच्चे की नकसीर", "nosebleed"),
+    ("उसकी नाक से खून आ रहा है", "nosebleed"),
+    ("हाथ जल गया", "burns"),
+])
+def test_hindi_shard_search(router, query, expected):
+    snapshot = router.route("greenvalley", "Hindi")
+    results = snapshot.protocol_index.search(query)
+    assert results and results[0][1]["id"] == expected
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import singleflight
+from singleflight import SingleFlight
+
+ANSWER = {"response": "Pinch the soft part of the nose."}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "singleflight.db")
+
+
+def in_thread(fn):
+    """Starts fn in a thread; the returned getter joins it and returns fn's result."""
+    box = {}
+    thread = threading.Thread(target=lambda: box.setdefault("value", fn()))
+    thread.start()
+    return lambda: (thread.join(10), box["value"])[1]
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_follower_gets_the_leaders_answer():
+    flight = SingleFlight(shared=False)
+    release, calls = threading.Event(), []
+
+    def answer():
+        calls.append(1)
+        release.wait(5)
+        return ANSWER
+
+    leader = in_thread(lambda: flight.run("q", answer))
+    wait_until(lambda: calls)
+    follower = in_thread(lambda: flight.run("q", answer))
+    wait_until(lambda: flight.stats()["in_flight"] == 1)
+    release.set()
+    assert leader() == (ANSWER, False)
+    assert follower() == (ANSWER, True)
+    assert len(calls) == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_failed_leader_is_not_shared():
+    flight = SingleFlight(shared=False)
+    role, call = flight.enter("q")
+    assert role == "leader"
+    follower = in_thread(lambda: flight.enter("q"))
+    time.sleep(0.1)
+    flight.leave("q", call, {"error": "quota"})
+    assert follower() == ("solo", None)
+
+
+def test_sync_follower_gives_up_after_its_own_timeout():
+    flight = SingleFlight(shared=False, wait_timeout=30, sync_wait_timeout=0.1)
+    assert flight.enter("q")[0] == "leader"
+    started = time.time()
+    assert flight.enter("q") == ("solo", None)
+    assert time.time() - started < 5
+    assert flight.stats()["solo"] == 1
+
+
+def test_sync_wait_never_exceeds_the_lease():
+    assert SingleFlight(shared=False, wait_timeout=2, sync_wait_timeout=60).sync_wait_timeout == 2
+
+
+def test_async_follower_waits_for_the_full_timeout():
+    flight = SingleFlight(shared=False, wait_timeout=5, sync_wait_timeout=0.01)
+
+    async def main():
+        role, call = await flight.enter_async("q")
+        follower = asyncio.ensure_future(flight.enter_async("q"))
+        await asyncio.sleep(0.1)  # well past the sync timeout
+        flight.leave("q", call, ANSWER)
+        return role, await follower
+
+    assert asyncio.run(main()) == ("leader", ("shared", ANSWER))
+
+
+def test_result_is_handed_to_another_worker(db_path):
+    first, second = SingleFlight(db_path), SingleFlight(db_path)
+    role, call = first.enter("q")
+    assert role == "leader"
+    follower = in_thread(lambda: second.enter("q"))
+    time.sleep(0.1)
+    first.leave("q", call, ANSWER)
+    assert follower() == ("shared", ANSWER)
+    assert second.stats()["shared_remote"] == 1
+
+
+def test_crashed_leader_is_taken_over_once_its_lease_expires(db_path):
+    crashed = SingleFlight(db_path, wait_timeout=0.3)
+    assert crashed.enter("q")[0] == "leader"  # ...and never calls leave()
+
+    survivor = SingleFlight(db_path, wait_timeout=30, sync_wait_timeout=30)
+    started = time.time()
+    role, call = survivor.enter("q")
+    assert role == "leader"
+    assert time.time() - started < 5
+    survivor.leave("q", call, ANSWER)
+
+    # The survivor owns the lease now, so its answer is published for other workers
+    assert singleflight.SharedLeases(db_path).wait("q", 0.1) == ANSWER
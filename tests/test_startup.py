@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import app as app_module
+import cache
+import core
+import keys
+import sessions
+
+KEY = "AIzaTestForkKey"
+SESSION = "fork-test-session"
+
+
+@pytest.fixture
+def components(tmp_path):
+    response_cache = cache.ResponseCache(db_path=str(tmp_path / "cache.db"))
+    key_manager = keys.KeyManager(keys=[KEY], state_path=str(tmp_path / "keys.db"))
+    session_store = sessions.SessionStore(db_path=str(tmp_path / "sessions.db"))
+    # Open each connection, as a preloading master would while warming up
+    response_cache.set("q", {"response": "cached"})
+    session_store.append(SESSION, "nosebleed", "Pinch the nose.")
+    assert key_manager.acquire(KEY)
+    key_manager.release(KEY)
+    return response_cache, key_manager, session_store
+
+
+def connections(response_cache, key_manager, session_store):
+    return response_cache._db(), key_manager._conn, session_store._db()
+
+
+def test_after_fork_drops_inherited_connections(components):
+    response_cache, key_manager, session_store = components
+    inherited = connections(*components)
+    for component in components:
+        component.after_fork()
+    # Key state reconnects eagerly, the others on first use
+    assert key_manager._conn is not inherited[1]
+    assert response_cache._db() is not inherited[0]
+    assert session_store._db() is not inherited[2]
+    assert key_manager.owner == str(os.getpid())
+
+    # Everything still reads what the "master" wrote
+    response_cache._entries.clear()
+    session_store._sessions.clear()
+    assert response_cache.get("q") == {"response": "cached"}
+    assert session_store.history(SESSION)
+    assert key_manager.acquire(KEY)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_forked_worker_uses_its_own_connections(components):
+    response_cache, key_manager, session_store = components
+    inherited = connections(*components)
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            for component in components:
+                component.after_fork()
+            ok = (all(new is not old for new, old in zip(connections(*components), inherited))
+                  and key_manager.owner == str(os.getpid()) and key_manager.acquire(KEY))
+            response_cache._entries.clear()
+            ok = ok and response_cache.get("q") == {"response": "cached"}
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    # The master's own connections are untouched
+    assert connections(*components) == inherited
+    assert response_cache.get("q") == {"response": "cached"}
+
+
+@pytest.fixture
+def cold(monkeypatch):
+    monkeypatch.setattr(core, "WARM_UP", "background")
+    monkeypatch.setattr(core, "_readiness", {"ready": False, "state": "cold", "steps_ms": {}, "took_ms": None,
+                                             "error": None, "warmed_by": None})
+    monkeypatch.setattr(core, "_warm_steps", lambda: [("knowledge_base", core.content.current)])
+
+
+def test_ready_is_503_until_warmed_up(cold):
+    client = app_module.app.test_client()
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert response.get_json()["state"] == "cold"
+
+    core.warm_up()
+    response = client.get('/ready')
+    assert response.status_code == 200
+    state = response.get_json()
+    assert state["ready"] and state["state"] == "ready"
+    assert set(state["steps_ms"]) == {"knowledge_base"}
+    assert state["content_version"] == core.content.current().version
+    assert not state["preloaded"]
+
+
+def test_warm_up_off_is_always_ready(cold, monkeypatch):
+    monkeypatch.setattr(core, "WARM_UP", "off")
+    assert app_module.app.test_client().get('/ready').status_code == 200
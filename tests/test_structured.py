@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import structured
+
+FULL = {"answer": "Pinch the soft part of the nose.", "spot_id": 3,
+        "procedure": ["Sit up, lean forward", "Pinch for 10 minutes"], "search": ["Gauze", "Ice pack"]}
+NO_FIELDS = {"spot_id": None, "procedure": [], "search": [], "image_keywords": []}
+
+
+def fields(**overrides):
+    return dict(NO_FIELDS, **overrides)
+
+
+FULL_FIELDS = fields(spot_id=3, procedure=["Sit up, lean forward", "Pinch for 10 minutes"], search=["Gauze", "Ice pack"])
+
+
+@pytest.mark.parametrize("text, prose, expected, repairs", [
+    # Well-formed JSON, as the schema asks for
+    (json.dumps(FULL), FULL["answer"], FULL_FIELDS, []),
+    # Wrapped in code fences
+    ("```json\n" + json.dumps(FULL) + "\n```", FULL["answer"], FULL_FIELDS, ["fence"]),
+    ("```\n" + json.dumps(FULL) + "\n```", FULL["answer"], FULL_FIELDS, ["fence"]),
+    # Cut off inside an array item, then inside the object
+    (json.dumps(FULL)[:json.dumps(FULL).index("Ice") + 2], FULL["answer"],
+     dict(FULL_FIELDS, search=["Gauze", "Ic"]), ["truncated"]),
+    ('{"answer": "Pinch the nose.", "spot_id": 3, "procedure": ["Sit up"]', "Pinch the nose.",
+     fields(spot_id=3, procedure=["Sit up"]), ["truncated"]),
+    ('{"answer": "Pinch the no', "Pinch the no", fields(), ["truncated"]),
+    # Trailing commas
+    ('{"answer": "Rest.", "procedure": ["Sit",], "search": [],}', "Rest.", fields(procedure=["Sit"]), ["trailing_comma"]),
+    # Unknown keys are ignored, a missing answer falls back to the steps
+    (json.dumps(dict(FULL, mood="calm")), FULL["answer"], FULL_FIELDS, []),
+    (json.dumps({"procedure": ["Sit up", "Pinch"]}), "1. Sit up\n2. Pinch", fields(procedure=["Sit up", "Pinch"]), ["answer"]),
+    # Out-of-range spot
+    (json.dumps(dict(FULL, spot_id=99)), FULL["answer"], dict(FULL_FIELDS, spot_id=None), ["spot_id"]),
+])
+def test_json_output_is_parsed_or_repaired(text, prose, expected, repairs):
+    assert structured.parse(text) == (prose, expected, repairs)
+
+
+@pytest.mark.parametrize("text, prose, expected, repairs", [
+    ("Pinch the nose.\n[SPOT_ID: 3]\n[PROCEDURE: Sit up, Pinch]\n[SEARCH: Gauze]", "Pinch the nose.",
+     fields(spot_id=3, procedure=["Sit up", "Pinch"], search=["Gauze"]), []),
+    ("Pinch the nose.\n[SPOT_ID: 3]\n[PROCEDURE: Sit up, Pin", "Pinch the nose.",
+     fields(spot_id=3, procedure=["Sit up", "Pin"]), ["truncated"]),
+    ("Looks like a graze.\n[KEYWORDS: graze, knee]", "Looks like a graze.", fields(image_keywords=["graze", "knee"]), []),
+])
+def test_trailer_format_is_parsed(text, prose, expected, repairs):
+    assert structured.parse(text) == (prose, expected, repairs)
+
+
+@pytest.mark.parametrize("text", ["Just sit down and rest.", "", None, "[1, 2]"])
+def test_plain_text_passes_through(text):
+    assert structured.parse(text) == (text or "", fields(), [])
+
+
+@pytest.mark.parametrize("text, prose", [
+    ('{"answer": "Pinch the nose" "spot_id" 3 ]]', "Pinch the nose"),
+    ('{"answer": "Line one\\nLine two", ]]] oops', "Line one\nLine two"),
+    ("{not json at all", "{not json at all"),
+])
+def test_hopeless_json_falls_back_to_readable_text(text, prose):
+    parsed_prose, parsed, repairs = structured.parse(text)
+    assert parsed_prose == prose
+    assert parsed == fields()
+    assert "unparsed_json" in repairs
+
+
+def test_long_lists_are_clipped():
+    steps = [f"Step {i}" for i in range(structured.MAX_STEPS + 3)]
+    prose, parsed, repairs = structured.parse(json.dumps({"answer": "Do this.", "procedure": steps, "search": []}))
+    assert parsed["procedure"] == steps[:structured.MAX_STEPS]
+    assert repairs == ["clipped"]
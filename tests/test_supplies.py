@@ -0,0 +1,96 @@
+import pytest
+
+import supplies
+from supplies import SupplyIndex
+
+BURN = {"id": "burns", "steps": ["Cool under running water", "Cover loosely with cling film"]}
+CUT = {"id": "cuts", "steps": ["Press with gauze", "Clean with antiseptic", "Apply a plaster"]}
+SPRAIN = {"id": "sprain", "steps": ["Apply an ice pack wrapped in cloth"]}
+
+
+def _index(*names):
+    return SupplyIndex({"version": None, "items": [{"name": n, "quantity": 1} for n in names]})
+
+
+def test_brand_and_synonym_names_map_to_supplies():
+    index = _index("Dettol liquid", "Cotton roll", "Hansaplast")
+    result = index.cross_reference([CUT])
+    assert [i["name"] for i in result["have"]] == ["Dettol liquid", "Cotton roll", "Hansaplast"]
+    assert result["missing"] == []
+
+
+def test_unmapped_and_misspelt_items_stand_in_for_a_supply():
+    assert supplies.could_cover("Ice") == ["Cold compress / ice pack"]
+    assert supplies.could_cover("Guaze") == ["Gauze"]
+    result = _index("Ice", "Guaze").cross_reference([SPRAIN, CUT])
+    assert [i["name"] for i in result["have"]] == ["Ice", "Guaze"]
+    assert "Gauze" not in result["missing"]
+
+
+def test_generic_words_do_not_cover_supplies():
+    assert supplies.could_cover("First aid kit") == []
+    assert supplies.could_cover("Eye drops") == []
+    assert _index("First aid kit").cross_reference([BURN])["missing"] == ["Cling film"]
+
+
+def test_item_for_prefers_a_named_match_over_a_substitute():
+    index = _index("Ice", "Instant cold pack")
+    assert index.item_for("ice pack")["name"] == "Instant cold pack"
+
+
+@pytest.mark.parametrize("name", ["Salt", "Plasticine", "Latex balloon", "Inhaler spacer", "Baby wipes"])
+def test_lookalike_items_cover_nothing(name):
+    assert supplies.could_cover(name) == []
+    index = _index(name)
+    assert index.stock == {} and index.substitutes == {}
+
+
+def test_qualified_brand_names_still_map():
+    index = _index("Salbutamol inhaler", "Crocin 500mg tablets", "ORS sachets")
+    assert set(index.stock) == {"Reliever inhaler", "Paracetamol", "ORS"}
+
+
+@pytest.mark.parametrize("name, expected", [
+    # Generic names, synonyms and brands
+    ("Dettol antiseptic liquid", "Antiseptic wipes"),
+    ("Betadine ointment", "Antiseptic wipes"),
+    ("Rubbing alcohol", "Antiseptic wipes"),
+    ("Isopropyl alcohol 70%", "Antiseptic wipes"),
+    ("Cotton wool roll", "Gauze"),
+    ("Band-Aid", "Adhesive plasters"),
+    ("Hansaplast strips", "Adhesive plasters"),
+    ("Melolin dressing", "Sterile dressing"),
+    ("Instant cold pack", "Cold compress / ice pack"),
+    ("Cling wrap", "Cling film"),
+    ("Triangular bandage", "Sling / splint"),
+    ("Crepe bandage 10cm", "Sling / splint"),
+    ("EpiPen Jr", "Adrenaline auto-injector (EpiPen)"),
+    ("Dettol handwash", "Soap"),
+    ("Nitrile gloves (M)", "Gloves"),
+    ("Calpol syrup", "Paracetamol"),
+    ("Dolo 650", "Paracetamol"),
+    ("Cetirizine 10mg", "Antihistamine"),
+    ("Electral ORS sachets", "ORS"),
+    ("Asthalin inhaler", "Reliever inhaler"),
+    # Stand-ins and misspellings
+    ("Ice cubes", "Cold compress / ice pack"),
+    ("Guaze swabs", "Gauze"),
+    ("Antiseptik cream", "Antiseptic wipes"),
+    # Generic names and lookalikes
+    ("First aid kit", None),
+    ("Eye drops", None),
+    ("Baby wipes", None),
+    ("Bandage", None),  # a plaster or a sling: names neither
+    ("Sterile water", None),
+    ("Cotton buds", None),
+    ("Plaster of paris", None),
+    ("Spirit level", None),
+    ("Latex balloon", None),
+    ("Inhaler spacer", None),
+    ("Scissors", None),
+])
+def test_item_names_map_to_supplies(name, expected):
+    assert supplies.concept_for(name) == expected
+    index = _index(name)
+    provides = [label for label, items in {**index.stock, **index.substitutes}.items() if items]
+    assert provides == ([expected] if expected else [])